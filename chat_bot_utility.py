@@ -1,23 +1,43 @@
 import json
-import re
 import yaml
 from ruamel.yaml import YAML
 import dateutil.parser
 import logging
 import sys
-import multiprocessing
+import time
+import signal
+import calendar
+import argparse
+import datetime
+import threading
+from multiprocessing.pool import ThreadPool
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 from lib.Logger import Logger
 from lib.GenericWrappper import GenericWrappper
-from lib.JiraConnectionWrapper import JiraConnectionWrapper
+from lib.JiraConnectionWrapper import JiraConnectionWrapper, JiraClientManager
 from lib.WebexNotifierWrapper import WebexNotifierWrapper
-from lib.QdnaConnectorWrapper import QdnaConnectorWrapper
-from lib.SshWrapper import SshWrappper
+from lib.QdnaConnectorWrapper import QdnaConnectorWrapper, parse_build_targets
+from lib.SshWrapper import SshWrappper, SshConnectionPool, parse_host_list
 from lib.FileServerWrapper import FileServerWrapper
+from lib.RequestDispatcher import RequestDispatcher, ServedWatermark
+from lib.TtlCache import TtlCache
+from lib.WebhookReceiver import WebhookReceiver
+from lib.CommandRouter import CommandRouter, command
+from lib.JobScheduler import JobScheduler
+from lib.Tracer import Tracer
+from lib.Metrics import Metrics, MetricsServer
+from periodic_bug_notifier import BugNotifierUtility
 
 
 
 class ChatBotUtility:
+    # Seconds, from a message being posted until it is served
+    LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
     def __init__(self):
         """
             Initializes and sets required default global variables by
@@ -30,15 +50,51 @@ class ChatBotUtility:
         self.logger = logging.getLogger('chatbot_logger')
         self.logger.info("Starting default initialization...")
         self.webex_auth_headers = {'content-type': 'application/json'}
+        self.daemon_mode = False
+        self.stop_event = threading.Event()
+        # Set in daemon mode, requests are served sequentially otherwise
+        self.dispatcher = None
+        self.watermark = None
+        self.webhook_receiver = None
+        self.webhook_queue = None
+        self.webhook_thread = None
+        self.scheduler = None
+        self.bug_notifier = None
+        self.dispatch_lock = threading.Lock()
+        self.mappings_lock = threading.Lock()
+        # Command handlers register themselves with the command decorator
+        self.command_router = CommandRouter()
+        self.command_router.register_handlers(self)
+        self.metrics_server = None
+        self.last_poll_time = None
+        self.requests_counter = Metrics.counter("chatbot_requests_total", "Requests served by command", ("command",))
+        self.request_errors_counter = Metrics.counter("chatbot_request_errors_total", "Requests that failed")
+        self.poll_errors_counter = Metrics.counter("chatbot_poll_errors_total", "Poll iterations that failed")
+        self.request_seconds = Metrics.histogram("chatbot_request_duration_seconds",
+                                                 "Time spent serving a request by command", ("command",))
+        self.message_lag_seconds = Metrics.histogram("chatbot_message_lag_seconds",
+                                                     "Time from a message being posted until it is picked up",
+                                                     buckets=self.LATENCY_BUCKETS)
+        self.reply_latency_seconds = Metrics.histogram("chatbot_reply_latency_seconds",
+                                                       "Time from a message being posted until it is served",
+                                                       buckets=self.LATENCY_BUCKETS)
+        Metrics.gauge("chatbot_poll_lag_seconds", "Seconds since the last successful poll",
+                      function=self.get_poll_lag)
         try:
             # Collecting metadata from information.yaml
             with open('information.yaml', 'r') as ifh:
                 self.doc = yaml.safe_load(ifh)
 
+                # Getting general details
+                self.read_time_interval = float(self.doc["general_details"]["chat_bot_read_time_interval"])
+
                 # Getting Webex Teams Room details
                 self.webex_url = str(self.doc["webex_teams_details"]["webex_url"])
                 self.webex_room_id = str(self.doc["webex_teams_details"]["webex_room_id"])
 
+                # Max bytes (UTF-8) per message, longer replies are split
+                self.message_size_limit = int(self.doc["webex_teams_details"].get("message_size_limit", 7000))
+
                 # Getting Webex Teams Bot details
                 self.auth_token = str(self.doc["webex_teams_details"]["auth_token"])
                 self.webex_bot_name = str(self.doc["webex_teams_details"]["webex_bot_name"])
@@ -52,6 +108,12 @@ class ChatBotUtility:
             # list messages api
             self.webex_teams_get_url = self.webex_url + "?mentionedPeople=me" \
                                        + "&roomId=" + self.webex_room_id
+            # Upper limit on the number of message pages read per iteration
+            self.max_poll_pages = int(self.doc["general_details"].get("chat_bot_max_poll_pages", 5))
+            # In webhook mode polls read back this many seconds past the
+            # last served request, picking up messages a webhook callback
+            # missed
+            self.poll_lookback = float(self.doc["general_details"].get("chat_bot_poll_lookback", 600))
 
             self.logger.info("Default initialization complete!!!")
         except Exception as e:
@@ -63,9 +125,12 @@ class ChatBotUtility:
             Initializes and sets other default prerequisites for the
             utility by collecting metadata from information.yaml
         """
+        if getattr(self, 'mappings', None) is not None:
+            # Already initialized, keyword mappings are kept up to date in
+            # memory by edit_keyword_jira_query_mappings
+            return
         self.logger.info("Initializing pre-requisites...")
         self.generic_wrapper = GenericWrappper()
-        self.EDIT_KEYWORDS = ['add', 'delete']
         try:
             # Collecting info from keyword_query_mappings.yaml
             with open('keyword_query_mappings.yaml', 'r') as kfh:
@@ -73,7 +138,7 @@ class ChatBotUtility:
 
                 # Getting jira keyword query mappings
                 self.keyword_jira_query_mappings = self.mappings["keyword_jira_query_mappings"]
-                self.logger.info("Keyword Query mappings -- {}".format(self.keyword_jira_query_mappings))
+                self.logger.info("Keyword Query mappings -- %s", self.keyword_jira_query_mappings)
 
             self.logger.info("Pre-Requisite initialization complete!!!")
         except Exception as e:
@@ -85,23 +150,29 @@ class ChatBotUtility:
             Initializes and sets required prerequisites for jira queries
             by collecting metadata from information.yaml
         """
+        if getattr(self, 'jira_manager', None) is not None:
+            return
         self.logger.info("Initializing pre-requisites for JIRA...")
         self.jira_wrapper = JiraConnectionWrapper()
         try:
-            # Collecting info from information.yaml
-            with open('information.yaml', 'r') as ifh:
-                self.doc = yaml.safe_load(ifh)
-
-                # Getting JIRA server connection details
-                self.jira_user = str(self.doc["jira_details"]["jira_user"])
-                self.jira_password = str(self.doc["jira_details"]["jira_password"])
-                self.jira_server_url = str(self.doc["jira_details"]["jira_server_url"])
-                self.fixed_jira_query = str(self.doc["jira_details"]["fixed_jira_query"])
-
-            # Creating connection to Jira server
-            self.jira_object = self.jira_wrapper.get_jira_server_connection_object(jira_server_url=self.jira_server_url,
-                                                                                   jira_user=self.jira_user,
-                                                                                   jira_password=self.jira_password)
+            # Getting JIRA server connection details
+            self.jira_user = str(self.doc["jira_details"]["jira_user"])
+            self.jira_password = str(self.doc["jira_details"]["jira_password"])
+            self.jira_server_url = str(self.doc["jira_details"]["jira_server_url"])
+            self.fixed_jira_query = str(self.doc["jira_details"]["fixed_jira_query"])
+
+            # Caching jira query results and bug details, repeat requests
+            # within jira_cache_ttl seconds are served from memory
+            cache_ttl = self.doc["jira_details"].get("jira_cache_ttl", 300)
+            cache_size = self.doc["jira_details"].get("jira_cache_size", 128)
+            self.jira_query_cache = TtlCache("Jira query", ttl=cache_ttl, max_size=cache_size)
+            self.bug_details_cache = TtlCache("Bug details", ttl=cache_ttl, max_size=cache_size)
+
+            # Connection to Jira server is created on first use and
+            # reused by the following requests
+            self.jira_manager = JiraClientManager.get_manager(jira_server_url=self.jira_server_url,
+                                                              jira_user=self.jira_user,
+                                                              jira_password=self.jira_password)
 
             self.logger.info("Pre-Requisite initialization for JIRA complete!!!")
         except Exception as e:
@@ -113,19 +184,28 @@ class ChatBotUtility:
             Initializes and sets other required prerequisites for qdna
             queries by collecting metadata from information.yaml
         """
+        if getattr(self, 'qdna_wrapper', None) is not None:
+            return
         self.logger.info("Initializing pre-requisites for QDNA...")
         try:
-            # Collecting info from information.yaml
-            with open('information.yaml', 'r') as ifh:
-                self.doc = yaml.safe_load(ifh)
-
-                # Getting QDNA details
-                self.qdna_cluster_ip = str(self.doc["qdna_details"]["cluster_ip"])
-                self.qdna_username = str(self.doc["qdna_details"]["username"])
-                self.qdna_password = str(self.doc["qdna_details"]["password"])
+            # Getting QDNA details
+            self.qdna_cluster_ip = str(self.doc["qdna_details"]["cluster_ip"])
+            self.qdna_username = str(self.doc["qdna_details"]["username"])
+            self.qdna_password = str(self.doc["qdna_details"]["password"])
+            self.qdna_max_parallel_requests = int(self.doc["qdna_details"].get("max_parallel_requests", 4))
 
             # Creating QDNA connection object
-            self.qdna_wrapper = QdnaConnectorWrapper(self.qdna_cluster_ip, self.qdna_username, self.qdna_password)
+            qdna_details = self.doc["qdna_details"]
+            self.qdna_wrapper = QdnaConnectorWrapper(self.qdna_cluster_ip, self.qdna_username, self.qdna_password,
+                                                     token_lifetime=qdna_details.get("token_lifetime", 3600),
+                                                     token_refresh_margin=qdna_details.get("token_refresh_margin", 300),
+                                                     cache_ttl=qdna_details.get("cache_ttl", 120),
+                                                     cache_size=qdna_details.get("cache_size", 256),
+                                                     completed_status_field=qdna_details.get("completed_status_field",
+                                                                                             "Status"),
+                                                     completed_status_values=qdna_details.get(
+                                                         "completed_status_values",
+                                                         QdnaConnectorWrapper.COMPLETED_STATUS_VALUES))
 
             self.logger.info("Pre-Requisite initialization for QDNA complete!!!")
         except Exception as e:
@@ -138,9 +218,19 @@ class ChatBotUtility:
             troubleshoot queries by collecting metadata from
             commands.yaml
         """
+        if getattr(self, 'ssh_wrapper', None) is not None:
+            return
         self.logger.info("Initializing pre-requisites for troubleshooting...")
         try:
-            self.ssh_wrapper = SshWrappper()
+            general_details = self.doc["general_details"]
+            self.ssh_wrapper = SshWrappper(max_channels=general_details.get("ssh_max_channels", 8),
+                                           command_timeout=general_details.get("ssh_command_timeout", 20),
+                                           pool_max_connections=general_details.get("ssh_pool_max_connections", 16),
+                                           pool_idle_timeout=general_details.get("ssh_pool_idle_timeout", 300),
+                                           pool_acquire_timeout=general_details.get("ssh_pool_acquire_timeout", 30),
+                                           keepalive_interval=general_details.get("ssh_keepalive_interval", 30),
+                                           probe_timeout=general_details.get("probe_timeout", 2),
+                                           probe_icmp=str(general_details.get("probe_icmp", False)).lower() == 'true')
             self.all_commands = {}
             with open('commands.yaml', 'r') as ifh:
                 self.all_commands = yaml.safe_load(ifh)
@@ -149,132 +239,186 @@ class ChatBotUtility:
             self.logger.error("Error -- {}".format(e))
 
 
-    def intialize_fileserver_prerequisites(self, branch):
+    def intialize_fileserver_prerequisites(self):
         """
             Initializes and sets other required prerequisites to access
-            maglev fileserver
-            :param branch: Branch ID
+            maglev fileserver by collecting metadata from information.yaml
         """
+        if getattr(self, 'fileserver_wrapper', None) is not None:
+            return
         self.logger.info("Initializing pre-requisites for fileserver...")
-        self.fileserver_wrapper = FileServerWrapper()
-        self.logger.info("Branch: {}".format(branch))
-        _file_server_url = 'URL'
-        self.get_stable_build_url = _file_server_url + 'stable/{}/'.format(branch)
-        self.get_current_build_url = _file_server_url + 'daily/{}/'.format(branch)
+        fileserver_details = self.doc.get("fileserver_details", {})
+        self.fileserver_wrapper = FileServerWrapper(
+            file_server_url=str(fileserver_details.get("fileserver_url", "URL")),
+            min_refresh_interval=fileserver_details.get("min_refresh_interval", 60),
+            max_parallel_requests=fileserver_details.get("max_parallel_requests", 4))
+        self.fileserver_default_branches = [str(branch) for branch in fileserver_details.get("branches", [])]
 
 
-    def formulate_and_send_message_to_webex_group(self, text_data, metadata, message_time):
+    def formulate_and_send_message_to_webex_group(self, text_data, metadata, message_time, text_key="text"):
         """
             Formulate message and then send it to the webex group
-            :param text_data: text to send
+            :param text_data: text to send, or an iterable of rows
             :param metadata: metadata to update
             :param message_time: message time
+            :param text_key: "text" or "markdown"
         """
         data_to_send = {}
         data_to_send["roomId"] = self.webex_room_id
-        data_to_send["text"] = text_data
-        self.webex_wrapper.send_message_to_webex_group(webex_url=self.webex_url,
-                                                       webex_auth_headers=self.webex_auth_headers,
-                                                       data_to_send=data_to_send)
-        self.generic_wrapper.update_timestamp(metadata, message_time)
+        if hasattr(text_data, "splitlines") or text_data is None:
+            rows = (text_data or "").splitlines(True)
+        else:
+            rows = text_data
+        self.webex_wrapper.send_message_in_chunks(webex_url=self.webex_url,
+                                                  webex_auth_headers=self.webex_auth_headers,
+                                                  data_to_send=data_to_send,
+                                                  rows=rows,
+                                                  text_key=text_key,
+                                                  max_message_size=self.message_size_limit)
+        self.mark_served(metadata, message_time)
         self.logger.info("---***--- Reply sent to the Webex group ---***---")
 
 
     def formulate_and_send_message_to_individual(self, text_data, person_id):
         """
             Formulate message and then send it to the given individual
-            :param text_data: text to send
-            :param metadata: metadata to update
-            :param message_time: message time
+            :param text_data: text to send, or an iterable of rows
             :param person_id: Webex person ID
         """
         data_to_send = {}
         data_to_send["toPersonId"] = person_id
-        data_to_send["markdown"] = text_data
-        self.webex_wrapper.send_message_to_webex_group(webex_url=self.webex_url,
-                                                       webex_auth_headers=self.webex_auth_headers,
-                                                       data_to_send=data_to_send)
+        if hasattr(text_data, "splitlines"):
+            rows = text_data.splitlines(True)
+        else:
+            rows = text_data
+        self.webex_wrapper.send_message_in_chunks(webex_url=self.webex_url,
+                                                  webex_auth_headers=self.webex_auth_headers,
+                                                  data_to_send=data_to_send,
+                                                  rows=rows,
+                                                  max_message_size=self.message_size_limit)
         self.logger.info("---***--- Reply sent to the individual ---***---")
 
 
-    def get_testing_status(self, last_message):
+    @command("get testing status", arguments=r"(?P<targets>[^\d\s]\S*(?:\s+\S+)+)$",
+             converters={"targets": parse_build_targets})
+    def get_testing_status(self, metadata, message_time, person_id, fresh, targets):
+        """
+            Get generic testing status for one or more builds and send it
+            to the webex group, several builds are compared in one table
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+            :param targets: List of (project, build ID) tuples
+        """
+        self.logger.info("User wants testing info about builds: {}".format(targets))
+        self.reply_with_testing_status(targets, False, metadata, message_time, fresh)
+
+
+    @command("get detailed testing status", arguments=r"(?P<targets>[^\d\s]\S*(?:\s+\S+)+)$",
+             converters={"targets": parse_build_targets})
+    def get_detailed_testing_status(self, metadata, message_time, person_id, fresh, targets):
+        """
+            Get detailed testing status for one or more builds and send it
+            to the webex group, several builds are compared in one table
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+            :param targets: List of (project, build ID) tuples
+        """
+        self.logger.info("User wants detailed testing info about builds: {}".format(targets))
+        self.reply_with_testing_status(targets, True, metadata, message_time, fresh)
+
+
+    def reply_with_testing_status(self, targets, detailed, metadata, message_time, fresh=False):
+        """
+            Send the testing status of the given builds to the webex group,
+            a single build gets the full report and several builds get a
+            comparison table fetched concurrently
+            :param targets: List of (project, build ID) tuples
+            :param detailed: Detailed (per component) status
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param fresh: Bypass cached results
+        """
+        if not targets:
+            self.unidentified_keyword(metadata, message_time)
+            return
+        self.intialize_qdna_prerequisites()
+        if len(targets) == 1:
+            project, build_id = targets[0]
+            if detailed:
+                return_text = self.qdna_wrapper.get_detailed_testing_status_from_qdna(project=project,
+                                                                                      build_id=build_id,
+                                                                                      fresh=fresh)
+            else:
+                return_text = self.qdna_wrapper.get_testing_status_from_qdna(project=project, build_id=build_id,
+                                                                             fresh=fresh)
+            self.formulate_and_send_message_to_webex_group(return_text, metadata, message_time)
+            return
+        rows = self.qdna_wrapper.get_testing_status_for_builds(targets, detailed=detailed,
+                                                               max_parallel_requests=self.qdna_max_parallel_requests,
+                                                               fresh=fresh)
+        self.formulate_and_send_message_to_webex_group(rows, metadata, message_time, text_key="markdown")
+
+
+    @command("add keyword", arguments=r"(?P<keyword>[^:]+?)\s*:\s*(?P<jira_query>.+)$")
+    def add_keyword(self, metadata, message_time, person_id, fresh, keyword, jira_query):
         """
-            Get generic testing status for a given build in a project and
-            return text ouput
-            :param last_message: last message
-            :return: build statistics in string format
+            Add a new keyword to jira query mapping
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+            :param keyword: Keyword
+            :param jira_query: Jira query
         """
-        entity = re.split('[: ]', last_message)
-        self.logger.info("Last message tokens: {}".format(entity))
-        project = entity[4]
-        build_id = entity[5]
-        self.logger.info("Project: {}".format(project))
-        self.logger.info("Build ID: {}".format(build_id))
-        return_text = self.qdna_wrapper.get_testing_status_from_qdna(project=project, build_id=build_id)
-        return return_text
+        self.edit_keyword_jira_query_mappings("add", keyword, jira_query, metadata, message_time)
 
 
-    def get_detailed_testing_status(self, last_message):
+    @command("delete keyword", arguments=r"(?P<keyword>[^:]+?)\s*(?::\s*(?P<jira_query>.*))?$")
+    def delete_keyword(self, metadata, message_time, person_id, fresh, keyword, jira_query):
         """
-            Get detailed testing status for a given build in a project and
-            return text ouput
-            :param last_message: last message
-            :return: build statistics in string format
+            Delete an existing keyword to jira query mapping
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+            :param keyword: Keyword
+            :param jira_query: Jira query
         """
-        entity = re.split('[: ]', last_message)
-        self.logger.info("Last message tokens: {}".format(entity))
-        project = entity[5]
-        build_id = entity[6]
-        self.logger.info("Project: {}".format(project))
-        self.logger.info("Build ID: {}".format(build_id))
-        return_text = self.qdna_wrapper.get_detailed_testing_status_from_qdna(project=project,
-                                                                              build_id=build_id)
-        return return_text
+        self.edit_keyword_jira_query_mappings("delete", keyword, jira_query, metadata, message_time)
 
 
-    def edit_keyword_jira_query_mappings(self, last_message, metadata, message_time):
+    def edit_keyword_jira_query_mappings(self, action, keyword, jira_query, metadata, message_time):
         """
             Edit keyword_query_mappings.yaml depending upon user input.
             Add a new keyword or delete existing keyword
-            :param last_message: Last message recieved
+            :param action: "add" or "delete"
+            :param keyword: Keyword
+            :param jira_query: Jira query
             :param metadata: metadata to update
             :param message_time: message time
         """
-        entity = re.split('[>:]', last_message)
-        self.logger.info("Last message tokens: {}".format(entity))
+        self.logger.info("User wants to edit keyword_query_mappings.yaml")
+        self.logger.info("{} -- {} : {}".format(action, keyword, jira_query))
         try:
-            with open('keyword_query_mappings.yaml', 'w') as kfh:
-                # Check if incoming message has "add keyword" in it
-                if "add keyword" in entity[0].lower() and len(entity) == 3:
+            with self.mappings_lock:
+                if action == "add":
                     self.logger.info("Adding keyword to the existing list --")
-                    self.logger.info("{} : {}".format(entity[1].strip(), entity[2].strip()))
-                    self.mappings["keyword_jira_query_mappings"][entity[1].strip()] = entity[2].strip()
-                    self.ru_yaml.dump(self.mappings, kfh)
+                    self.mappings["keyword_jira_query_mappings"][keyword] = jira_query
                     text = "Successfully added given keyword to the existing list!!!"
-                    self.logger.info(text)
-                    self.formulate_and_send_message_to_webex_group(text, metadata, message_time)
-
-                # Check if incoming message has "delete keyword" in it
-                elif "delete keyword" in entity[0].lower() and len(entity) == 3:
-                    self.logger.info("Deleting keyword from the existing list if present --")
-                    self.logger.info("{} : {}".format(entity[1].strip(), entity[2].strip()))
-                    if entity[1].strip() in self.keyword_jira_query_mappings:
-                        del self.mappings["keyword_jira_query_mappings"][entity[1].strip()]
-                        self.ru_yaml.dump(self.mappings, kfh)
-                        text = "Successfully deleted given keyword from the existing list!!!"
-                        self.logger.info(text)
-                        self.formulate_and_send_message_to_webex_group(text, metadata, message_time)
-                    else:
-                        self.ru_yaml.dump(self.mappings, kfh)
-                        text = "Keyword does not exist..."
-                        self.logger.info(text)
-                        self.formulate_and_send_message_to_webex_group(text, metadata, message_time)
-
+                elif keyword in self.keyword_jira_query_mappings:
+                    self.logger.info("Deleting keyword from the existing list --")
+                    del self.mappings["keyword_jira_query_mappings"][keyword]
+                    text = "Successfully deleted given keyword from the existing list!!!"
                 else:
+                    text = "Keyword does not exist..."
+                with open('keyword_query_mappings.yaml', 'w') as kfh:
                     self.ru_yaml.dump(self.mappings, kfh)
-                    text = "Un-indentified keyword..."
-                    self.logger.info(text)
-                    self.formulate_and_send_message_to_webex_group(text, metadata, message_time)
+            self.logger.info(text)
+            self.formulate_and_send_message_to_webex_group(text, metadata, message_time)
 
         except Exception as e:
             text = "Failure in updating keyword_query_mappings.yaml file,\nError: {}".format(e)
@@ -282,30 +426,58 @@ class ChatBotUtility:
             self.formulate_and_send_message_to_webex_group(text, metadata, message_time)
 
 
-    def formulating_command_output(self, output, error, person_id, text):
+    def formulate_command_output_rows(self, command, output, error):
         """
-            Sending message to individual
+            Formulate report rows for an executed command
+            :param command: Command
             :param output: stdout of the executed command
             :param error: stderr of the executed command
-            :param person_id: Webex person ID
-            :param text: text to send
+            :return: List of rows
         """
-        decoded_output = output.read().decode('utf8')
-        decoded_error = error.read().decode('utf8')
-        # Sending command output
-        if decoded_output:
-            self.logger.info("Output: {}".format(decoded_output))
-            text += "```\n" + decoded_output + "\n```"
-        if decoded_error:
-            self.logger.info("Error: {}".format(decoded_error))
-            text += "```\n" + decoded_error + "\n```"
-        self.formulate_and_send_message_to_individual(text, person_id)
+        rows = ["command: {}\n".format(command)]
+        if output:
+            self.logger.debug("Output: %s", output)
+            rows.append("```\n")
+            rows.extend(output.splitlines(True))
+            rows.append("\n```\n")
+        if error:
+            self.logger.info("Error: {}".format(error))
+            rows.append("```\n")
+            rows.extend(error.splitlines(True))
+            rows.append("\n```\n")
+        return rows
+
+
+    def formulate_troubleshoot_report(self, hostname, ssh):
+        """
+            Run all troubleshooting commands and formulate the report.
+            Commands run concurrently, rows are produced in command order
+            as the commands finish
+            :param hostname: Hostname
+            :param ssh: SSH connection object
+            :return: Generator of report rows
+        """
+        yield "Hello!!!<br />This is MaQ<br />"
+        yield "I just got a request to troubleshoot this cluster -- {}<br />".format(hostname)
+        yield "Here is the report --<br />"
+        commands = []
+        for command_set in self.all_commands:
+            self.logger.info("Command Set: {}".format(command_set))
+            commands.extend(self.all_commands[command_set] or [])
+        start_time = time.time()
+        for command, output, error in self.ssh_wrapper.execute_commands(ssh, commands):
+            for row in self.formulate_command_output_rows(command, output, error):
+                yield row
+        self.logger.info("{} commands executed on {} in {:.1f} seconds".format(len(commands), hostname,
+                                                                              time.time() - start_time))
+        yield "Troubleshooting Completed!!!<br />"
 
 
     def execute_commands_on_cluster(self ,hostname, ssh_username, ssh_password,
                                     cluster_username, cluster_password, person_id):
         """
-            Execute commands on the cluster
+            Execute commands on the cluster and send the report, in as
+            few messages as the size limit allows
             :param hostname: Hostname
             :param ssh_username: SSH Username
             :param ssh_password: SSH Password
@@ -313,67 +485,173 @@ class ChatBotUtility:
             :param cluster_password: cluster password
             :param person_id: Webex person ID
         """
-        # Connecting to the given cluster
-        self.ssh, self.pingstatus = self.ssh_wrapper.connect(hostname=hostname,
-                                            username=ssh_username,
-                                            password=ssh_password)
-        if self.pingstatus == 0:
-            text = "Hello!!!<br />This is MaQ<br />"
-            text += "I just got a request to troubleshoot this cluster -- {}<br />".format(hostname)
-            text += "Here is the report --<br />"
-            for command_set in self.all_commands:
-                self.logger.info("Command Set: {}".format(command_set))
-                if self.all_commands[command_set]:
-                    for command in self.all_commands[command_set]:
-                        text += "command: {}\n".format(command)
-                        self.logger.info("Executing " + str(text))
-                        stdin, stdout, stderr = self.ssh.exec_command(command, timeout=20)
-                        # Sending command output to the individual
-                        self.formulating_command_output(stdout, stderr, person_id, text)
-                        text = ""
-            # Sending tshoot completed reply
-            text = "Troubleshooting Completed!!!<br />"
+        # Connecting to the given cluster, or reusing a pooled connection
+        ssh, pingstatus = self.ssh_wrapper.acquire(hostname=hostname,
+                                                   username=ssh_username,
+                                                   password=ssh_password)
+        if pingstatus == 0 and ssh:
+            try:
+                self.formulate_and_send_message_to_individual(self.formulate_troubleshoot_report(hostname, ssh),
+                                                              person_id)
+            finally:
+                # Returning SSH connection to the pool
+                self.ssh_wrapper.release(ssh, hostname=hostname, username=ssh_username, password=ssh_password)
+                self.logger.info('SSH Connection Released!!!')
+        elif pingstatus == SshConnectionPool.POOL_FULL:
+            text = "All SSH connections are in use, try again in a few minutes..."
+            self.logger.info(text)
+            self.formulate_and_send_message_to_individual(text, person_id)
+        elif pingstatus == SshWrappper.SSH_FAILED:
+            text = "Cluster is reachable but the SSH connection failed, check the SSH username and password..."
             self.logger.info(text)
             self.formulate_and_send_message_to_individual(text, person_id)
-            # Closing SSH connection
-            self.ssh.close()
-            self.logger.info('SSH Connection Closed!!!')
         else:
             text = "Cluster is not reachable..."
             self.logger.info(text)
             self.formulate_and_send_message_to_individual(text, person_id)
 
 
-    def tshoot_cluster(self, last_message, metadata, message_time, person_id):
+    @command("troubleshoot", arguments=r"(?P<hostname>\S+)\s+(?P<ssh_username>\S+)\s+(?P<ssh_password>\S+)"
+                                       r"\s+(?P<cluster_username>\S+)\s+(?P<cluster_password>\S+)$",
+             lane="ssh", sensitive=True)
+    def tshoot_cluster(self, metadata, message_time, person_id, fresh, hostname,
+                       ssh_username, ssh_password, cluster_username, cluster_password):
         """
             Troubleshoot given cluster
-            :param last_message: last message
             :param metadata: metadata to update
             :param message_time: message time
             :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+            :param hostname: Hostname
+            :param ssh_username: SSH Username
+            :param ssh_password: SSH Password
+            :param cluster_username: cluster username
+            :param cluster_password: cluster password
         """
-        entity = re.split(' ', last_message)
-        self.generic_wrapper.update_timestamp(metadata, message_time)
-        if len(entity) == 6:
-            hostname = entity[1]
-            ssh_username = entity[2]
-            ssh_password = entity[3]
-            cluster_username = entity[4]
-            cluster_password = entity[5]
-            self.logger.info("IP: {}".format(hostname))
-            self.logger.info("SSH username: {}".format(ssh_username))
-            self.logger.info("SSH password: {}".format(ssh_password))
-            self.logger.info("cluster username: {}".format(cluster_username))
-            self.logger.info("cluster password: {}".format(cluster_password))
-            self.intialize_tshoot_prerequisites()
-            tshoot_process = multiprocessing.Process(target=self.execute_commands_on_cluster,
-                                         args=(hostname, ssh_username,
-                                               ssh_password, cluster_username,
-                                               cluster_password, person_id))
-            tshoot_process.start()
-            tshoot_process.join()
+        self.logger.info("User wants to troubleshoot/debug given cluster")
+        self.mark_served(metadata, message_time)
+        self.logger.info("IP: {}".format(hostname))
+        self.logger.info("SSH username: {}".format(ssh_username))
+        self.logger.info("cluster username: {}".format(cluster_username))
+        self.intialize_tshoot_prerequisites()
+        self.execute_commands_on_cluster(hostname, ssh_username, ssh_password,
+                                         cluster_username, cluster_password, person_id)
+
+
+    def summarize_cluster_health(self, hostname, ssh_username, ssh_password, start_times):
+        """
+            Run the troubleshooting commands on a cluster and summarize
+            the results
+            :param hostname: Hostname
+            :param ssh_username: SSH Username
+            :param ssh_password: SSH Password
+            :param start_times: Dictionary the start time of the check is
+                                recorded in
+            :return: Summary row [host, ssh, nodes ready, etcd, failed
+                     commands, seconds]
+        """
+        start_time = time.time()
+        start_times[hostname] = start_time
+        ssh, pingstatus = self.ssh_wrapper.acquire(hostname=hostname, username=ssh_username, password=ssh_password)
+        if not ssh:
+            status = {SshWrappper.SSH_FAILED: "failed",
+                      SshConnectionPool.POOL_FULL: "pool full"}.get(pingstatus, "unreachable")
+            return [hostname, status, "-", "-", "-",
+                    "{:.0f}".format(time.time() - start_time)]
+        nodes_ready = etcd_health = "-"
+        failed_commands = 0
+        commands = []
+        for command_set in self.all_commands:
+            commands.extend(self.all_commands[command_set] or [])
+        try:
+            for command, output, error in self.ssh_wrapper.execute_commands(ssh, commands):
+                if error:
+                    failed_commands += 1
+                if command.startswith("kubectl get nodes"):
+                    statuses = [line.split()[1] for line in output.splitlines()[1:] if len(line.split()) > 1]
+                    ready = [status for status in statuses if status.split(",")[0] == "Ready"]
+                    nodes_ready = "{}/{}".format(len(ready), len(statuses))
+                elif command.startswith("etcdctl cluster-health"):
+                    etcd_health = "healthy" if "cluster is healthy" in output else "unhealthy"
+        finally:
+            self.ssh_wrapper.release(ssh, hostname=hostname, username=ssh_username, password=ssh_password)
+        return [hostname, "ok", nodes_ready, etcd_health, failed_commands, "{:.0f}".format(time.time() - start_time)]
+
+
+    @command("troubleshoot fleet", arguments=r"(?P<hosts>\S+)\s+(?P<ssh_username>\S+)\s+(?P<ssh_password>\S+)"
+                                             r"\s+(?P<cluster_username>\S+)\s+(?P<cluster_password>\S+)$",
+             lane="ssh", sensitive=True)
+    def tshoot_fleet(self, metadata, message_time, person_id, fresh, hosts,
+                     ssh_username, ssh_password, cluster_username, cluster_password):
+        """
+            Troubleshoot several clusters at once and send a summary
+            matrix in personal chat
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+            :param hosts: Host list, see parse_host_list
+            :param ssh_username: SSH Username
+            :param ssh_password: SSH Password
+            :param cluster_username: cluster username
+            :param cluster_password: cluster password
+        """
+        self.logger.info("User wants to troubleshoot clusters: {}".format(hosts))
+        self.mark_served(metadata, message_time)
+        general_details = self.doc["general_details"]
+        max_hosts = int(general_details.get("fleet_max_hosts", 64))
+        host_timeout = float(general_details.get("fleet_host_timeout", 120))
+        try:
+            hosts = parse_host_list(hosts, max_hosts)
+        except ValueError as e:
+            self.formulate_and_send_message_to_individual("Invalid cluster list -- {}".format(e), person_id)
+            return
+        if not hosts:
+            self.formulate_and_send_message_to_individual("Give between 1 and {} clusters to troubleshoot"
+                                                          .format(max_hosts), person_id)
+            return
+        self.intialize_tshoot_prerequisites()
+        # Probing every cluster at once first, unreachable clusters do
+        # not take up a slot of the pool waiting for the SSH timeout
+        probe_results = self.ssh_wrapper.reachability_probe.probe_many(hosts, port=2222)
+        start_times = {}
+        pool = ThreadPool(max(1, min(int(general_details.get("fleet_pool_size", 8)), len(hosts))))
+        pending = [(probe_result["hostname"], pool.apply_async(Tracer.bind(self.summarize_cluster_health),
+                                                               (probe_result["hostname"], ssh_username,
+                                                                ssh_password, start_times)))
+                   for probe_result in probe_results if probe_result["reachable"]]
+        pool.close()
+        table = [[probe_result["hostname"], "unreachable", "-", "-", "-", "{:.0f}".format(probe_result["seconds"])]
+                 for probe_result in probe_results if not probe_result["reachable"]]
+        timed_out = 0
+        for hostname, result in pending:
+            # A host gets host_timeout seconds from the moment its check
+            # starts, hosts still queued behind others are not charged
+            while not result.ready():
+                start_time = start_times.get(hostname)
+                if start_time is not None and time.time() - start_time > host_timeout:
+                    break
+                result.wait(0.5)
+            if not result.ready():
+                timed_out += 1
+                table.append([hostname, "timed out", "-", "-", "-", "{:.0f}".format(host_timeout)])
+            elif not result.successful():
+                table.append([hostname, "error", "-", "-", "-", "-"])
+            else:
+                table.append(result.get())
+        rows = ["Fleet troubleshoot summary for {} clusters --\n".format(len(hosts))]
+        rows.extend(self.generic_wrapper.formulate_table_rows(["Host", "SSH", "Nodes Ready", "etcd",
+                                                               "Failed Commands", "Seconds"], table))
+        if timed_out:
+            # Worker threads cannot be cancelled, the pool is left to
+            # finish in the background. Every SSH command of a check is
+            # still bounded by ssh_command_timeout
+            rows.append("\n{} checks timed out after {:.0f} seconds, they keep running in the background "
+                        "until their SSH commands complete or time out, their results are not "
+                        "reported".format(timed_out, host_timeout))
         else:
-            self.unidentified_keyword(metadata, message_time)
+            pool.join()
+        self.formulate_and_send_message_to_individual(rows, person_id)
 
 
     def unidentified_keyword(self, metadata, message_time):
@@ -387,129 +665,459 @@ class ChatBotUtility:
         self.formulate_and_send_message_to_webex_group(text, metadata, message_time)
 
 
-    def reply_to_message(self, current_message_datetime, last_served_request,
-                         last_message, metadata, message_time, person_id):
+    @command("valar morghulis")
+    def reply_to_test_keyword(self, metadata, message_time, person_id, fresh):
         """
-            Read the message and reply accordingly
-            :param current_message_datetime: current message time in datetime format
-            :param last_served_request: last served request time
+            Test keyword
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+        """
+        self.logger.info("Test keyword identified..., sending reply!!!")
+        self.formulate_and_send_message_to_webex_group(self.keyword_jira_query_mappings["Valar Morghulis"],
+                                                       metadata, message_time)
+
+
+    @command("help")
+    def reply_with_help(self, metadata, message_time, person_id, fresh):
+        """
+            Help keyword
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+        """
+        self.logger.info("Keyword identified..., user needs help!!!")
+        rows = [self.generic_wrapper.HELP_TEXT, "\nKeyword to jira query mappings available:\n"]
+        for key, value in self.keyword_jira_query_mappings.items():
+            rows.append("\t" + str(key) + "\t-->\t" + str(value) + "\n")
+        self.formulate_and_send_message_to_webex_group("".join(rows), metadata, message_time)
+
+
+    @command("get bug details", arguments=r"(?P<bug_id>\S+)$")
+    def reply_with_bug_details(self, metadata, message_time, person_id, fresh, bug_id):
+        """
+            Provide bug description
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+            :param bug_id: Bug ID
+        """
+        self.logger.info("User wants details about a bug")
+        self.intialize_jira_prerequisites()
+        self.logger.info("Bug ID: {}".format(bug_id))
+        details = self.bug_details_cache.get_or_load(bug_id.upper(),
+                                                     lambda: self.jira_manager.run(self.jira_wrapper.get_bug_details,
+                                                                                   bug_id=bug_id),
+                                                     fresh=fresh)
+        self.formulate_and_send_message_to_webex_group(details, metadata, message_time)
+
+
+    @command("get last promoted build", arguments=r"(?P<branch>\S+)$")
+    def reply_with_last_promoted_build(self, metadata, message_time, person_id, fresh, branch):
+        """
+            Provide last promoted build ID for a given branch
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+            :param branch: Branch ID
+        """
+        self.logger.info("User wants to know the last promoted build from a branch")
+        self.intialize_fileserver_prerequisites()
+        self.logger.info("Branch: {}".format(branch))
+        get_stable_build_url, get_current_build_url = self.fileserver_wrapper.get_build_urls(branch)
+        details = self.fileserver_wrapper.get_build(url=get_stable_build_url, fresh=fresh)
+        self.formulate_and_send_message_to_webex_group(details, metadata, message_time)
+
+
+    @command("get current build", arguments=r"(?P<branch>\S+)$")
+    def reply_with_current_build(self, metadata, message_time, person_id, fresh, branch):
+        """
+            Provide current build ID for a given branch
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+            :param branch: Branch ID
+        """
+        self.logger.info("User wants to know the current build from a branch")
+        self.intialize_fileserver_prerequisites()
+        self.logger.info("Branch: {}".format(branch))
+        get_stable_build_url, get_current_build_url = self.fileserver_wrapper.get_build_urls(branch)
+        details = self.fileserver_wrapper.get_build(url=get_current_build_url, fresh=fresh)
+        self.formulate_and_send_message_to_webex_group(details, metadata, message_time)
+
+
+    @command("builds", arguments=r"(?P<branches>[^\s,]*(?:[\s,]+[^\s,]+)*)[\s,]*$",
+             converters={"branches": lambda text: text.replace(",", " ").split()})
+    def reply_with_builds_overview(self, metadata, message_time, person_id, fresh, branches):
+        """
+            Provide last promoted and current build of several branches,
+            the configured branches if none are given
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+            :param branches: List of branch IDs
+        """
+        self.logger.info("User wants an overview of builds")
+        self.intialize_fileserver_prerequisites()
+        branches = branches or self.fileserver_default_branches
+        if not branches:
+            self.unidentified_keyword(metadata, message_time)
+            return
+        rows = self.fileserver_wrapper.get_builds_overview(branches, fresh=fresh)
+        self.formulate_and_send_message_to_webex_group(rows, metadata, message_time, text_key="markdown")
+
+
+    @command("stats")
+    def reply_with_stats(self, metadata, message_time, person_id, fresh):
+        """
+            Provide time spent per backend since the bot started and the
+            timing breakdown of the latest requests
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+        """
+        self.logger.info("User wants the request timing stats")
+        spans, traces = Tracer.get_stats()
+        table = [[name, calls, "{:.3f}".format(average), "{:.3f}".format(maximum), errors]
+                 for name, calls, average, maximum, errors in spans]
+        rows = ["Backend Calls --\n"]
+        rows.extend(self.generic_wrapper.formulate_table_rows(["Call", "Count", "Avg (s)", "Max (s)", "Errors"],
+                                                              table or [["-", 0, "-", "-", 0]]))
+        rows.append("\nLatest Requests --\n")
+        for trace_id, name, seconds, breakdown in traces[:10]:
+            rows.append("- {} `{}` {:.3f}s -- {}\n".format(trace_id, name, seconds, breakdown))
+        self.formulate_and_send_message_to_webex_group(rows, metadata, message_time, text_key="markdown")
+
+
+    @command("get bugs for build", arguments=r".*$")
+    def reply_with_bugs_for_build(self, metadata, message_time, person_id, fresh):
+        """
+            Get bugs raised on a given build
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param person_id: Webex person ID
+            :param fresh: Bypass cached results
+        """
+        self.logger.info("User wants to get the list of bugs filed for a build")
+        self.intialize_jira_prerequisites()
+        return_text = self.jira_wrapper.get_bugs_filed_for_build()
+        self.formulate_and_send_message_to_webex_group(return_text, metadata, message_time)
+
+
+    def reply_with_jira_query_results(self, keyword, metadata, message_time, fresh):
+        """
+            Executing jira query associated with the keyword
+            :param keyword: Keyword
+            :param metadata: metadata to update
+            :param message_time: message time
+            :param fresh: Bypass cached results
+        """
+        reply_text = "Here are " + keyword + " --\n"
+        self.logger.info("Keyword identified..., sending reply now")
+        self.intialize_jira_prerequisites()
+        jira_query_to_run = self.keyword_jira_query_mappings[keyword]
+        open_issues = self.jira_query_cache.get_or_load(jira_query_to_run,
+                                                        lambda: self.jira_manager.run(self.jira_wrapper.run_jira_query,
+                                                                                      jira_query=jira_query_to_run,
+                                                                                      fields=self.jira_wrapper.MESSAGE_FIELDS),
+                                                        fresh=fresh)
+        rows = self.jira_wrapper.formulate_message_rows(text_data=reply_text,
+                                                        issues=open_issues,
+                                                        jira_server_url=self.jira_server_url)
+        self.webex_wrapper.send_message_in_chunks(webex_url=self.webex_url,
+                                                  webex_auth_headers=self.webex_auth_headers,
+                                                  data_to_send={"roomId": self.webex_room_id},
+                                                  rows=rows,
+                                                  max_message_size=self.message_size_limit)
+        self.mark_served(metadata, message_time)
+        self.logger.info("---***--- Reply sent to the Webex group ---***---")
+
+
+    def redact_message(self, message):
+        """
+            Message text safe to log, post back or store in the user
+            history. Troubleshoot credentials are dropped, and messages
+            that are neither a command nor a JIRA keyword are not kept as
+            they may be a mistyped command with credentials
+            :param message: Message text
+            :return: Redacted text
+        """
+        redacted = self.command_router.redact(message)
+        if redacted is not None:
+            return redacted
+        keyword = message[:-len(" --fresh")].rstrip() if message.lower().endswith(" --fresh") else message
+        if keyword in getattr(self, "keyword_jira_query_mappings", {}):
+            return message
+        return "<unidentified request>"
+
+
+    def reply_to_message(self, last_message, metadata, message_time, person_id):
+        """
+            Read the message and reply accordingly. Messages already
+            served are filtered out by ID before they get here
             :param last_message: last message content
             :param metadata: metadata to update
             :param message_time: message time
+            :param person_id: Webex person ID
         """
         # Read message and reply accordingly
-        if current_message_datetime > last_served_request:
-            self.logger.info("Received new message/keyword...")
-            self.intialize_prerequisites()
-
-            # Test keyword
-            if last_message == "Valar Morghulis":
-                self.logger.info("Test keyword identified..., sending reply!!!")
-                self.formulate_and_send_message_to_webex_group(self.keyword_jira_query_mappings[last_message],
-                                                               metadata, message_time)
-
-            # Help keyword
-            elif last_message.lower() == "help":
-                self.logger.info("Keyword identified..., user needs help!!!")
-                text = self.generic_wrapper.HELP_TEXT
-                text += "\nKeyword to jira query mappings available:\n"
-                for key, value in self.keyword_jira_query_mappings.iteritems():
-                    text += "\t" + str(key) + "\t-->\t" + str(value) + "\n"
-                self.formulate_and_send_message_to_webex_group(text, metadata, message_time)
-
-            # Editing keyword_query_mappings.yaml file
-            elif any(word in re.split('[>:]', last_message.lower())[0].strip() for word in self.EDIT_KEYWORDS):
-                self.logger.info("Keyword identified...")
-                self.logger.info("User wants to edit keyword_query_mappings.yaml")
-                self.edit_keyword_jira_query_mappings(last_message,
-                                                      metadata, message_time)
-
-            # Provide bug description
-            elif "get bug details" in last_message.lower():
-                self.logger.info("Keyword identified...")
-                self.logger.info("User wants details about a bug")
-                self.intialize_jira_prerequisites()
-                bug_id = last_message.split(" ")[3]
-                self.logger.info("Bug ID: {}".format(bug_id))
-                details = self.jira_wrapper.get_bug_details(jira_object=self.jira_object,
-                                                          bug_id=bug_id)
-                self.formulate_and_send_message_to_webex_group(details, metadata, message_time)
-
-            # Provide last promoted build ID for a given branch
-            elif "get last promoted build" in last_message.lower():
-                self.logger.info("Keyword identified...")
-                self.logger.info("User wants to know the last promoted build from a branch")
-                branch = last_message.split(" ")[4]
-                self.logger.info("Branch: {}".format(branch))
-                self.intialize_fileserver_prerequisites(branch)
-                details = self.fileserver_wrapper.get_build(url=self.get_stable_build_url)
-                self.formulate_and_send_message_to_webex_group(details, metadata, message_time)
-
-            # Provide current build ID for a given branch
-            elif "get current build" in last_message.lower():
-                self.logger.info("Keyword identified...")
-                self.logger.info("User wants to know the current build from a branch")
-                branch = last_message.split(" ")[3]
-                self.logger.info("Branch: {}".format(branch))
-                self.intialize_fileserver_prerequisites(branch)
-                details = self.fileserver_wrapper.get_build(url=self.get_current_build_url)
-                self.formulate_and_send_message_to_webex_group(details, metadata, message_time)
-
-            # Get testing status for a given build
-            elif "get testing status" in last_message.lower():
-                self.logger.info("Keyword identified...")
-                self.logger.info("User wants testing info about a build")
-                self.intialize_qdna_prerequisites()
-                return_text = self.get_testing_status(last_message)
-                self.formulate_and_send_message_to_webex_group(return_text, metadata, message_time)
-
-            # Get detailed testing status for a given build
-            elif "get detailed testing status" in last_message.lower():
-                self.logger.info("Keyword identified...")
-                self.logger.info("User wants detailed testing info about a build")
-                self.intialize_qdna_prerequisites()
-                return_text = self.get_detailed_testing_status(last_message)
-                self.formulate_and_send_message_to_webex_group(return_text, metadata, message_time)
-
-            # Troubleshoot a given cluster
-            elif "troubleshoot" in last_message.lower():
-                self.logger.info("Keyword identified...")
-                self.logger.info("User wants to troubleshoot/debug given cluster")
-                self.tshoot_cluster(last_message, metadata, message_time, person_id)
-
-            # Get bugs raised on a given build
-            elif "get bugs for build" in last_message.lower():
-                self.logger.info("Keyword identified...")
-                self.logger.info("User wants to get the list of bugs filed for a build")
-                return_text = self.jira_wrapper.get_bugs_filed_for_build()
-                self.formulate_and_send_message_to_webex_group(return_text, metadata, message_time)
+        self.logger.info("Received new message/keyword...")
+        self.intialize_prerequisites()
+
+        # Requests ending with --fresh bypass cached results
+        fresh = last_message.lower().endswith(" --fresh")
+        if fresh:
+            last_message = last_message[:-len(" --fresh")].rstrip()
+            self.logger.info("Fresh results requested, bypassing cache")
+
+        command_object, arguments = self.command_router.route(last_message)
+        command_name = "unidentified"
+        start_time = time.time()
+        try:
+            # Running the registered command handler
+            if command_object is not None and arguments is not None:
+                command_name = command_object.phrase
+                self.logger.info("Keyword identified -- {}".format(command_object.phrase))
+                command_object.handler(metadata, message_time, person_id, fresh, **arguments)
 
             # Executing jira query associated with the keyword
             elif last_message in self.keyword_jira_query_mappings:
-                reply_text = "Here are " + last_message + " --\n"
-                self.logger.info("Keyword identified..., sending reply now")
-                self.intialize_jira_prerequisites()
-                jira_query_to_run = self.keyword_jira_query_mappings[last_message]
-                open_issues = self.jira_wrapper.run_jira_query(jira_object=self.jira_object,
-                                                             jira_query=jira_query_to_run)
-                data_to_send = self.jira_wrapper.formulate_message_to_send(room_id=self.webex_room_id,
-                                                                           text_data=reply_text,
-                                                                           issues=open_issues,
-                                                                           jira_server_url=self.jira_server_url,
-                                                                           jira_object=self.jira_object)
-                self.webex_wrapper.send_message_to_webex_group(webex_url=self.webex_url,
-                                                            webex_auth_headers=self.webex_auth_headers,
-                                                            data_to_send=data_to_send)
-                self.generic_wrapper.update_timestamp(metadata, message_time)
-                self.logger.info("---***--- Reply sent to the Webex group ---***---")
+                command_name = "jira keyword"
+                self.reply_with_jira_query_results(last_message, metadata, message_time, fresh)
 
             # Keyword not identified
             else:
                 self.unidentified_keyword(metadata, message_time)
-                self.generic_wrapper.update_timestamp(metadata, message_time)
+        finally:
+            # Traces are named by the routed command, never by the message
+            # text which can carry credentials
+            Tracer.set_trace_name(command_name)
+            self.requests_counter.inc(labels=(command_name,))
+            self.request_seconds.observe(time.time() - start_time, (command_name,))
+
+
+    def get_lookback_boundary(self, last_served_request):
+        """
+            Oldest message time a webhook mode poll reads back to. Served
+            message IDs are only recorded from the first lookback poll on,
+            so the walk never goes back past that poll's last served
+            request, older messages would be served again
+            :param last_served_request: last served request time
+            :return: Boundary time
+        """
+        state_store = self.generic_wrapper.state_store
+        floor = state_store.get("poll_lookback_floor")
+        if floor is None:
+            floor = last_served_request.isoformat()
+            state_store.set("poll_lookback_floor", floor)
+            self.logger.info("First lookback poll, reading back to {} only".format(floor))
+        return max(last_served_request - datetime.timedelta(seconds=self.poll_lookback),
+                   dateutil.parser.parse(floor))
+
+
+    def collect_unserved_messages(self, last_served_request):
+        """
+            Walks the list of messages where bot was mentioned (newest
+            first), following the pagination links, back to the last served
+            request. In webhook mode the walk goes chat_bot_poll_lookback
+            seconds further back and messages already served are skipped by
+            ID, so a message whose webhook callback was lost is still picked
+            up after newer ones were served. If chat_bot_max_poll_pages is
+            reached first, the next poll carries on from where this one
+            stopped (see save_poll_progress), so older requests are served
+            later rather than skipped
+            :param last_served_request: last served request time
+            :return: (List of unserved messages in chronological order, walk
+                     dictionary for save_poll_progress)
+        """
+        state_store = self.generic_wrapper.state_store
+        unserved_messages = []
+        resume = state_store.get("poll_resume")
+        if resume:
+            resume = json.loads(resume)
+            url = resume["url"]
+            last_served_request = dateutil.parser.parse(resume["until"])
+            self.logger.info("Resuming poll of older messages, back to {}".format(last_served_request))
         else:
-            self.logger.info("This message was already served at: {}".format(last_served_request))
-            self.logger.info("---***--- Nothing to serve in this iteration!!! ---***---")
+            url = self.webex_teams_get_url
+            if self.webhook_receiver is not None:
+                last_served_request = self.get_lookback_boundary(last_served_request)
+        walk = {"start_url": url, "until": last_served_request.isoformat(), "resumed": bool(resume)}
+        pages_read = 0
+        while url and pages_read < self.max_poll_pages:
+            with Tracer.span("webex poll"):
+                output = self.webex_wrapper.receive_message_from_webex_group(webex_url=url,
+                                                                             webex_auth_headers=self.webex_auth_headers)
+            self.logger.info("Ouput response -- %s", output)
+            json_output = json.loads(output.content)
+            pages_read += 1
+            for item in json_output["items"]:
+                if dateutil.parser.parse(item["created"]) <= last_served_request:
+                    url = None
+                    break
+                if not state_store.is_message_processed(item["id"]):
+                    unserved_messages.append(item)
+            else:
+                # Every message in this page is within the walk, reading next page
+                url = output.links.get("next", {}).get("url")
+        if url:
+            self.logger.warning("Reached max poll pages limit ({}), older unserved messages are read "
+                                "in the next poll".format(self.max_poll_pages))
+        walk["next_url"] = url
+        unserved_messages.reverse()
+        return unserved_messages, walk
+
+
+    def save_poll_progress(self, walk, dispatched):
+        """
+            Saves where the next poll starts once the collected messages
+            were handed over. The walk only moves on to older pages when
+            every collected message was dispatched, otherwise it is read
+            again from the same page and the messages already served are
+            skipped by ID. Pages older than the watermark are never read
+            by a fresh walk, so they must not be given up on
+            :param walk: Walk dictionary from collect_unserved_messages
+            :param dispatched: True if every collected message was
+                               dispatched
+        """
+        state_store = self.generic_wrapper.state_store
+        if not dispatched:
+            if walk["resumed"] or walk["next_url"]:
+                state_store.set("poll_resume", json.dumps({"url": walk["start_url"], "until": walk["until"]}))
+        elif walk["next_url"]:
+            state_store.set("poll_resume", json.dumps({"url": walk["next_url"], "until": walk["until"]}))
+        elif walk["resumed"]:
+            self.logger.info("Caught up with older unserved messages")
+            state_store.set("poll_resume", "")
+
+
+    def serve_message(self, item, last_served_request, metadata):
+        """
+            Replies to a single message and advances the last served
+            request timestamp once the message is served
+            :param item: Message item from the webex list messages API
+            :param last_served_request: last served request time
+            :param metadata: metadata to update
+        """
+        last_message = item["text"].replace(self.webex_bot_name + " ", "")
+        person_id = item["personId"]
+        current_message_datetime = dateutil.parser.parse(item["created"])
+        message_time = str(item["created"])
+        redacted_message = self.redact_message(last_message)
+        self.logger.info("Current message -- {}".format(redacted_message))
+        self.logger.info("Current message time: {}".format(message_time))
+        message_timestamp = calendar.timegm(current_message_datetime.utctimetuple())
+        self.message_lag_seconds.observe(max(0.0, time.time() - message_timestamp))
+        # Backend calls made while serving the message are timed under
+        # the trace, the breakdown is logged once the reply is sent
+        trace = Tracer.start_trace("unidentified")
+        try:
+            self.reply_to_message(last_message, metadata, message_time, person_id)
+        except Exception as e:
+            # Replying with the failure so that a bad request does not
+            # block the messages queued after it
+            text = "Failed to serve the request -- {}\nError: {}".format(redacted_message, e)
+            self.logger.error(text)
+            self.request_errors_counter.inc()
+            self.formulate_and_send_message_to_webex_group(text, metadata, message_time)
+        finally:
+            Tracer.finish_trace(trace)
+            self.reply_latency_seconds.observe(max(0.0, time.time() - message_timestamp))
+        self.generic_wrapper.state_store.record_processed_message(item["id"], message_time,
+                                                                  person_id, redacted_message)
+        self.mark_served(metadata, message_time)
+
+
+    def mark_served(self, metadata, message_time):
+        """
+            Update last served request timestamp once a message is served.
+            In daemon mode the timestamp is advanced by the served
+            watermark when the dispatched request completes instead
+            :param metadata: metadata to update
+            :param message_time: message time
+        """
+        if self.watermark is not None:
+            return
+        self.advance_served_timestamp(metadata, message_time)
+
+
+    def advance_served_timestamp(self, metadata, message_time):
+        """
+            Move the last served request timestamp forward, never back --
+            older messages are served after newer ones when the poll
+            resumes an unfinished walk
+            :param metadata: metadata to update
+            :param message_time: message time
+        """
+        last_served_request = metadata["read_only"]["last_served_request"]
+        if dateutil.parser.parse(message_time) > dateutil.parser.parse(last_served_request):
+            self.generic_wrapper.update_timestamp(metadata, message_time)
+
+
+    def update_served_timestamp(self, message_time):
+        """
+            Update last served request timestamp in the state store,
+            used by the served watermark in daemon mode
+            :param message_time: message time
+        """
+        metadata = self.generic_wrapper.load_metadata()
+        self.advance_served_timestamp(metadata, message_time)
+
+
+    def dispatch_message(self, item, last_served_request, metadata):
+        """
+            Serves the message right away or, in daemon mode, queues it on
+            the request dispatcher. Troubleshoot requests go to the ssh
+            lane so that they never hold up quick requests
+            :param item: Message item from the webex list messages API
+            :param last_served_request: last served request time
+            :param metadata: metadata to update
+            :return: False if the dispatcher is full and the remaining
+                     messages should wait for the next iteration
+        """
+        message_id = item["id"]
+        # Served message IDs outlive restarts, a message is never
+        # answered twice even if the watermark falls behind
+        if self.generic_wrapper.state_store.is_message_processed(message_id):
+            self.logger.info("Message {} was already served".format(message_id))
+            return True
+        if self.dispatcher is None:
+            self.serve_message(item, last_served_request, metadata)
+            return True
+        # Messages can arrive both from the poller and from the webhook
+        # receiver, checking and tracking them under one lock
+        with self.dispatch_lock:
+            if self.watermark.is_tracked(message_id):
+                self.logger.info("Message {} is already being served".format(message_id))
+                return True
+            self.watermark.begin(message_id, str(item["created"]))
+        lane = self.command_router.get_lane(item["text"].replace(self.webex_bot_name + " ", ""))
+        queued = self.dispatcher.submit(lane, item["personId"], self.serve_dispatched_message,
+                                        item, last_served_request, metadata)
+        if not queued:
+            self.watermark.cancel(message_id)
+        return queued
+
+
+    def serve_dispatched_message(self, item, last_served_request, metadata):
+        """
+            Dispatcher worker entry point, serves the message and marks it
+            as served
+            :param item: Message item from the webex list messages API
+            :param last_served_request: last served request time
+            :param metadata: metadata to update
+        """
+        try:
+            self.serve_message(item, last_served_request, metadata)
+        finally:
+            self.watermark.complete(item["id"])
 
 
     def monitor_webex_group_and_take_action(self):
@@ -524,43 +1132,289 @@ class ChatBotUtility:
         try:
             self.logger.info("---***--- Iteration Start!!! ---***---")
 
-            # Collecting info from metadata.yaml
-            with open('tmp/metadata.yaml', 'r') as mfh:
-                metadata = yaml.safe_load(mfh)
-                last_served_request = dateutil.parser.parse(metadata["read_only"]["last_served_request"])
+            # Collecting info from the state store
+            metadata = self.generic_wrapper.load_metadata()
+            last_served_request = dateutil.parser.parse(metadata["read_only"]["last_served_request"])
             self.logger.info("Last served request time: {}".format(last_served_request))
 
-            # Getting the last message in the group where bot was mentioned
-            output = self.webex_wrapper.receive_message_from_webex_group(webex_url=self.webex_teams_get_url,
-                                                                         webex_auth_headers=self.webex_auth_headers)
-            self.logger.info("Ouput response -- {}".format(output))
-            self.logger.info("Output content -- {}".format(output.content))
-            json_output = json.loads(output.content)
-            last_message = json_output["items"][0]["text"].replace(self.webex_bot_name + " ","")
-            person_id = json_output["items"][0]["personId"]
-            current_message_datetime = dateutil.parser.parse(json_output["items"][0]["created"])
-            message_time = str(json_output["items"][0]["created"])
-            self.logger.info("Current message -- {}".format(last_message))
-            self.logger.info("Current message time: {}".format(message_time))
+            # Getting all the unserved messages in the group where bot
+            # was mentioned
+            unserved_messages, walk = self.collect_unserved_messages(last_served_request)
+            self.last_poll_time = time.time()
+            self.logger.info("Unserved messages in this iteration: {}".format(len(unserved_messages)))
+            if not unserved_messages:
+                self.logger.info("---***--- Nothing to serve in this iteration!!! ---***---")
 
-            # Sending reply
-            self.reply_to_message(current_message_datetime, last_served_request,
-                                  last_message, metadata, message_time, person_id)
+            # Sending replies, oldest message first
+            self.intialize_prerequisites()
+            dispatched = True
+            for item in unserved_messages:
+                if not self.dispatch_message(item, last_served_request, metadata):
+                    dispatched = False
+                    break
+            self.save_poll_progress(walk, dispatched)
 
             self.logger.info("---***--- Iteration End!!! ---***---")
         except Exception as e:
             self.logger.error("Error: {}".format(e))
-            sys.exit()
+            self.poll_errors_counter.inc()
+            # The daemon keeps running and retries in the next iteration
+            if not self.daemon_mode:
+                sys.exit()
 
 
-    def starter(self):
+    def handle_webhook_message(self, data):
+        """
+            Webhook receiver callback, only queues the message ID for the
+            webhook fetcher thread so that the HTTP handler answers right
+            away. A message dropped because the queue is full is picked up
+            by the next poll
+            :param data: "data" dictionary of the webhook payload
+        """
+        if data.get("roomId") != self.webex_room_id:
+            self.logger.info("Ignoring webhook message from another room")
+            return
+        try:
+            self.webhook_queue.put_nowait(data["id"])
+        except queue.Full:
+            self.logger.warning("Webhook queue full, leaving message {} to the poller".format(data["id"]))
+
+
+    def webhook_fetcher_loop(self):
+        """
+            Webhook fetcher thread, fetches the queued messages and puts
+            them on the same dispatch path as polled messages. Runs until
+            the stop sentinel is queued
+        """
+        while True:
+            message_id = self.webhook_queue.get()
+            if message_id is None:
+                break
+            try:
+                metadata = self.generic_wrapper.load_metadata()
+                last_served_request = dateutil.parser.parse(metadata["read_only"]["last_served_request"])
+                output = self.webex_wrapper.get_message(webex_url=self.webex_url,
+                                                        webex_auth_headers=self.webex_auth_headers,
+                                                        message_id=message_id)
+                self.dispatch_message(json.loads(output.content), last_served_request, metadata)
+            except Exception as e:
+                self.logger.error("Failed to serve webhook message {}, leaving it to the poller -- {}"
+                                  .format(message_id, e))
+
+
+    def start_webhook_receiver(self):
+        """
+            Starts the webhook receiver and the webhook fetcher thread if
+            webhook mode is enabled in information.yaml
+            (webex_teams_details:webhook_enabled)
+        """
+        webex_details = self.doc["webex_teams_details"]
+        if str(webex_details.get("webhook_enabled", False)).lower() != 'true':
+            return
+        self.webhook_queue = queue.Queue(int(webex_details.get("webhook_queue_size", 100)))
+        self.webhook_thread = threading.Thread(target=self.webhook_fetcher_loop, name="webhook-fetcher")
+        self.webhook_thread.daemon = True
+        self.webhook_thread.start()
+        self.webhook_receiver = WebhookReceiver(callback=self.handle_webhook_message,
+                                                host=webex_details.get("webhook_host", "0.0.0.0"),
+                                                port=webex_details.get("webhook_port", 8012),
+                                                path=webex_details.get("webhook_path", "/webhook"),
+                                                secret=webex_details.get("webhook_secret"))
+        if not self.webhook_receiver.start():
+            self.logger.error("Webhook receiver is down, falling back to polling")
+
+
+    def stop_webhook_receiver(self):
+        """
+            Stops the webhook receiver, then the webhook fetcher thread once
+            it has handed over the queued messages
+        """
+        if self.webhook_receiver is not None:
+            self.webhook_receiver.stop()
+        if self.webhook_thread is not None:
+            self.webhook_queue.put(None)
+            self.webhook_thread.join()
+
+
+    def watch_testing_status(self, name, targets, room_id, header):
+        """
+            Scheduled QDNA build watch, posts the testing status of the
+            builds to the room when it has changed since the last run
+            :param name: Job name, state store key prefix
+            :param targets: List of (project, build ID) tuples
+            :param room_id: Webex room ID
+            :param header: Message header
+        """
+        rows = self.qdna_wrapper.get_testing_status_for_builds(targets,
+                                                               max_parallel_requests=self.qdna_max_parallel_requests,
+                                                               fresh=True)
+        status_text = "".join(rows[1:])
+        status_key = "watch:{}:status".format(name)
+        if self.generic_wrapper.state_store.get(status_key) == status_text:
+            self.logger.info("Testing status of {} has not changed".format(name))
+            return
+        self.webex_wrapper.send_message_in_chunks(webex_url=self.webex_url,
+                                                  webex_auth_headers=self.webex_auth_headers,
+                                                  data_to_send={"roomId": room_id},
+                                                  rows=[header] + rows[1:],
+                                                  text_key="markdown",
+                                                  max_message_size=self.message_size_limit)
+        self.generic_wrapper.state_store.set(status_key, status_text)
+
+
+    def create_scheduled_job(self, job_details):
+        """
+            Function run by a scheduled job
+            :param job_details: Job entry of scheduled_jobs in information.yaml
+            :return: Function called without arguments
+        """
+        name = str(job_details["name"])
+        job_type = str(job_details.get("type", "jira_notifier"))
+        room_id = str(job_details.get("room_id", self.webex_room_id))
+        if job_type == "jira_notifier":
+            if self.bug_notifier is None:
+                # A single notifier for all jira jobs, they share the JIRA
+                # connection with the chat bot requests
+                self.bug_notifier = BugNotifierUtility()
+            notifier = self.bug_notifier
+            jira_query = str(job_details.get("jira_query", notifier.fixed_jira_query))
+            header = str(job_details.get("header", notifier.string_header_with_response))
+            if str(job_details.get("incremental", notifier.incremental)).lower() == 'true':
+                return lambda: notifier.notify_changes(name, jira_query, room_id, header)
+            return lambda: notifier.notify_full_list(jira_query, room_id, header)
+        if job_type == "qdna_watch":
+            self.intialize_qdna_prerequisites()
+            targets = parse_build_targets(str(job_details["builds"]))
+            if not targets:
+                raise ValueError("No builds to watch in \"{}\"".format(job_details["builds"]))
+            header = str(job_details.get("header", "Testing Status Update --\n"))
+            return lambda: self.watch_testing_status(name, targets, room_id, header)
+        raise ValueError("Unknown job type {}".format(job_type))
+
+
+    def start_scheduler(self):
+        """
+            Starts the periodic jobs of scheduled_jobs in information.yaml
+            (daemon only), every job runs on its own interval
+        """
+        scheduled_jobs = self.doc.get("scheduled_jobs") or []
+        if not scheduled_jobs:
+            return
+        general_details = self.doc["general_details"]
+        # Jobs without an interval run every periodic_notifier_interval hours
+        default_interval = float(general_details.get("periodic_notifier_interval", 6)) * 3600
+        self.scheduler = JobScheduler(max_concurrent_jobs=general_details.get("scheduler_pool_size", 2))
+        for job_details in scheduled_jobs:
+            try:
+                function = self.create_scheduled_job(job_details)
+                self.scheduler.add_job(str(job_details["name"]), job_details.get("interval", default_interval),
+                                       function, jitter=job_details.get("jitter", 60),
+                                       run_at_start=str(job_details.get("run_at_start", False)).lower() == 'true')
+            except Exception as e:
+                self.logger.error("Skipping scheduled job {} -- {}".format(job_details, e))
+        self.scheduler.start()
+
+
+    def get_poll_lag(self):
+        """
+            Seconds since the webex group was last polled successfully,
+            collected by the chatbot_poll_lag_seconds gauge
+            :return: Dictionary of () to seconds, empty before the first poll
+        """
+        if self.last_poll_time is None:
+            return {}
+        return {(): time.time() - self.last_poll_time}
+
+
+    def start_metrics_server(self):
+        """
+            Starts the metrics endpoint if enabled in information.yaml
+            (general_details:metrics_enabled)
+        """
+        general_details = self.doc["general_details"]
+        if str(general_details.get("metrics_enabled", False)).lower() != 'true':
+            return
+        self.metrics_server = MetricsServer(host=general_details.get("metrics_host", "127.0.0.1"),
+                                            port=general_details.get("metrics_port", 9102))
+        self.metrics_server.start()
+
+
+    def get_poll_interval(self):
+        """
+            Returns the wait before the next poll. While the webhook
+            receiver is up polling only acts as a safety net for missed
+            callbacks
+            :return: Poll interval in seconds
+        """
+        if self.webhook_receiver is not None and self.webhook_receiver.is_alive():
+            return float(self.doc["webex_teams_details"].get("webhook_fallback_poll_interval", 60))
+        return self.read_time_interval
+
+
+    def handle_shutdown_signal(self, signum, frame):
+        """
+            Signal handler, asks the daemon loop to stop after the
+            current iteration
+            :param signum: Signal number
+            :param frame: Current stack frame
+        """
+        self.logger.info("Received signal {}, shutting down chat bot daemon...".format(signum))
+        self.stop_event.set()
+
+
+    def run_daemon(self):
+        """
+            Resident mode for the chat bot utility. Keeps configuration,
+            wrappers and connections in memory and polls the webex group
+            every chat_bot_read_time_interval seconds until SIGTERM or
+            SIGINT is received
+        """
+        self.daemon_mode = True
+        signal.signal(signal.SIGTERM, self.handle_shutdown_signal)
+        signal.signal(signal.SIGINT, self.handle_shutdown_signal)
+        self.intialize_prerequisites()
+        general_details = self.doc["general_details"]
+        self.watermark = ServedWatermark(self.update_served_timestamp)
+        self.dispatcher = RequestDispatcher(lanes={"default": general_details.get("worker_pool_size", 4),
+                                                   "ssh": general_details.get("ssh_worker_pool_size", 2)},
+                                            queue_size=general_details.get("dispatch_queue_size", 20))
+        self.start_webhook_receiver()
+        self.start_metrics_server()
+        self.start_scheduler()
+        self.logger.info("Starting chat bot daemon, polling every {} seconds...".format(self.get_poll_interval()))
+        while not self.stop_event.is_set():
+            iteration_start = time.time()
+            self.monitor_webex_group_and_take_action()
+            # Fixed rate scheduling, time spent serving requests is
+            # deducted from the wait before the next poll
+            elapsed = time.time() - iteration_start
+            self.stop_event.wait(max(0.0, self.get_poll_interval() - elapsed))
+        self.stop_webhook_receiver()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        self.dispatcher.shutdown()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.logger.info("Chat bot daemon stopped!!!")
+
+
+    def starter(self, daemon=False):
         """
             Starter method for the chat bot utility
+            :param daemon: Run as a resident daemon instead of serving a
+                           single iteration
         """
-        self.monitor_webex_group_and_take_action()
+        if daemon:
+            self.run_daemon()
+        else:
+            self.monitor_webex_group_and_take_action()
 
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ChatBot Utility")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep running and poll the webex group every chat_bot_read_time_interval seconds")
+    args = parser.parse_args()
     cbu_obj = ChatBotUtility()
-    cbu_obj.starter()
+    cbu_obj.starter(daemon=args.daemon)
@@ -11,7 +11,8 @@ class Installer:
 
     def setup_cronjob_for_periodic_bug_notifier(self):
         """
-            Sets up cronjob for periodic bug notifier
+            Sets up cronjob for periodic bug notifier, not needed when the
+            chat bot runs as a daemon (scheduled_jobs in information.yaml)
         """
         # init cron
         cron = CronTab()
@@ -0,0 +1,184 @@
+import re
+import logging
+
+
+def command(phrase, arguments=None, converters=None, lane="default", sensitive=False):
+    """
+        Decorator marking a method as a chat bot command handler, picked
+        up by CommandRouter.register_handlers
+        :param phrase: Command words the message starts with, e.g.
+                       "get bug details" (case insensitive)
+        :param arguments: Regex with named groups matched against the rest
+                          of the message, no arguments allowed if not given
+        :param converters: Dictionary of argument name to a function that
+                           converts the matched text, e.g. int
+        :param lane: Request dispatcher lane the command runs on
+        :param sensitive: Arguments carry credentials, they are never
+                          logged or stored
+        :return: Decorator
+    """
+    def decorator(function):
+        function.chatbot_command = {"phrase": phrase, "arguments": arguments,
+                                    "converters": converters, "lane": lane, "sensitive": sensitive}
+        return function
+    return decorator
+
+
+
+class Command:
+    """
+        A registered chat bot command
+    """
+    def __init__(self, phrase, handler, arguments=None, converters=None, lane="default", sensitive=False):
+        """
+            Init Method
+            :param phrase: Command words
+            :param handler: Function called with the parsed arguments
+            :param arguments: Regex with named groups for the arguments
+            :param converters: Dictionary of argument name to converter
+            :param lane: Request dispatcher lane
+            :param sensitive: Arguments carry credentials
+        """
+        self.phrase = phrase
+        self.handler = handler
+        self.pattern = re.compile(arguments if arguments else r"$", re.IGNORECASE)
+        self.converters = converters or {}
+        self.lane = lane
+        self.sensitive = sensitive
+
+
+    def parse_arguments(self, remainder):
+        """
+            Extract arguments from the text following the command words
+            :param remainder: Message text after the command words
+            :return: Dictionary of arguments, None if the text does not
+                     match the argument pattern
+        """
+        match = self.pattern.match(remainder)
+        if match is None:
+            return None
+        arguments = {}
+        for name, value in match.groupdict().items():
+            if value is not None and name in self.converters:
+                value = self.converters[name](value)
+            arguments[name] = value
+        return arguments
+
+
+
+class CommandRouter:
+    """
+        Command Router Class which maps chat bot messages to handler
+        functions. Command words are kept in a token trie, so routing a
+        message costs the same however many commands are registered and
+        the longest matching command always wins
+    """
+    TOKEN_REGEX = re.compile(r"\S+")
+    # Punctuation users put right after the command words
+    TOKEN_SUFFIXES = ":>"
+
+    def __init__(self):
+        """
+            Init Method
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        # token --> child node, the None key holds the Command ending there
+        self.trie = {}
+
+
+    def normalize_token(self, token):
+        """
+            Normalize a message token for matching against command words
+            :param token: Token
+            :return: Lower case token without trailing punctuation
+        """
+        return token.lower().rstrip(self.TOKEN_SUFFIXES)
+
+
+    def register(self, phrase, handler, arguments=None, converters=None, lane="default", sensitive=False):
+        """
+            Register a command
+            :param phrase: Command words
+            :param handler: Function called with the parsed arguments
+            :param arguments: Regex with named groups for the arguments
+            :param converters: Dictionary of argument name to converter
+            :param lane: Request dispatcher lane
+            :param sensitive: Arguments carry credentials
+        """
+        node = self.trie
+        for token in phrase.split():
+            node = node.setdefault(self.normalize_token(token), {})
+        node[None] = Command(phrase, handler, arguments, converters, lane, sensitive)
+        self.logger.info("Registered command: {}".format(phrase))
+
+
+    def register_handlers(self, handler_object):
+        """
+            Register every method of the object marked with the command
+            decorator
+            :param handler_object: Object with command handler methods
+        """
+        handler_class = handler_object.__class__
+        for name in dir(handler_class):
+            function = getattr(handler_class, name)
+            command_details = getattr(function, "chatbot_command", None)
+            if command_details is not None:
+                self.register(handler=getattr(handler_object, name), **command_details)
+
+
+    def match(self, message):
+        """
+            Find the command with the longest phrase the message starts
+            with
+            :param message: Message text
+            :return: (Command, remaining message text) or (None, None)
+        """
+        node = self.trie
+        matched = (None, None)
+        for token_match in self.TOKEN_REGEX.finditer(message):
+            node = node.get(self.normalize_token(token_match.group()))
+            if node is None:
+                break
+            if None in node:
+                matched = (node[None], message[token_match.end():])
+        return matched
+
+
+    def route(self, message):
+        """
+            Route a message to its command
+            :param message: Message text
+            :return: (Command, arguments dictionary), (Command, None) if the
+                     arguments are invalid, (None, None) if no command
+                     matches
+        """
+        command_object, remainder = self.match(message)
+        if command_object is None:
+            return None, None
+        remainder = remainder.strip().lstrip(self.TOKEN_SUFFIXES).strip()
+        return command_object, command_object.parse_arguments(remainder)
+
+
+    def get_lane(self, message):
+        """
+            Dispatcher lane for a message
+            :param message: Message text
+            :return: Lane name
+        """
+        command_object, remainder = self.match(message)
+        return command_object.lane if command_object is not None else "default"
+
+
+    def redact(self, message):
+        """
+            Message text safe to log and store, the arguments of sensitive
+            commands are replaced even if they do not parse
+            :param message: Message text
+            :return: Redacted text, None if no command matches
+        """
+        command_object, remainder = self.match(message)
+        if command_object is None:
+            return None
+        if command_object.sensitive:
+            return "{} <redacted>".format(command_object.phrase)
+        return message
@@ -1,49 +1,202 @@
+import re
+import time
+import bisect
 import logging
-import requests
 import datetime
+import threading
+from multiprocessing.pool import ThreadPool
+from GenericWrappper import GenericWrappper
+from Tracer import Tracer
 
 
 class FileServerWrapper:
     """
         File Server Wrapper Class which contains helper methods and other
-        required generic variables
+        required generic variables. Keeps an index of the builds in every
+        directory listing it has read, refreshed with conditional GETs
+        only when the listing has changed
     """
-    def __init__(self):
+    # Listing row of an ISO, e.g.
+    # <a href="maglev-1.3.0.100.iso">maglev-1.3.0.100.iso</a>   20-Feb-2020 10:22   4G
+    BUILD_ROW_REGEX = re.compile(r'<a href="(?P<build>[^"]+\.iso)">.*?</a>\s+'
+                                 r'(?P<upload_time>\d{1,2}-[A-Za-z]{3}-\d{4} \d{2}:\d{2})')
+    NO_BRANCH_TEXT = "Branch does not exist. Please provide correct branch prefix"
+    NO_BUILDS_TEXT = "No builds found for the branch"
+    UNREACHABLE_TEXT = "Fileserver is unreachable or failed to answer, please try again later"
+
+    def __init__(self, file_server_url='URL', min_refresh_interval=60, max_parallel_requests=4):
         """
             Init Method
             Declaring constants and creating logger object
+            :param file_server_url: File server URL, with the stable and
+                                    daily directories under it
+            :param min_refresh_interval: Seconds a listing is served from
+                                         the index before checking the
+                                         file server for changes
+            :param max_parallel_requests: Max listings fetched at once
         """
         self.logger = logging.getLogger('chatbot_logger')
+        self.generic_wrapper = GenericWrappper()
+        self.file_server_url = file_server_url
+        self.min_refresh_interval = float(min_refresh_interval)
+        self.max_parallel_requests = int(max_parallel_requests)
+        self.lock = threading.Lock()
+        # listing URL --> {"builds": [(upload time, build)...] sorted,
+        # "etag", "last_modified", "checked_at"}, builds is None if the
+        # listing does not exist
+        self.build_index = {}
+
+
+    def get_build_urls(self, branch):
+        """
+            Listing URLs of a branch
+            :param branch: Branch ID
+            :return: Stable build URL, Current build URL
+        """
+        return (self.file_server_url + 'stable/{}/'.format(branch),
+                self.file_server_url + 'daily/{}/'.format(branch))
+
+
+    def parse_listing(self, lines):
+        """
+            Parse a directory listing line by line
+            :param lines: Iterable of listing lines
+            :return: List of (upload time, build) tuples, sorted
+        """
+        builds = []
+        for line in lines:
+            if ".iso" not in line:
+                continue
+            for match in self.BUILD_ROW_REGEX.finditer(line):
+                try:
+                    upload_time = datetime.datetime.strptime(match.group("upload_time"), '%d-%b-%Y %H:%M')
+                except ValueError:
+                    self.logger.info("Skipping listing row with invalid time: {}".format(line))
+                    continue
+                bisect.insort(builds, (upload_time, match.group("build")))
+        return builds
+
+
+    def refresh_index(self, url, fresh=False):
+        """
+            Returns the index entry of the listing, asking the file server
+            for the listing only if it is older than min_refresh_interval,
+            and downloading it only if it has changed
+            :param url: Listing URL
+            :param fresh: Check the file server whatever the entry age
+            :return: Index entry
+            :raises IOError: File server unreachable
+        """
+        with self.lock:
+            entry = self.build_index.get(url)
+        if entry is not None and not fresh and time.time() - entry["checked_at"] < self.min_refresh_interval:
+            return entry
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        with Tracer.span("fileserver listing"):
+            response = self.generic_wrapper.requests_get(url=url, headers=headers, verify=True,
+                                                         do_not_set_proxy=True, stream=True)
+            if response is None:
+                raise IOError("Fileserver unreachable: {}".format(url))
+            try:
+                if response.status_code == 304:
+                    self.logger.info("Listing not modified: {}".format(url))
+                    new_entry = dict(entry, checked_at=time.time())
+                elif response.status_code == 404:
+                    new_entry = {"builds": None, "checked_at": time.time()}
+                else:
+                    response.raise_for_status()
+                    new_entry = {"builds": self.parse_listing(response.iter_lines(decode_unicode=True)),
+                                 "etag": response.headers.get("ETag"),
+                                 "last_modified": response.headers.get("Last-Modified"),
+                                 "checked_at": time.time()}
+                    self.logger.info("Indexed {} builds from {}".format(len(new_entry["builds"]), url))
+            finally:
+                response.close()
+        with self.lock:
+            self.build_index[url] = new_entry
+        return new_entry
+
 
+    def get_latest_build(self, url, fresh=False):
+        """
+            Latest build in the listing with its upload time
+            :param url: Listing URL
+            :param fresh: Check the file server whatever the index age
+            :return: (upload time, build), None if the listing does not
+                     exist or has no builds
+        """
+        builds = self.refresh_index(url, fresh)["builds"]
+        return builds[-1] if builds else None
 
-    def get_build(self, url):
+
+    def get_build(self, url, fresh=False):
         """
             Returns latest build ID string from the given file server URL
             :param url: URL to access file server
-            :return: Build ID string
+            :param fresh: Check the file server whatever the index age
+            :return: Build ID string, or the reason there is none
         """
         try:
-            latest = []
-            last_upload_time = datetime.datetime.strptime("20-Feb-1991 00:00", '%d-%b-%Y %H:%M')
-            response = requests.get(url)
-            response_text = response.text
-            if "404 Not Found" in response_text:
-                _text = "Branch does not exist. Please provide correct branch prefix"
-                self.logger.info(_text)
-                return _text
-            else:
-                lines = response_text.split("\n")
-                for line in lines:
-                    if ".iso" in line:
-                        el = line.split("         ")
-                        el[:] = [item.strip() for item in el if item != '']
-                        date_time_obj = datetime.datetime.strptime(el[1], '%d-%b-%Y %H:%M')
-                        if date_time_obj > last_upload_time:
-                            last_upload_time = date_time_obj
-                            latest = el
-                build = str(latest[0]).split('"')[1]
-                self.logger.info("Build: {}".format(build))
-                return build
+            entry = self.refresh_index(url, fresh)
         except Exception as e:
             self.logger.error("Failed to connect to fileserver...")
             self.logger.error("Error: {}".format(e))
+            return self.UNREACHABLE_TEXT
+        if entry["builds"] is None:
+            self.logger.info(self.NO_BRANCH_TEXT)
+            return self.NO_BRANCH_TEXT
+        if not entry["builds"]:
+            self.logger.info(self.NO_BUILDS_TEXT)
+            return self.NO_BUILDS_TEXT
+        build = entry["builds"][-1][1]
+        self.logger.info("Build: {}".format(build))
+        return build
+
+
+    def format_age(self, upload_time):
+        """
+            Human readable age of a build
+            :param upload_time: Upload time
+            :return: Age text, e.g. "5h" or "3d"
+        """
+        hours = int((datetime.datetime.now() - upload_time).total_seconds() // 3600)
+        return "{}d".format(hours // 24) if hours >= 48 else "{}h".format(max(hours, 0))
+
+
+    def get_builds_overview(self, branches, fresh=False):
+        """
+            Latest promoted and current build of every branch, listings
+            are fetched concurrently, max_parallel_requests at a time
+            :param branches: List of branch IDs
+            :param fresh: Check the file server whatever the index age
+            :return: List of message rows
+        """
+        urls = []
+        for branch in branches:
+            urls.extend(self.get_build_urls(branch))
+
+        def get_latest_build(url):
+            try:
+                return self.get_latest_build(url, fresh)
+            except Exception as e:
+                self.logger.error("Failed to read listing {} -- {}".format(url, e))
+                return None, "error"
+
+        pool = ThreadPool(max(1, min(self.max_parallel_requests, len(urls))))
+        try:
+            latest_builds = [latest_build or (None, "-")
+                             for latest_build in pool.map(Tracer.bind(get_latest_build), urls)]
+        finally:
+            pool.close()
+            pool.join()
+        table = []
+        for index, branch in enumerate(branches):
+            promoted, current = latest_builds[2 * index], latest_builds[2 * index + 1]
+            table.append([branch, promoted[1], current[1],
+                          self.format_age(current[0]) if current[0] is not None else "-"])
+        return ["Builds --\n"] + self.generic_wrapper.formulate_table_rows(["Branch", "Last Promoted",
+                                                                            "Current", "Current Age"], table)
@@ -1,8 +1,17 @@
 import json
 import logging
+import threading
 import ruamel.yaml
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from StateStore import StateStore
+from Tracer import Tracer
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
@@ -11,6 +20,11 @@ class GenericWrappper:
         Generic Wrapper Class which contains helper methods and other
         required generic variables
     """
+    # HTTP sessions shared by every wrapper object in the process, one
+    # session (and connection pool) per scheme and host
+    sessions = {}
+    sessions_lock = threading.Lock()
+
     def __init__(self):
         """
             Init Method
@@ -24,8 +38,14 @@ class GenericWrappper:
             self.proxies["http"] = str(doc["general_details"]["http_proxy"])
             self.proxies["https"] = str(doc["general_details"]["https_proxy"])
             self.proxy_flag = str(doc["general_details"]["proxy"])
+            self.http_pool_size = int(doc["general_details"].get("http_pool_size", 10))
+            self.http_max_retries = int(doc["general_details"].get("http_max_retries", 3))
+            self.http_backoff_factor = float(doc["general_details"].get("http_backoff_factor", 0.3))
+            self.state_db_path = str(doc["general_details"].get("state_db_path", "tmp/state.db"))
+        self.state_store = StateStore.get_store(self.state_db_path)
         self.HELP_TEXT = """Keywords (with examples):
         [Keywords are case insensitive]
+        [Add --fresh at the end of a bug details, testing status, build or jira keyword request to bypass cached results]
         Bug details:                    Gives a brief description for the given BUG-ID
                                         \t\t@BUG_NOTIFIER_BOT get bug details: BUG-ID
                                         \t\t@BUG_NOTIFIER_BOT get bug details: MAGLEV-6347
@@ -38,18 +58,31 @@ class GenericWrappper:
                                         \t\t@BUG_NOTIFIER_BOT get current build BRANCH
                                         \t\t@BUG_NOTIFIER_BOT get current build 1.3.0
 
-        Testing status:                 Gives overall testing status for a given build
+        Builds overview:                Gives last promoted and current build of several branches (configured branches if none given)
+                                        \t\t@BUG_NOTIFIER_BOT builds [BRANCH BRANCH...]
+                                        \t\t@BUG_NOTIFIER_BOT builds 1.3.0 1.4.0 2.1.0
+
+        Testing status:                 Gives overall testing status for a given build, or a comparison table for several builds
                                         \t\t@BUG_NOTIFIER_BOT get testing status: COMPONENT BUILD-ID
                                         \t\t@BUG_NOTIFIER_BOT get testing status: Maglev 1.3.0.100
+                                        \t\t@BUG_NOTIFIER_BOT get testing status: Maglev 1.3.0.100 1.3.0.101 Dnac 2.1.0.5
 
         Detailed testing status:        Gives detailed status of each regression job for a given build
                                         \t\t@BUG_NOTIFIER_BOT get detailed testing status: COMPONENT BUILD-ID
                                         \t\t@BUG_NOTIFIER_BOT get detailed testing status: Maglev 1.3.0.100
+                                        \t\t@BUG_NOTIFIER_BOT get detailed testing status: Maglev 1.3.0.100 1.3.0.101
 
         Troubleshoot cluster:           Runs a set of troubleshooting commands on given cluster and provide status in personal chat
                                         \t\t@BUG_NOTIFIER_BOT troubleshoot HOSTNAME SSH_USERNAME SSH_PASSWORD MAGLEV_USERNAME MAGLEV_PASSWORD
                                         \t\t@BUG_NOTIFIER_BOT troubleshoot 10.198.198.1 maglev maglev1@3 admin maglev1@3
 
+        Troubleshoot clusters:          Runs the troubleshooting commands on several clusters and provide a summary in personal chat
+                                        \t\t@BUG_NOTIFIER_BOT troubleshoot fleet HOSTS SSH_USERNAME SSH_PASSWORD MAGLEV_USERNAME MAGLEV_PASSWORD
+                                        \t\t@BUG_NOTIFIER_BOT troubleshoot fleet 10.198.198.1-4,10.198.199.10 maglev maglev1@3 admin maglev1@3
+
+        Stats:                          Gives time spent per backend (Webex, JIRA, QDNA, SSH, fileserver) and the latest requests
+                                        \t\t@BUG_NOTIFIER_BOT stats
+
         Add New Keyword:                Adds new keyword to query mapping
                                         \t\t@BUG_NOTIFIER_BOT Add Keyword > KEYWORD : JIRA QUERY
                                         \t\t@BUG_NOTIFIER_BOT Add Keyword > Open DNAC1.5 Bugs : type = Bug AND labels = dnac15-mf
@@ -60,46 +93,89 @@ class GenericWrappper:
         \n"""
 
 
+    def formulate_table_rows(self, header, table):
+        """
+            Formulate a fixed width table inside a markdown code block
+            :param header: List of column names
+            :param table: List of rows, each a list of cell values
+            :return: List of message rows
+        """
+        widths = [max(len(str(row[column])) for row in [header] + table) for column in range(len(header))]
+        line_format = " | ".join("{:<%d}" % width for width in widths)
+        rows = ["```\n", line_format.format(*header).rstrip() + "\n",
+                "-+-".join("-" * width for width in widths) + "\n"]
+        for row in table:
+            rows.append(line_format.format(*[str(cell) for cell in row]).rstrip() + "\n")
+        rows.append("```\n")
+        return rows
+
+
+    def load_metadata(self):
+        """
+            Load the chat bot state from the state store
+            :return: Metadata dictionary, same layout tmp/metadata.yaml had
+        """
+        return {"read_only": {"last_served_request": self.state_store.get("last_served_request"),
+                              "qdna_server_token": self.state_store.get("qdna_server_token")}}
+
+
     def update_timestamp(self, metadata, updated_time):
         """
-            Update last served request timestamp in
-            tmp/metadata.yaml
-            :param metadata: Timestamp
+            Update last served request timestamp in the state store
+            :param metadata: Metadata dictionary, updated in place
+            :param updated_time: Timestamp
         """
-        self.logger.info("Updating tmp/metadata.yaml...")
-        self.logger.info("With last served request timestamp")
+        self.logger.info("Updating last served request timestamp to {}".format(updated_time))
         metadata["read_only"]["last_served_request"] = updated_time
-        with open('tmp/metadata.yaml', 'w') as mfh:
-            self.yaml.dump(metadata, mfh)
-        self.logger.info("Successfully updated tmp/metadata.yaml!!!")
+        self.state_store.set("last_served_request", str(updated_time))
 
 
     def get_token(self):
         """
-            Get token from metadata.yaml file and return it
+            Get token from the state store and return it
             :return: X-Auth-Token for QDNA server
         """
-        self.logger.info("Accessing QDNA token from tmp/metadata.yaml...")
-        with open('tmp/metadata.yaml', 'r') as mfh:
-            metadata = self.yaml.load(mfh)
-            token = str(metadata['read_only']['qdna_server_token'])
-            self.logger.info("Successfully accessed token from tmp/metadata.yaml!!!")
-            return token
+        self.logger.info("Accessing QDNA token from the state store...")
+        return str(self.state_store.get("qdna_server_token"))
 
 
     def set_token(self, token):
         """
-            Set X-Auth-Token for QDNA server to metadata.yaml file
+            Set X-Auth-Token for QDNA server in the state store
         """
-        self.logger.info("Updating QDNA token in tmp/metadata.yaml...")
-        with open('tmp/metadata.yaml', 'r') as mfh:
-            metadata = self.yaml.load(mfh)
-        metadata['read_only']['qdna_server_token'] = str(token)
-        with open('tmp/metadata.yaml', 'w') as mfh:
-            self.yaml.dump(metadata, mfh)
+        self.logger.info("Updating QDNA token in the state store...")
+        self.state_store.set("qdna_server_token", str(token))
         self.logger.info("Successfully updated QDNA token")
 
 
+    def get_session(self, url):
+        """
+            Returns the shared HTTP session for the host of the given URL,
+            creating it on first use. Sessions keep connections alive and
+            retry failed connections with backoff
+            :param url: URL
+            :return: requests Session object
+        """
+        parsed_url = urlparse(url)
+        session_key = (parsed_url.scheme, parsed_url.netloc)
+        with GenericWrappper.sessions_lock:
+            session = GenericWrappper.sessions.get(session_key)
+            if session is None:
+                self.logger.info("Creating HTTP session for {}://{}".format(*session_key))
+                retries = Retry(total=self.http_max_retries,
+                                backoff_factor=self.http_backoff_factor,
+                                status_forcelist=(429, 502, 503, 504),
+                                raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.http_pool_size,
+                                      max_retries=retries)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                GenericWrappper.sessions[session_key] = session
+            return session
+
+
     def requests_post(self, url, data=None, headers=None,
                       auth=None, verify=False, do_not_set_proxy=False):
         """
@@ -114,50 +190,52 @@ class GenericWrappper:
             :return:     Returns output recieved from the POST API call
         """
         self.logger.info("POST API CALL")
-        self.logger.info("URL: {}".format(url))
-        self.logger.info("Data: {}".format(data))
-        self.logger.info("Authentication Headers: {}".format(headers))
+        self.logger.info("URL: %s", url)
+        self.logger.debug("Data: %s", data)
+        self.logger.debug("Authentication Headers: %s", headers)
         self.logger.info("Proxy Flag: {}".format(self.proxy_flag))
         self.logger.info("Proxies: {}".format(self.proxies))
         self.logger.info("do_not_set_proxy flag: {}".format(do_not_set_proxy))
         try:
-            if self.proxy_flag.lower() == 'true' and auth != None and do_not_set_proxy == False:
-                self.logger.info("Using proxy for the following POST API call...")
-                output = requests.post(url=url, verify=verify,
-                                       proxies=self.proxies, auth=auth,
-                                       timeout=5)
-            elif self.proxy_flag.lower() == 'true' and auth == None and do_not_set_proxy == False:
-                self.logger.info("Using proxy for the following POST API call...")
-                output = requests.post(url=url, headers=headers,
-                                       verify=verify,
-                                       data=json.dumps(data),
-                                       proxies=self.proxies, auth=auth,
-                                       timeout=5)
-            elif self.proxy_flag.lower() == 'false' and auth != None and do_not_set_proxy == False:
-                self.logger.info("Not using proxy for the following POST API call...")
-                output = requests.post(url = url, verify = verify,
-                                       auth = auth, timeout=5)
-            elif self.proxy_flag.lower() == 'false' and auth == None and do_not_set_proxy == False:
-                self.logger.info("Not using proxy for the following POST API call...")
-                output = requests.post(url=url, headers=headers,
-                                       verify=verify,
-                                       data=json.dumps(data), timeout=5)
-            elif do_not_set_proxy == True and auth != None:
-                self.logger.info("Not using proxy for the following POST API call...")
-                output = requests.post(url=url, verify=verify,
-                                       auth=auth, timeout=5)
-            elif do_not_set_proxy == True and auth == None:
-                self.logger.info("Not using proxy for the following POST API call...")
-                output = requests.post(url=url, headers=headers,
-                                       verify=verify,
-                                       data=json.dumps(data), timeout=5)
-            self.logger.info("Output: {}".format(output))
+            session = self.get_session(url)
+            with Tracer.span("http POST " + urlparse(url).netloc):
+                if self.proxy_flag.lower() == 'true' and auth != None and do_not_set_proxy == False:
+                    self.logger.info("Using proxy for the following POST API call...")
+                    output = session.post(url=url, verify=verify,
+                                          proxies=self.proxies, auth=auth,
+                                          timeout=5)
+                elif self.proxy_flag.lower() == 'true' and auth == None and do_not_set_proxy == False:
+                    self.logger.info("Using proxy for the following POST API call...")
+                    output = session.post(url=url, headers=headers,
+                                          verify=verify,
+                                          data=json.dumps(data),
+                                          proxies=self.proxies, auth=auth,
+                                          timeout=5)
+                elif self.proxy_flag.lower() == 'false' and auth != None and do_not_set_proxy == False:
+                    self.logger.info("Not using proxy for the following POST API call...")
+                    output = session.post(url = url, verify = verify,
+                                          auth = auth, timeout=5)
+                elif self.proxy_flag.lower() == 'false' and auth == None and do_not_set_proxy == False:
+                    self.logger.info("Not using proxy for the following POST API call...")
+                    output = session.post(url=url, headers=headers,
+                                          verify=verify,
+                                          data=json.dumps(data), timeout=5)
+                elif do_not_set_proxy == True and auth != None:
+                    self.logger.info("Not using proxy for the following POST API call...")
+                    output = session.post(url=url, verify=verify,
+                                          auth=auth, timeout=5)
+                elif do_not_set_proxy == True and auth == None:
+                    self.logger.info("Not using proxy for the following POST API call...")
+                    output = session.post(url=url, headers=headers,
+                                          verify=verify,
+                                          data=json.dumps(data), timeout=5)
+            self.logger.info("Output: %s", output)
             return output
         except Exception as e:
             self.logger.error("Error: {}".format(e))
 
 
-    def requests_get(self, url, headers=None, verify=False, do_not_set_proxy=False):
+    def requests_get(self, url, headers=None, verify=False, do_not_set_proxy=False, stream=False):
         """
             GET API CALL
             :param url: URL
@@ -165,26 +243,29 @@ class GenericWrappper:
             :param verify: Verify value
             :param do_not_set_proxy: Set it to true, if you don't want to use
                                      proxy for certain API calls
+            :param stream: Read the response body lazily
             :return:     Returns output recieved from the GET API call
         """
         self.logger.info("GET API CALL")
-        self.logger.info("URL: {}".format(url))
-        self.logger.info("Authentication Headers: {}".format(headers))
+        self.logger.info("URL: %s", url)
+        self.logger.debug("Authentication Headers: %s", headers)
         self.logger.info("Proxy Flag: {}".format(self.proxy_flag))
         self.logger.info("Proxies: {}".format(self.proxies))
         self.logger.info("Verify: {}".format(verify))
         self.logger.info("do_not_set_proxy flag: {}".format(do_not_set_proxy))
         try:
-            if self.proxy_flag.lower() == 'true' and do_not_set_proxy == False:
-                self.logger.info("Using proxy for the following GET API call...")
-                output = requests.get(url = url, verify = verify,
-                                      headers = headers, proxies = self.proxies,
-                                      timeout=8)
-            else:
-                self.logger.info("Not using proxy for the following GET API call...")
-                output = requests.get(url = url, verify = verify,
-                                      headers = headers, timeout=8)
-            self.logger.info("Output: {}".format(output))
+            session = self.get_session(url)
+            with Tracer.span("http GET " + urlparse(url).netloc):
+                if self.proxy_flag.lower() == 'true' and do_not_set_proxy == False:
+                    self.logger.info("Using proxy for the following GET API call...")
+                    output = session.get(url = url, verify = verify,
+                                         headers = headers, proxies = self.proxies,
+                                         timeout=8, stream = stream)
+                else:
+                    self.logger.info("Not using proxy for the following GET API call...")
+                    output = session.get(url = url, verify = verify,
+                                         headers = headers, timeout=8, stream = stream)
+            self.logger.info("Output: %s", output)
             return output
         except Exception as e:
             self.logger.error("Error: {}".format(e))
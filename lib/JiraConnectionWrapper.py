@@ -1,6 +1,17 @@
 import base64
 import logging
+import threading
 from jira import JIRA
+from jira.exceptions import JIRAError
+from Tracer import Tracer
+
+
+
+class JiraIssueNotFound(Exception):
+    """
+        Raised by run_jira_query when the query names an issue key that
+        does not exist, e.g. a deleted or moved issue
+    """
 
 
 
@@ -14,6 +25,8 @@ class JiraConnectionWrapper:
 
         """
         self.logger = logging.getLogger('chatbot_logger')
+        # Fields required to formulate the bug list message
+        self.MESSAGE_FIELDS = "summary,assignee"
 
 
     def get_jira_server_connection_object(self, jira_server_url, jira_user, jira_password):
@@ -34,58 +47,102 @@ class JiraConnectionWrapper:
             self.logger.error("Failed to connect to JIRA server: {}".format(e))
 
 
-    def run_jira_query(self, jira_object, jira_query):
+    def run_jira_query(self, jira_object, jira_query, fields=None, page_size=500, raise_not_found=False):
         """
             Runs a given jira query on the JIRA server
             and return list of issues
             :param jira_object: JIRA connection object
             :param jira_query: Valid jira query to run
-            :return: List of issues
+            :param fields: Comma separated issue fields to fetch, all
+                           fields are fetched if not given
+            :param page_size: Max issues fetched per search call
+            :param raise_not_found: Raise JiraIssueNotFound if the query
+                                    names an issue key that does not exist
+            :return: List of issues, None on failure
         """
         try:
             self.logger.info("Running the following JIRA query on JIRA server...")
             self.logger.info("Jira Query: {}".format(jira_query))
-            open_issues = jira_object.search_issues(jira_query, startAt=0,
-                                                    maxResults=0, json_result=False)
-            self.logger.info("Response: {}".format(open_issues))
+            self.logger.info("Fields: {}".format(fields))
+            open_issues = []
+            start_at = 0
+            while True:
+                page = jira_object.search_issues(jira_query, startAt=start_at,
+                                                 maxResults=page_size, fields=fields,
+                                                 json_result=False)
+                open_issues.extend(page)
+                start_at += len(page)
+                if not page or start_at >= page.total:
+                    break
+            self.logger.debug("Response: %s", open_issues)
             return open_issues
+        except JIRAError as e:
+            if e.status_code == 401:
+                # Session expired, let JiraClientManager reconnect
+                raise
+            if raise_not_found and e.status_code == 400 and "does not exist" in str(e.text):
+                raise JiraIssueNotFound(e.text)
+            self.logger.error("Failed to get a response for the JIRA query: {}".format(e))
         except Exception as e:
             self.logger.error("Failed to get a response for the JIRA query: {}".format(e))
 
 
-    def formulate_message_to_send(self, room_id, text_data, issues, jira_server_url, jira_object):
+    def formulate_message_rows(self, text_data, issues, jira_server_url):
         """
-            Lists open issues and populates required variables
+            Lists open issues, one markdown row per issue. Rows are
+            rendered lazily. Issues must have been fetched with
+            MESSAGE_FIELDS
+            :param text_data: Header text
             :param issues: List of open issues
-            :param room_id: Webex room ID
-            :param text_data: Data
-            :return: Data to send variable
+            :param jira_server_url: JIRA server URL
+            :return: Generator of message rows
         """
-        data_to_send = {}
         bug_count = 0
-        data_to_send["roomId"] = room_id
         four_spaces = "&nbsp;&nbsp;&nbsp;&nbsp;"
         seven_spaces = "&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;"
         if (issues):
-            text_data += "<br />"
+            yield text_data + "<br />"
             for issue in issues:
-                issue_str = str(issue)
-                self.logger.info("Issue: {}".format(issue_str))
+                issue_str = str(issue.key)
                 link = "{}browse/{}".format(jira_server_url,issue_str)
-                self.logger.info("Link: {}".format(link))
-                bug_details = jira_object.issue(issue_str)
-                text_data += "[{}]({}),{}Assignee: {},{}Summary: {}<br />".format(issue_str, link,
-                                                                                  four_spaces,
-                                                                                  bug_details.fields.assignee,
-                                                                                  seven_spaces,
-                                                                                  bug_details.fields.summary[:75])
+                yield "[{}]({}),{}Assignee: {},{}Summary: {}<br />".format(issue_str, link,
+                                                                           four_spaces,
+                                                                           issue.fields.assignee,
+                                                                           seven_spaces,
+                                                                           issue.fields.summary[:75])
                 bug_count += 1
         else:
             self.logger.info("No Issues found with the given jira query")
-        text_data += "Total Bugs: {}".format(bug_count)
-        self.logger.info("Data to send: {}".format(text_data))
-        data_to_send["markdown"] = text_data
-        return data_to_send
+            yield text_data
+        self.logger.info("Total Bugs: {}".format(bug_count))
+        yield "Total Bugs: {}".format(bug_count)
+
+
+    def formulate_diff_rows(self, text_data, new_issues, reassigned_issues, closed_issues, jira_server_url):
+        """
+            Lists the changes of a jira query result since the last run,
+            one markdown row per changed issue
+            :param text_data: Header text
+            :param new_issues: List of (key, issue summary) tuples
+            :param reassigned_issues: List of (key, issue summary, previous
+                                      assignee) tuples
+            :param closed_issues: List of (key, issue summary, status) tuples
+            :param jira_server_url: JIRA server URL
+            :return: Generator of message rows
+        """
+        yield text_data + "<br />"
+        for key, summary in new_issues:
+            yield "New: [{}]({}browse/{}), Assignee: {}, Summary: {}<br />".format(key, jira_server_url, key,
+                                                                                summary["assignee"],
+                                                                                summary["summary"][:75])
+        for key, summary, previous_assignee in reassigned_issues:
+            yield "Reassigned: [{}]({}browse/{}), {} --> {}<br />".format(key, jira_server_url, key,
+                                                                        previous_assignee, summary["assignee"])
+        for key, summary, status in closed_issues:
+            yield "Closed: [{}]({}browse/{}), Status: {}, Summary: {}<br />".format(key, jira_server_url, key,
+                                                                                 status, summary["summary"][:75])
+        yield "New: {}, Reassigned: {}, Closed: {}".format(len(new_issues), len(reassigned_issues),
+                                                           len(closed_issues))
 
 
     def get_bug_details(self, jira_object, bug_id):
@@ -127,4 +184,97 @@ class JiraConnectionWrapper:
         """
 
             :return:
-        """
\ No newline at end of file
+        """
+
+
+
+class JiraClientManager:
+    """
+        Jira Client Manager Class which creates the JIRA connection object
+        lazily on first use and shares it between requests and worker
+        threads, reconnecting when the session has expired
+    """
+    # One manager per JIRA server and user in the process
+    managers = {}
+    managers_lock = threading.Lock()
+
+    def __init__(self, jira_server_url, jira_user, jira_password):
+        """
+            Init Method
+            :param jira_server_url: JIRA server URL
+            :param jira_user: base64 encoded JIRA username
+            :param jira_password: base64 encoded JIRA password
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.jira_wrapper = JiraConnectionWrapper()
+        self.jira_server_url = jira_server_url
+        self.jira_user = jira_user
+        self.jira_password = jira_password
+        self.lock = threading.Lock()
+        self.jira_object = None
+
+
+    @classmethod
+    def get_manager(cls, jira_server_url, jira_user, jira_password):
+        """
+            Returns the shared client manager for the given JIRA server
+            and user, creating it on first use
+            :param jira_server_url: JIRA server URL
+            :param jira_user: base64 encoded JIRA username
+            :param jira_password: base64 encoded JIRA password
+            :return: JiraClientManager object
+        """
+        manager_key = (jira_server_url, jira_user)
+        with cls.managers_lock:
+            manager = cls.managers.get(manager_key)
+            if manager is None or manager.jira_password != jira_password:
+                manager = cls(jira_server_url, jira_user, jira_password)
+                cls.managers[manager_key] = manager
+            return manager
+
+
+    def get_client(self):
+        """
+            Returns the JIRA connection object, connecting to the JIRA
+            server if there is no live connection yet
+            :return: JIRA server connection object
+        """
+        with self.lock:
+            if self.jira_object is None:
+                self.jira_object = self.jira_wrapper.get_jira_server_connection_object(jira_server_url=self.jira_server_url,
+                                                                                       jira_user=self.jira_user,
+                                                                                       jira_password=self.jira_password)
+            return self.jira_object
+
+
+    def reset_client(self, stale_jira_object):
+        """
+            Drops the given connection object so that the next request
+            reconnects. Another thread may have reconnected already, in
+            which case the newer connection is kept
+            :param stale_jira_object: JIRA connection object that failed
+        """
+        with self.lock:
+            if self.jira_object is stale_jira_object:
+                self.jira_object = None
+
+
+    def run(self, operation, *args, **kwargs):
+        """
+            Runs operation(jira_object, *args, **kwargs) with the shared
+            JIRA connection object. If the JIRA session has expired it
+            reconnects and runs the operation once more
+            :param operation: Function taking JIRA connection object as
+                              its first argument
+            :return: Return value of the operation
+        """
+        with Tracer.span("jira " + operation.__name__):
+            jira_object = self.get_client()
+            try:
+                return operation(jira_object, *args, **kwargs)
+            except JIRAError as e:
+                if e.status_code != 401:
+                    raise
+                self.logger.info("JIRA session expired, reconnecting to JIRA server...")
+                self.reset_client(jira_object)
+                return operation(self.get_client(), *args, **kwargs)
@@ -0,0 +1,150 @@
+import time
+import random
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+class ScheduledJob:
+    """
+        A named job run every interval seconds
+    """
+    def __init__(self, name, interval, function, jitter=0, run_at_start=False):
+        """
+            Init Method
+            :param name: Job name, used in logs
+            :param interval: Seconds between runs
+            :param function: Function called without arguments
+            :param jitter: Max random delay in seconds added to every run,
+                           spreads jobs with the same interval
+            :param run_at_start: Run right after the scheduler starts
+                                 instead of one interval later
+        """
+        self.name = name
+        self.interval = float(interval)
+        self.function = function
+        self.jitter = float(jitter)
+        self.base_time = time.time() - (self.interval if run_at_start else 0)
+        self.next_run = self.schedule_next()
+        self.running = False
+        self.runs = 0
+        self.skipped_runs = 0
+
+
+    def schedule_next(self):
+        """
+            Advance the schedule by one interval, at a fixed rate so that
+            run times do not drift
+            :return: Next run time
+        """
+        now = time.time()
+        self.base_time += self.interval
+        if self.base_time < now - self.interval:
+            # Far behind (e.g. the host was suspended), not catching up
+            self.base_time = now
+        self.next_run = self.base_time + random.uniform(0, self.jitter)
+        return self.next_run
+
+
+
+class JobScheduler:
+    """
+        Job Scheduler Class which runs named periodic jobs inside the
+        resident chat bot process, on a shared pool of worker threads.
+        A job still running when its next run is due is skipped rather
+        than run twice at once
+    """
+    def __init__(self, max_concurrent_jobs=2):
+        """
+            Init Method
+            :param max_concurrent_jobs: Max jobs running at once
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.max_concurrent_jobs = int(max_concurrent_jobs)
+        self.jobs = []
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.pool = None
+        self.scheduler_thread = None
+
+
+    def add_job(self, name, interval, function, jitter=0, run_at_start=False):
+        """
+            Add a job, can be called before or after the scheduler starts
+            :param name: Job name
+            :param interval: Seconds between runs
+            :param function: Function called without arguments
+            :param jitter: Max random delay in seconds added to every run
+            :param run_at_start: Run right after the scheduler starts
+        """
+        with self.condition:
+            self.jobs.append(ScheduledJob(name, interval, function, jitter, run_at_start))
+            self.condition.notify()
+        self.logger.info("Scheduled job {} every {} seconds".format(name, interval))
+
+
+    def start(self):
+        """
+            Starts the scheduler thread
+        """
+        self.pool = ThreadPool(self.max_concurrent_jobs)
+        self.scheduler_thread = threading.Thread(target=self.scheduler_loop, name="job-scheduler")
+        self.scheduler_thread.daemon = True
+        self.scheduler_thread.start()
+        self.logger.info("Job scheduler started with {} jobs".format(len(self.jobs)))
+
+
+    def run_job(self, job):
+        """
+            Worker entry point, runs the job and clears its running flag
+            :param job: ScheduledJob object
+        """
+        start_time = time.time()
+        try:
+            self.logger.info("Running job {}...".format(job.name))
+            job.function()
+            self.logger.info("Job {} done in {:.1f} seconds".format(job.name, time.time() - start_time))
+        except Exception as e:
+            self.logger.error("Job {} failed -- {}".format(job.name, e))
+        finally:
+            with self.condition:
+                job.running = False
+                job.runs += 1
+
+
+    def scheduler_loop(self):
+        """
+            Scheduler thread, sleeps until the next job is due and hands
+            due jobs to the worker pool
+        """
+        with self.condition:
+            while not self.stopped:
+                now = time.time()
+                for job in self.jobs:
+                    if job.next_run > now:
+                        continue
+                    if job.running:
+                        job.skipped_runs += 1
+                        self.logger.warning("Job {} is still running, skipping this run".format(job.name))
+                    else:
+                        job.running = True
+                        self.pool.apply_async(self.run_job, (job,))
+                    job.schedule_next()
+                next_run = min([job.next_run for job in self.jobs] or [now + 60])
+                self.condition.wait(max(0.1, next_run - time.time()))
+
+
+    def stop(self, timeout=60):
+        """
+            Stops the scheduler and waits for running jobs to finish
+            :param timeout: Max seconds to wait for the scheduler thread
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.scheduler_thread is not None:
+            self.scheduler_thread.join(timeout)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        self.logger.info("Job scheduler stopped!!!")
@@ -1,32 +1,253 @@
+import sys
+import json
+import yaml
+import atexit
 import logging
+import threading
 from logging.handlers import RotatingFileHandler
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class TruncatingFormatter(logging.Formatter):
+    """
+        Log formatter which caps every logging argument at max_field_size
+        characters and the whole message at max_message_size characters,
+        so a full JIRA result or QDNA payload cannot flood the log file
+    """
+    def __init__(self, fmt=None, max_field_size=2000, max_message_size=8000):
+        """
+            Init Method
+            :param fmt: Log format
+            :param max_field_size: Max characters per logging argument
+            :param max_message_size: Max characters per log message
+        """
+        logging.Formatter.__init__(self, fmt)
+        self.max_field_size = int(max_field_size)
+        self.max_message_size = int(max_message_size)
+
+
+    def truncate(self, text, max_size):
+        """
+            Cap text at max_size characters
+            :param text: Text
+            :param max_size: Max characters
+            :return: Text, with a marker if truncated
+        """
+        if len(text) <= max_size:
+            return text
+        return "{}...[{} chars truncated]".format(text[:max_size], len(text) - max_size)
+
+
+    def get_message(self, record):
+        """
+            Log message with the size caps applied
+            :param record: Log record
+            :return: Message text
+        """
+        if isinstance(record.args, tuple) and record.args:
+            try:
+                message = str(record.msg) % tuple(self.truncate(str(arg), self.max_field_size)
+                                                  for arg in record.args)
+            except (TypeError, ValueError):
+                message = record.getMessage()
+        else:
+            message = record.getMessage()
+        return self.truncate(message, self.max_message_size)
+
+
+    def format(self, record):
+        """
+            Format the record with the size caps applied, the record itself
+            is left untouched
+            :param record: Log record
+            :return: Log line
+        """
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = self.get_message(record)
+        record.args = None
+        return logging.Formatter.format(self, record)
+
+
+
+class JsonLinesFormatter(TruncatingFormatter):
+    """
+        Log formatter writing one JSON object per line
+    """
+    def format(self, record):
+        """
+            Format the record as a JSON line
+            :param record: Log record
+            :return: Log line
+        """
+        line = {"time": self.formatTime(record),
+                "level": record.levelname,
+                "logger": record.name,
+                "thread": record.threadName,
+                "message": self.get_message(record)}
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line)
+
+
+
+class QueueHandler(logging.Handler):
+    """
+        Log handler which only puts the records on a queue, formatting
+        and writing are left to the LogWriter thread. Records are dropped
+        (and counted) rather than blocking the caller when the queue is
+        full
+    """
+    def __init__(self, record_queue):
+        """
+            Init Method
+            :param record_queue: Queue shared with the LogWriter
+        """
+        logging.Handler.__init__(self)
+        self.record_queue = record_queue
+        self.dropped_records = 0
+
+
+    def emit(self, record):
+        """
+            Queue a log record
+            :param record: Log record
+        """
+        try:
+            self.record_queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+
+
+class LogWriter:
+    """
+        Background thread writing the queued log records with the target
+        handlers
+    """
+    def __init__(self, queue_handler, handlers):
+        """
+            Init Method
+            :param queue_handler: QueueHandler feeding the queue
+            :param handlers: Handlers that format and write the records
+        """
+        self.queue_handler = queue_handler
+        self.record_queue = queue_handler.record_queue
+        self.handlers = handlers
+        self.reported_drops = 0
+        self.writer_thread = threading.Thread(target=self.writer_loop, name="log-writer")
+        self.writer_thread.daemon = True
+
+
+    def start(self):
+        """
+            Starts the writer thread
+        """
+        self.writer_thread.start()
+
+
+    def write(self, record):
+        """
+            Write a record with every target handler
+            :param record: Log record
+        """
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+    def writer_loop(self):
+        """
+            Writer thread, runs until the stop sentinel is queued
+        """
+        while True:
+            record = self.record_queue.get()
+            if record is None:
+                break
+            try:
+                self.write(record)
+                dropped_records = self.queue_handler.dropped_records
+                if dropped_records != self.reported_drops:
+                    self.write(logging.makeLogRecord({"name": record.name, "levelno": logging.WARNING,
+                                                      "levelname": "WARNING",
+                                                      "msg": "Log queue full, %s records dropped",
+                                                      "args": (dropped_records - self.reported_drops,)}))
+                    self.reported_drops = dropped_records
+            except Exception:
+                # Logging must never take the writer down
+                pass
+
+
+    def stop(self):
+        """
+            Writes the queued records and stops the writer thread
+        """
+        if self.writer_thread.is_alive():
+            self.record_queue.put(None)
+            self.writer_thread.join()
+        for handler in self.handlers:
+            handler.flush()
+
 
 
 class Logger:
     """
        Creates logger object for the Chat Bot Utility
     """
-    def __init__(self):
+    # Handlers are set up once per process
+    configured = False
+
+    def __init__(self, config_file='information.yaml'):
         """
-            Init Method, creating logger object
+            Init Method, creating logger object. Logging options are read
+            from the logging_details section of information.yaml
+            :param config_file: Configuration file
         """
+        self.logger = logging.getLogger("chatbot_logger")
+        if Logger.configured:
+            return
+        Logger.configured = True
         try:
+            logging_details = {}
+            try:
+                with open(config_file, 'r') as ifh:
+                    logging_details = yaml.safe_load(ifh).get("logging_details") or {}
+            except Exception as e:
+                sys.stderr.write("Using default logging options -- {}\n".format(e))
+
             # Setting name and level for the logger object
-            self.logger = logging.getLogger("chatbot_logger")
-            self.logger.setLevel(logging.INFO)
+            level = getattr(logging, str(logging_details.get("log_level", "INFO")).upper(), logging.INFO)
+            self.logger.setLevel(level)
 
             # Creating log file handler
-            handler = RotatingFileHandler('chat_bot.log',
+            handler = RotatingFileHandler(str(logging_details.get("log_file", "chat_bot.log")),
                                           maxBytes=5000000, backupCount=10)
 
             # Setting log level and creating logging format
-            handler.setLevel(logging.INFO)
-            formatter = logging.Formatter('%(asctime)s - %(name)s - '
-                                          '%(levelname)s - %(message)s')
+            handler.setLevel(level)
+            if str(logging_details.get("json_lines", False)).lower() == 'true':
+                formatter_class = JsonLinesFormatter
+            else:
+                formatter_class = TruncatingFormatter
+            formatter = formatter_class('%(asctime)s - %(name)s - '
+                                        '%(levelname)s - %(message)s',
+                                        max_field_size=logging_details.get("max_field_size", 2000),
+                                        max_message_size=logging_details.get("max_message_size", 8000))
             handler.setFormatter(formatter)
 
+            if str(logging_details.get("async_logging", False)).lower() == 'true':
+                # Records are formatted and written by a background thread,
+                # callers only pay for putting them on the queue
+                queue_handler = QueueHandler(queue.Queue(int(logging_details.get("queue_size", 10000))))
+                self.log_writer = LogWriter(queue_handler, [handler])
+                self.log_writer.start()
+                atexit.register(self.log_writer.stop)
+                handler = queue_handler
+
             # Adding handler to the logger object
             self.logger.addHandler(handler)
 
         except Exception as e:
-            self.logger.error("Error creating logger object...\nError -- %s".format(e))
+            self.logger.error("Error creating logger object...\nError -- {}".format(e))
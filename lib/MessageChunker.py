@@ -0,0 +1,90 @@
+import logging
+
+
+class MessageChunker:
+    """
+        Message Chunker Class which splits long replies into Webex
+        messages under the message size limit, at row boundaries and
+        without breaking code blocks. Sizes are UTF-8 encoded lengths,
+        Webex limits messages by bytes
+    """
+    CODE_FENCE = "```"
+
+    def __init__(self, max_message_size=7000):
+        """
+            Init Method
+            :param max_message_size: Max bytes per message, Webex
+                                     rejects messages above 7439 bytes
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.max_message_size = int(max_message_size)
+        # Room left in every message for closing an open code block
+        self.fence_overhead = len("\n" + self.CODE_FENCE)
+
+
+    def get_size(self, text):
+        """
+            Size of a text as sent to Webex
+            :param text: Text, unicode or UTF-8 encoded
+            :return: UTF-8 encoded length
+        """
+        if not isinstance(text, bytes):
+            text = text.encode('utf8')
+        return len(text)
+
+
+    def split_long_row(self, row):
+        """
+            Splits a single row that does not fit in one message, never
+            in the middle of a multi-byte character
+            :param row: Row text
+            :return: Generator of row pieces
+        """
+        piece_size = self.max_message_size - 2 * self.fence_overhead
+        if self.get_size(row) <= piece_size:
+            yield row
+            return
+        is_text = not isinstance(row, bytes)
+        data = row.encode('utf8') if is_text else row
+        start = 0
+        while start < len(data):
+            end = min(start + piece_size, len(data))
+            # Moving the cut back to the first byte of a character
+            while start + 1 < end < len(data) and ord(data[end:end + 1]) & 0xC0 == 0x80:
+                end -= 1
+            yield data[start:end].decode('utf8') if is_text else data[start:end]
+            start = end
+
+
+    def split_rows(self, rows):
+        """
+            Groups rows into messages under the size limit. Rows are
+            consumed lazily, so a generator of rows is never rendered in
+            full. A code block split across messages is closed at the end
+            of a message and reopened at the start of the next one
+            :param rows: Iterable of rows, each row carries its own line
+                         break or separator
+            :return: Generator of message texts
+        """
+        message_rows = []
+        message_size = 0
+        in_code_block = False
+        for row in rows:
+            for piece in self.split_long_row(row):
+                toggles_code_block = piece.count(self.CODE_FENCE) % 2 == 1
+                # Room for closing the code block is needed only if it is
+                # still open after this piece
+                closing_size = self.fence_overhead if in_code_block != toggles_code_block else 0
+                piece_size = self.get_size(piece)
+                if message_rows and message_size + piece_size + closing_size > self.max_message_size:
+                    if in_code_block:
+                        message_rows.append("\n" + self.CODE_FENCE)
+                    yield "".join(message_rows)
+                    message_rows = [self.CODE_FENCE + "\n"] if in_code_block else []
+                    message_size = sum(self.get_size(message_row) for message_row in message_rows)
+                message_rows.append(piece)
+                message_size += piece_size
+                if toggles_code_block:
+                    in_code_block = not in_code_block
+        if message_rows:
+            yield "".join(message_rows)
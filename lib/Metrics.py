@@ -0,0 +1,346 @@
+import bisect
+import logging
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+def format_labels(label_names, label_values, extra_labels=()):
+    """
+        Format the labels of a sample in the text exposition format
+        :param label_names: Tuple of label names
+        :param label_values: Tuple of label values
+        :param extra_labels: Tuple of (name, value) added at the end,
+                             e.g. the histogram bucket
+        :return: Label text, e.g. '{call="jira"}', empty if no labels
+    """
+    pairs = list(zip(label_names, label_values)) + list(extra_labels)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                           .replace("\n", "\\n"))
+                          for name, value in pairs) + "}"
+
+
+
+class Counter:
+    """
+        Monotonically increasing count, one per combination of labels
+    """
+    metric_type = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        """
+            Init Method
+            :param name: Metric name
+            :param help_text: Metric description
+            :param label_names: Tuple of label names
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+
+    def inc(self, amount=1, labels=()):
+        """
+            Increase the count
+            :param amount: Amount to add
+            :param labels: Tuple of label values
+        """
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+    def collect(self):
+        """
+            Samples of the metric
+            :return: List of exposition lines
+        """
+        with self.lock:
+            values = sorted(self.values.items())
+        return ["{}{} {}".format(self.name, format_labels(self.label_names, labels), value)
+                for labels, value in values]
+
+
+
+class Gauge(Counter):
+    """
+        Value that goes up and down, set directly or read from a function
+        when the metrics are collected
+    """
+    metric_type = "gauge"
+
+    def __init__(self, name, help_text, label_names=(), function=None):
+        """
+            Init Method
+            :param name: Metric name
+            :param help_text: Metric description
+            :param label_names: Tuple of label names
+            :param function: Called on every collection, returns the value,
+                             or a dictionary of label values tuple to value
+        """
+        Counter.__init__(self, name, help_text, label_names)
+        self.function = function
+
+
+    def set(self, value, labels=()):
+        """
+            Set the value
+            :param value: Value
+            :param labels: Tuple of label values
+        """
+        with self.lock:
+            self.values[labels] = value
+
+
+    def collect(self):
+        """
+            Samples of the metric
+            :return: List of exposition lines
+        """
+        if self.function is not None:
+            try:
+                values = self.function()
+            except Exception as e:
+                logging.getLogger('chatbot_logger').error("Failed to collect {} -- {}".format(self.name, e))
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+            with self.lock:
+                self.values = values
+        return Counter.collect(self)
+
+
+
+class Histogram:
+    """
+        Distribution of observed values over fixed buckets, one per
+        combination of labels
+    """
+    metric_type = "histogram"
+    # Seconds, suits backend calls and replies
+    DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+            Init Method
+            :param name: Metric name
+            :param help_text: Metric description
+            :param label_names: Tuple of label names
+            :param buckets: Sorted bucket upper bounds, +Inf is added
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_labels = ["{:g}".format(bound) for bound in self.buckets] + ["+Inf"]
+        self.lock = threading.Lock()
+        # label values --> [bucket counts (last one +Inf), sum, count]
+        self.values = {}
+
+
+    def observe(self, value, labels=()):
+        """
+            Record an observation
+            :param value: Observed value
+            :param labels: Tuple of label values
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+
+    def collect(self):
+        """
+            Samples of the metric, buckets are cumulative
+            :return: List of exposition lines
+        """
+        with self.lock:
+            values = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self.values.items())
+        lines = []
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bucket_label, bucket_count in zip(self.bucket_labels, counts):
+                cumulative += bucket_count
+                lines.append("{}_bucket{} {}".format(self.name, format_labels(self.label_names, labels,
+                                                                              (("le", bucket_label),)),
+                                                     cumulative))
+            lines.append("{}_sum{} {}".format(self.name, format_labels(self.label_names, labels), total))
+            lines.append("{}_count{} {}".format(self.name, format_labels(self.label_names, labels), count))
+        return lines
+
+
+
+class Metrics:
+    """
+        Metrics Registry Class, process wide set of named metrics shared
+        by every wrapper. Asking for a metric that already exists returns
+        it, so modules can look their metrics up wherever they need them
+    """
+    metrics = {}
+    metrics_lock = threading.Lock()
+
+    @classmethod
+    def get_metric(cls, metric_class, name, *args, **kwargs):
+        """
+            Returns the registered metric, creating it on first use
+            :param metric_class: Counter, Gauge or Histogram
+            :param name: Metric name
+            :return: Metric object
+        """
+        with cls.metrics_lock:
+            metric = cls.metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, *args, **kwargs)
+                cls.metrics[name] = metric
+            return metric
+
+
+    @classmethod
+    def counter(cls, name, help_text, label_names=()):
+        """
+            Registered counter
+            :param name: Metric name
+            :param help_text: Metric description
+            :param label_names: Tuple of label names
+            :return: Counter object
+        """
+        return cls.get_metric(Counter, name, help_text, label_names)
+
+
+    @classmethod
+    def gauge(cls, name, help_text, label_names=(), function=None):
+        """
+            Registered gauge
+            :param name: Metric name
+            :param help_text: Metric description
+            :param label_names: Tuple of label names
+            :param function: Called on every collection for the value
+            :return: Gauge object
+        """
+        return cls.get_metric(Gauge, name, help_text, label_names, function)
+
+
+    @classmethod
+    def histogram(cls, name, help_text, label_names=(), buckets=Histogram.DEFAULT_BUCKETS):
+        """
+            Registered histogram
+            :param name: Metric name
+            :param help_text: Metric description
+            :param label_names: Tuple of label names
+            :param buckets: Sorted bucket upper bounds
+            :return: Histogram object
+        """
+        return cls.get_metric(Histogram, name, help_text, label_names, buckets)
+
+
+    @classmethod
+    def render(cls):
+        """
+            Every metric in the text exposition format
+            :return: Exposition text
+        """
+        with cls.metrics_lock:
+            metrics = sorted(cls.metrics.items())
+        lines = []
+        for name, metric in metrics:
+            lines.append("# HELP {} {}".format(name, metric.help_text))
+            lines.append("# TYPE {} {}".format(name, metric.metric_type))
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+        HTTP server handling every request in its own thread
+    """
+    daemon_threads = True
+
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+        Request handler for the metrics server
+    """
+    def do_GET(self):
+        """
+            Serves the metrics on /metrics
+        """
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = Metrics.render().encode('utf8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        """
+            Sending access logs to the chat bot log instead of stderr
+        """
+        logging.getLogger('chatbot_logger').debug("Metrics server: " + format % args)
+
+
+
+class MetricsServer:
+    """
+        Metrics Server Class, small embedded HTTP server exposing the
+        registered metrics on /metrics for Prometheus to scrape
+    """
+    def __init__(self, host="127.0.0.1", port=9102):
+        """
+            Init Method
+            :param host: Address to listen on
+            :param port: Port to listen on
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.host = host
+        self.port = int(port)
+        self.server = None
+        self.server_thread = None
+
+
+    def start(self):
+        """
+            Starts the HTTP server in a background thread
+            :return: True if the server is listening
+        """
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), MetricsRequestHandler)
+            self.server_thread = threading.Thread(target=self.server.serve_forever, name="metrics-server")
+            self.server_thread.daemon = True
+            self.server_thread.start()
+            self.logger.info("Metrics server listening on {}:{}/metrics".format(self.host, self.port))
+            return True
+        except Exception as e:
+            self.logger.error("Failed to start metrics server: {}".format(e))
+            self.server = None
+            return False
+
+
+    def stop(self):
+        """
+            Stops the HTTP server
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.logger.info("Metrics server stopped!!!")
@@ -1,6 +1,31 @@
 import json
+import time
+import base64
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
 from GenericWrappper import GenericWrappper
+from TtlCache import TtlCache
+from Tracer import Tracer
+
+
+def parse_build_targets(text):
+    """
+        Parse the "PROJECT BUILD-ID [BUILD-ID...] [PROJECT BUILD-ID...]"
+        arguments of the testing status commands, build IDs start with a
+        digit and every other word switches the project
+        :param text: Arguments text
+        :return: List of (project, build ID) tuples
+    """
+    targets = []
+    project = None
+    for token in text.split():
+        if token[0].isdigit():
+            if project is not None:
+                targets.append((project, token))
+        else:
+            project = token
+    return targets
 
 
 
@@ -8,12 +33,28 @@ class QdnaConnectorWrapper:
     """
         QDNA Connector Wrapper Class containing helper methods
     """
-    def __init__(self, cluster_ip, username, password):
+    # Status values of a build whose testing is over
+    COMPLETED_STATUS_VALUES = ("Completed", "Complete", "Done", "Finished")
+
+    def __init__(self, cluster_ip, username, password, token_lifetime=3600, token_refresh_margin=300,
+                 cache_ttl=120, cache_size=256, completed_status_field="Status",
+                 completed_status_values=COMPLETED_STATUS_VALUES):
         """
             Init Method
             :param cluster_ip: Cluster IP
             :param username: Username
             :param password: Password
+            :param token_lifetime: Token lifetime in seconds, used when the
+                                   token does not carry its own expiry
+            :param token_refresh_margin: Seconds before expiry the token is
+                                         refreshed in the background
+            :param cache_ttl: Seconds the status of a build still under
+                              test is cached
+            :param cache_size: Max number of status payloads in memory
+            :param completed_status_field: Versions field holding the
+                                           build status
+            :param completed_status_values: Status values of a completed
+                                            build, whose status is pinned
         """
         self.generic_wrapper = GenericWrappper()
         self.cluster_ip = cluster_ip
@@ -21,9 +62,15 @@ class QdnaConnectorWrapper:
         self.password = password
         self.logger = logging.getLogger('chatbot_logger')
         self.url_request_header = {'content-type': 'application/json'}
-        self.get_token_url = "https://{}/api/system/v1/identitymgmt/token".format(cluster_ip)
         self.build_status_url = 'https://{}/api/qdna/v1/dashboard/dashboardapi/apic/products'.format(cluster_ip)
-        self.url_request_header['X-Auth-Token'] = self.generic_wrapper.get_token()
+        self.token_manager = QdnaTokenManager.get_manager(cluster_ip, username, password,
+                                                          token_lifetime, token_refresh_margin)
+        # Parsed status payloads per URL, completed builds are pinned in
+        # memory and spilled to the state store
+        self.status_cache = TtlCache("QDNA status", ttl=cache_ttl, max_size=cache_size)
+        self.completed_status_field = completed_status_field
+        self.completed_status_values = set(str(value).lower() for value in completed_status_values)
+        self.spilled_hits = 0
 
 
     def create_build_status_url(self, project, build_id):
@@ -51,140 +98,422 @@ class QdnaConnectorWrapper:
         return build_status_url, detailed_build_status_url
 
 
-    def get_token(self):
+    def get_from_qdna(self, url):
         """
-            Method to get token for the given cluster
-            :return: Maglev cluster token
+            GET request to the QDNA server with the cached token. If the
+            server still rejects the token it is refreshed (once for all
+            concurrent requests) and the request is sent once more
+            :param url: URL
+            :return: Response object
         """
-        try:
-            self.logger.info("---***--- Getting maglev token for {} ---***---".format(self.cluster_ip))
-            self.logger.info("Identity management get token URL: {}".format(self.get_token_url))
-            self.logger.info("Username: {}".format(self.username))
-            self.logger.info("Password: {}".format(self.password))
-            output = self.generic_wrapper.requests_post(url=self.get_token_url,
-                                                        auth=(self.username, self.password),
-                                                        do_not_set_proxy=True)
-            self.logger.info("Ouput Response Code: {}".format(output))
-            self.logger.info("Response: {}".format(output.content))
-            json_response = json.loads(output.content)
-            token = json_response['Token']
-            self.logger.info("TOKEN: {}".format(token))
-            self.url_request_header['X-Auth-Token'] = str(token)
-            # Chat Bot Utility specific requirements (Can be removed)
-            self.generic_wrapper.set_token(str(token))
-        except Exception as e:
-            self.logger.error("Failure in getting token,\nError -- {}".format(e))
+        token = self.token_manager.get_token()
+        headers = dict(self.url_request_header)
+        headers['X-Auth-Token'] = str(token)
+        output = self.generic_wrapper.requests_get(url=url, headers=headers, do_not_set_proxy=True)
+        self.logger.info("Ouput Response Code: %s", output)
+        self.logger.debug("Response: %s", output.content)
+        if "token expired" in output.text or "Unauthorized" in output.text:
+            headers['X-Auth-Token'] = str(self.token_manager.refresh(stale_token=token))
+            output = self.generic_wrapper.requests_get(url=url, headers=headers, do_not_set_proxy=True)
+            self.logger.info("Ouput Response Code: %s", output)
+            self.logger.debug("Response: %s", output.content)
+        return output
 
 
-    def formulate_testing_status_output(self, build_id, output):
+    def get_build_details_url(self, build_id):
         """
-            Get output content and formulate return text
-            :return: build statistics in string format
+            QDNA web page of the given build
+            :param build_id: Build ID
+            :return: URL
+        """
+        build_prefix = float(build_id[:3])
+        if build_prefix <= 1.4:
+            return "https://qdna.cisco.com/builds/{}/MAGLEV/Maglev[{}]/{}"\
+                   .format(build_id[:5], build_id[:5], build_id)
+        return "https://qdna.cisco.com/builds/{}/MAGLEV/Maglev[{}]/{}"\
+               .format(build_prefix, build_prefix, build_id)
+
+
+    def is_build_complete(self, build_status_url, payload=None):
+        """
+            Check if testing of a build is over, from its overall status
+            payload or, without one, from the pinned status of the build
+            :param build_status_url: Overall build status URL
+            :param payload: Overall build status payload
+            :return: True if complete
+        """
+        if payload is None:
+            return self.generic_wrapper.state_store.get_cache_entry("qdna", build_status_url) is not None
+        for element in payload.get("Versions", []):
+            if str(element.get(self.completed_status_field, "")).lower() in self.completed_status_values:
+                return True
+        return False
+
+
+    def get_status_payload(self, build_status_url, url, fresh=False):
+        """
+            Get a status payload of a build, from the cache if possible.
+            Status of a build still under test is cached for a short time,
+            status of a completed build never changes and is pinned
+            :param build_status_url: Overall build status URL
+            :param url: URL of the payload, overall or detailed status
+            :param fresh: Skip the cache and reload the payload
+            :return: Parsed payload, None if QDNA returned an error
+        """
+        if not fresh:
+            found, payload = self.status_cache.get(url)
+            if found:
+                self.logger.info("QDNA status cache hit: {}".format(url))
+                return payload
+            spilled = self.generic_wrapper.state_store.get_cache_entry("qdna", url)
+            if spilled is not None:
+                self.logger.info("QDNA status cache hit on disk: {}".format(url))
+                self.spilled_hits += 1
+                payload = json.loads(spilled)
+                self.status_cache.put(url, payload, ttl=float("inf"))
+                return payload
+        output = self.get_from_qdna(url)
+        if output.status_code != 200:
+            return None
+        payload = json.loads(output.content)
+        if self.is_build_complete(build_status_url, payload if url == build_status_url else None):
+            self.logger.info("Build testing complete, pinning status: {}".format(url))
+            self.status_cache.put(url, payload, ttl=float("inf"))
+            self.generic_wrapper.state_store.put_cache_entry("qdna", url, output.text)
+        else:
+            self.status_cache.put(url, payload)
+        self.logger.info("QDNA status cache stats: {}, {} hits on disk".format(self.status_cache.stats(),
+                                                                               self.spilled_hits))
+        return payload
+
+
+    def parse_testing_status(self, payload):
         """
-        return_text = "{} Testing Status --\n".format(build_id)
-        json_response = json.loads(output.content)
-        for element in json_response["Versions"]:
+            Get the overall testing status fields from the payload
+            :param payload: Overall build status payload
+            :return: List of (field, value) tuples
+        """
+        fields = []
+        for element in payload["Versions"]:
             for entity in element:
                 if "Score" in entity:
-                    return_text += "\t" + "{}: {} %".format("Pass Percentage", str(element[entity])) + "\n"
+                    fields.append(("Pass Percentage", "{} %".format(element[entity])))
                 elif "TrackingID" in entity or "VersionDetails" in entity:
                     pass
                 else:
-                    return_text += "\t" + "{}: {}".format(str(entity), str(element[entity])) + "\n"
-        build_prefix = float(build_id[:3])
-        if build_prefix <= 1.4:
-            return_text += "\nAdditional details can be found here -- " \
-                           "https://qdna.cisco.com/builds/{}/MAGLEV/Maglev[{}]/{}"\
-                           .format(build_id[:5], build_id[:5], build_id)
-        else:
-            return_text += "\nAdditional details can be found here -- " \
-                           "https://qdna.cisco.com/builds/{}/MAGLEV/Maglev[{}]/{}"\
-                           .format(build_prefix, build_prefix, build_id)
-        self.logger.info("Return text: {}".format(return_text))
+                    fields.append((str(entity), str(element[entity])))
+        return fields
+
+
+    def formulate_testing_status_output(self, build_id, payload):
+        """
+            Get payload and formulate return text
+            :return: build statistics in string format
+        """
+        rows = ["{} Testing Status --\n".format(build_id)]
+        for field, value in self.parse_testing_status(payload):
+            rows.append("\t{}: {}\n".format(field, value))
+        rows.append("\nAdditional details can be found here -- {}".format(self.get_build_details_url(build_id)))
+        return_text = "".join(rows)
+        self.logger.debug("Return text: %s", return_text)
         return return_text
 
 
-    def formulate_detailed_testing_status_output(self, build_id, output):
+    def formulate_detailed_testing_status_output(self, build_id, payload):
         """
-            Get detailed status output and formulate return text
+            Get detailed status payload and formulate return text
             :return: build statistics in string format
         """
-        return_text = "{} Detailed Testing Status --\n".format(build_id)
-        json_response = json.loads(output.content)
-        for entity in json_response['Components']:
-            self.logger.info("\t{} -- Total Tests - {}, Pass Percentage - {} %, Failures - {}\n"
-                             .format(entity['ComponentName'], entity['TotalTests'],
-                                     entity['Score'], entity['TotalFails']))
-            return_text += "\t{} -- Total Tests - {}, Pass Percentage - {} %, Failures - {}\n"\
-                            .format(entity['ComponentName'], entity['TotalTests'],
-                                    entity['Score'], entity['TotalFails'])
+        rows = ["{} Detailed Testing Status --\n".format(build_id)]
+        for entity in payload['Components']:
+            rows.append("\t{} -- Total Tests - {}, Pass Percentage - {} %, Failures - {}\n"
+                        .format(entity['ComponentName'], entity['TotalTests'],
+                                entity['Score'], entity['TotalFails']))
             if len(entity['TestSuiteList']) > 1:
                 for ts in entity['TestSuiteList']:
-                    self.logger.info("\t\t{} -- Total Tests - {}, Pass Percentage - {} %, Failures - {}\n"
-                                     .format(ts['TestSuiteName'], ts['TotalTests'],
-                                             ts['Score'], ts['TotalFails']))
-                    return_text += "\t\t{} -- Total Tests - {}, Pass Percentage - {} %, Failures - {}\n"\
-                                     .format(ts['TestSuiteName'], ts['TotalTests'],
-                                             ts['Score'], ts['TotalFails'])
-        self.logger.info("Return text: {}".format(return_text))
+                    rows.append("\t\t{} -- Total Tests - {}, Pass Percentage - {} %, Failures - {}\n"
+                                .format(ts['TestSuiteName'], ts['TotalTests'],
+                                        ts['Score'], ts['TotalFails']))
+        return_text = "".join(rows)
+        self.logger.debug("Return text: %s", return_text)
         return return_text
 
 
-    def get_testing_status_from_qdna(self, project, build_id):
+    def get_testing_status_from_qdna(self, project, build_id, fresh=False):
         """
             Get overall testing status for a given build in a project and
             return text ouput
             :param project: Project
             :param build_id: Build ID
+            :param fresh: Skip the cache
             :return: Build statistics
         """
         build_status_url, detailed_build_status_url = self.create_build_status_url(project, build_id)
         self.logger.info("Get build status final URL: {}".format(build_status_url))
-        self.logger.info("Header: {}".format(self.url_request_header))
-        output = self.generic_wrapper.requests_get(url=build_status_url,
-                                                   headers=self.url_request_header,
-                                                   do_not_set_proxy=True)
-        self.logger.info("Ouput Response Code: {}".format(output))
-        self.logger.info("Response: {}".format(output.content))
-        if "token expired" in output.content or "Unauthorized" in output.content:
-            self.get_token()
-            output = self.generic_wrapper.requests_get(url=build_status_url,
-                                                       headers=self.url_request_header,
-                                                       do_not_set_proxy=True)
-            return_text = self.formulate_testing_status_output(build_id=build_id, output=output)
-        elif "200" in str(output):
-            return_text = self.formulate_testing_status_output(build_id=build_id, output=output)
+        payload = self.get_status_payload(build_status_url, build_status_url, fresh)
+        if payload is not None:
+            return_text = self.formulate_testing_status_output(build_id=build_id, payload=payload)
         else:
             return_text = "Error getting status from QDNA"
         return return_text
 
 
-    def get_detailed_testing_status_from_qdna(self, project, build_id):
+    def get_detailed_testing_status_from_qdna(self, project, build_id, fresh=False):
         """
             Get overall testing status for a given build in a project and
             return text ouput
             :param project: Project
             :param build_id: Build ID
+            :param fresh: Skip the cache
             :return: Build statistics
         """
         build_status_url, detailed_build_status_url = self.create_build_status_url(project, build_id)
         self.logger.info("Get detailed build status final URL: {}".format(detailed_build_status_url))
-        self.logger.info("Header: {}".format(self.url_request_header))
-        output = self.generic_wrapper.requests_get(url = detailed_build_status_url,
-                                                   headers = self.url_request_header,
-                                                   do_not_set_proxy=True)
-        self.logger.info("Ouput Response Code: {}".format(output))
-        self.logger.info("Response: {}".format(output.content))
-        if "token expired" in output.content or "Unauthorized" in output.content:
-            self.get_token()
-            output = self.generic_wrapper.requests_get(url = detailed_build_status_url,
-                                                       headers = self.url_request_header,
-                                                       do_not_set_proxy=True)
-            self.logger.info("Ouput Response Code: {}".format(output))
-            self.logger.info("Response: {}".format(output.content))
-            return_text = self.formulate_detailed_testing_status_output(build_id=build_id, output=output)
-        elif "200" in output:
-            return_text = self.formulate_detailed_testing_status_output(build_id=build_id, output=output)
+        payload = self.get_status_payload(build_status_url, detailed_build_status_url, fresh)
+        if payload is not None:
+            return_text = self.formulate_detailed_testing_status_output(build_id=build_id, payload=payload)
         else:
             return_text = "Error getting status from QDNA"
         return return_text
+
+
+    def parse_component_status(self, payload):
+        """
+            Get the per component testing status from the detailed status
+            payload
+            :param payload: Detailed build status payload
+            :return: List of (component, status) tuples
+        """
+        return [(entity['ComponentName'], "{} % ({}/{} failed)".format(entity['Score'], entity['TotalFails'],
+                                                                      entity['TotalTests']))
+                for entity in payload['Components']]
+
+
+    def fetch_build_status(self, target, detailed=False, fresh=False):
+        """
+            Fetch and parse the testing status of one build
+            :param target: (project, build ID) tuple
+            :param detailed: Fetch per component status instead of the
+                             overall status
+            :param fresh: Skip the cache
+            :return: List of (field, value) tuples, None on failure
+        """
+        project, build_id = target
+        try:
+            build_status_url, detailed_build_status_url = self.create_build_status_url(project, build_id)
+            if detailed:
+                payload = self.get_status_payload(build_status_url, detailed_build_status_url, fresh)
+                return self.parse_component_status(payload) if payload is not None else None
+            payload = self.get_status_payload(build_status_url, build_status_url, fresh)
+            return self.parse_testing_status(payload) if payload is not None else None
+        except Exception as e:
+            self.logger.error("Error getting status of {} {} from QDNA: {}".format(project, build_id, e))
+            return None
+
+
+    def get_testing_status_for_builds(self, targets, detailed=False, max_parallel_requests=4, fresh=False):
+        """
+            Fetch the testing status of several builds at once and return
+            a comparison table, one column per build
+            :param targets: List of (project, build ID) tuples
+            :param detailed: Compare per component status instead of the
+                             overall status
+            :param max_parallel_requests: Max QDNA requests in flight
+            :param fresh: Skip the cache
+            :return: List of message rows
+        """
+        self.logger.info("Fetching testing status of {} builds".format(len(targets)))
+        pool = ThreadPool(max(1, min(int(max_parallel_requests), len(targets))))
+        try:
+            results = pool.map(Tracer.bind(lambda target: self.fetch_build_status(target, detailed, fresh)), targets)
+        finally:
+            pool.close()
+            pool.join()
+        # Fields in the order they first appear
+        field_names = []
+        for fields in results:
+            for field, value in fields or []:
+                if field not in field_names:
+                    field_names.append(field)
+        header = ["Component" if detailed else "Field"] + ["{} {}".format(project, build_id)
+                                                          for project, build_id in targets]
+        table = []
+        for field in field_names:
+            table.append([field] + [dict(fields).get(field, "-") if fields is not None else "error"
+                                    for fields in results])
+        if not table:
+            table.append(["Status"] + ["error"] * len(targets))
+        title = "Detailed Testing Status Comparison --\n" if detailed else "Testing Status Comparison --\n"
+        return [title] + self.generic_wrapper.formulate_table_rows(header, table)
+
+
+
+class QdnaTokenManager:
+    """
+        QDNA Token Manager Class which keeps the cluster token in memory
+        along with its expiry, refreshes it in a background thread before
+        it lapses and merges concurrent refreshes into a single
+        identitymgmt/token call
+    """
+    # One manager per cluster and user in the process
+    managers = {}
+    managers_lock = threading.Lock()
+    # Wait before retrying a failed background refresh
+    RETRY_INTERVAL = 30
+
+    def __init__(self, cluster_ip, username, password, token_lifetime=3600, token_refresh_margin=300):
+        """
+            Init Method
+            :param cluster_ip: Cluster IP
+            :param username: Username
+            :param password: Password
+            :param token_lifetime: Token lifetime in seconds, used when the
+                                   token does not carry its own expiry
+            :param token_refresh_margin: Seconds before expiry the token is
+                                         refreshed in the background
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.generic_wrapper = GenericWrappper()
+        self.cluster_ip = cluster_ip
+        self.username = username
+        self.password = password
+        self.token_lifetime = int(token_lifetime)
+        self.token_refresh_margin = int(token_refresh_margin)
+        self.get_token_url = "https://{}/api/system/v1/identitymgmt/token".format(cluster_ip)
+        self.condition = threading.Condition()
+        self.refreshing = False
+        self.refresher_thread = None
+        # Token saved by a previous run, used until it expires
+        self.token = self.generic_wrapper.get_token()
+        self.expires_at = float(self.generic_wrapper.state_store.get("qdna_token_expires_at", 0))
+
+
+    @classmethod
+    def get_manager(cls, cluster_ip, username, password, token_lifetime=3600, token_refresh_margin=300):
+        """
+            Returns the shared token manager for the given cluster and
+            user, creating it on first use
+            :param cluster_ip: Cluster IP
+            :param username: Username
+            :param password: Password
+            :param token_lifetime: Default token lifetime in seconds
+            :param token_refresh_margin: Background refresh margin in seconds
+            :return: QdnaTokenManager object
+        """
+        manager_key = (cluster_ip, username)
+        with cls.managers_lock:
+            manager = cls.managers.get(manager_key)
+            if manager is None or manager.password != password:
+                manager = cls(cluster_ip, username, password, token_lifetime, token_refresh_margin)
+                cls.managers[manager_key] = manager
+            return manager
+
+
+    def get_token_expiry(self, token):
+        """
+            Expiry time of the token, read from the "exp" claim if the
+            token is a JWT
+            :param token: Token
+            :return: Expiry as epoch seconds
+        """
+        try:
+            payload = token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+            return float(json.loads(base64.urlsafe_b64decode(payload.encode('utf8')).decode('utf8'))["exp"])
+        except Exception:
+            return time.time() + self.token_lifetime
+
+
+    def fetch_token(self):
+        """
+            Requests a new token from the cluster and saves it
+            :return: (token, expiry as epoch seconds)
+        """
+        self.logger.info("---***--- Getting maglev token for {} ---***---".format(self.cluster_ip))
+        self.logger.info("Identity management get token URL: {}".format(self.get_token_url))
+        self.logger.info("Username: {}".format(self.username))
+        output = self.generic_wrapper.requests_post(url=self.get_token_url,
+                                                    auth=(self.username, self.password),
+                                                    do_not_set_proxy=True)
+        self.logger.info("Ouput Response Code: %s", output)
+        token = str(json.loads(output.content)['Token'])
+        expires_at = self.get_token_expiry(token)
+        # Chat Bot Utility specific requirements (Can be removed)
+        self.generic_wrapper.set_token(token)
+        self.generic_wrapper.state_store.set("qdna_token_expires_at", str(expires_at))
+        self.logger.info("New maglev token valid for {} seconds".format(int(expires_at - time.time())))
+        return token, expires_at
+
+
+    def refresh(self, stale_token=None):
+        """
+            Refreshes the token. If another thread is refreshing already
+            the call waits for it and uses its token instead of sending
+            another request
+            :param stale_token: Token the caller found to be expired or
+                                rejected
+            :return: Token
+        """
+        with self.condition:
+            while self.refreshing:
+                self.condition.wait()
+            if self.token != stale_token and time.time() < self.expires_at:
+                return self.token
+            self.refreshing = True
+        token, expires_at = self.token, self.expires_at
+        try:
+            token, expires_at = self.fetch_token()
+        except Exception as e:
+            self.logger.error("Failure in getting token,\nError -- {}".format(e))
+        finally:
+            with self.condition:
+                self.token, self.expires_at = token, expires_at
+                self.refreshing = False
+                self.condition.notify_all()
+        return token
+
+
+    def get_token(self):
+        """
+            Returns the cached token, refreshing it first only if it has
+            already expired
+            :return: Token
+        """
+        self.start_refresher()
+        with self.condition:
+            if not self.refreshing and self.token and time.time() < self.expires_at:
+                return self.token
+            stale_token = self.token
+        return self.refresh(stale_token)
+
+
+    def start_refresher(self):
+        """
+            Starts the background refresher thread once
+        """
+        with self.condition:
+            if self.refresher_thread is not None:
+                return
+            self.refresher_thread = threading.Thread(target=self.refresher_loop,
+                                                     name="qdna-token-refresher")
+            self.refresher_thread.daemon = True
+            self.refresher_thread.start()
+
+
+    def refresher_loop(self):
+        """
+            Background thread refreshing the token token_refresh_margin
+            seconds before it expires
+        """
+        while True:
+            with self.condition:
+                stale_token = self.token
+                expires_at = self.expires_at
+            delay = expires_at - self.token_refresh_margin - time.time()
+            if delay > 0:
+                time.sleep(delay)
+                continue
+            self.refresh(stale_token)
+            # Bounds the refresh rate if the refresh failed or the token
+            # lifetime is shorter than the refresh margin
+            time.sleep(self.RETRY_INTERVAL)
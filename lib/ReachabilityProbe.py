@@ -0,0 +1,156 @@
+import os
+import time
+import socket
+import select
+import struct
+import logging
+from multiprocessing.pool import ThreadPool
+
+
+class ReachabilityProbe:
+    """
+        Reachability Probe Class which checks if hosts are up without
+        spawning processes -- a TCP connect to a service port and,
+        optionally, an ICMP echo through a socket when the process is
+        allowed to open one. Many hosts are probed concurrently
+    """
+    ICMP_ECHO_REQUEST = 8
+    ICMP_ECHO_REPLY = 0
+    ICMP_PAYLOAD = b"chatbot-probe"
+
+    def __init__(self, timeout=2, icmp_enabled=False, max_parallel_probes=32):
+        """
+            Init Method
+            :param timeout: Seconds a single probe may take
+            :param icmp_enabled: Also send an ICMP echo, needs a raw socket
+                                 (root) or unprivileged ICMP sockets
+                                 (net.ipv4.ping_group_range)
+            :param max_parallel_probes: Max hosts probed at once
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.timeout = float(timeout)
+        self.icmp_enabled = icmp_enabled
+        self.max_parallel_probes = int(max_parallel_probes)
+
+
+    def tcp_probe(self, hostname, port):
+        """
+            Check if a TCP connection to the port can be opened
+            :param hostname: Hostname/IP
+            :param port: Port
+            :return: True if the port accepted the connection
+        """
+        try:
+            sock = socket.create_connection((hostname, int(port)), timeout=self.timeout)
+            sock.close()
+            return True
+        except Exception as e:
+            self.logger.info("TCP probe of {}:{} failed -- {}".format(hostname, port, e))
+            return False
+
+
+    def calculate_checksum(self, packet):
+        """
+            Internet checksum of an ICMP packet
+            :param packet: Packet bytes
+            :return: Checksum
+        """
+        if len(packet) % 2:
+            packet += b"\0"
+        total = sum(struct.unpack("!%dH" % (len(packet) // 2), packet))
+        total = (total >> 16) + (total & 0xffff)
+        total += total >> 16
+        return ~total & 0xffff
+
+
+    def open_icmp_socket(self):
+        """
+            Open a raw ICMP socket, or an unprivileged ICMP socket
+            :return: (socket, True if raw) or (None, False) if the process
+                     is not allowed to open either
+        """
+        try:
+            return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+        except socket.error:
+            pass
+        try:
+            return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+        except socket.error:
+            return None, False
+
+
+    def icmp_probe(self, hostname):
+        """
+            Send an ICMP echo request and wait for the reply
+            :param hostname: Hostname/IP
+            :return: True if the host replied, False if not, None if ICMP
+                     sockets are not available
+        """
+        sock, raw = self.open_icmp_socket()
+        if sock is None:
+            return None
+        try:
+            address = socket.gethostbyname(hostname)
+            identifier = (os.getpid() ^ id(sock)) & 0xffff
+            header = struct.pack("!BBHHH", self.ICMP_ECHO_REQUEST, 0, 0, identifier, 1)
+            checksum = self.calculate_checksum(header + self.ICMP_PAYLOAD)
+            header = struct.pack("!BBHHH", self.ICMP_ECHO_REQUEST, 0, checksum, identifier, 1)
+            sock.sendto(header + self.ICMP_PAYLOAD, (address, 0))
+            deadline = time.time() + self.timeout
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                    return False
+                data, source = sock.recvfrom(1024)
+                if source[0] != address:
+                    continue
+                # Raw sockets receive the IP header too, unprivileged
+                # ICMP sockets get the ICMP message only and the kernel
+                # takes care of the identifier
+                offset = (struct.unpack("!B", data[:1])[0] & 0x0f) * 4 if raw else 0
+                reply_type, code, reply_checksum, reply_identifier, sequence = \
+                    struct.unpack("!BBHHH", data[offset:offset + 8])
+                if reply_type == self.ICMP_ECHO_REPLY and (not raw or reply_identifier == identifier):
+                    return True
+        except Exception as e:
+            self.logger.info("ICMP probe of {} failed -- {}".format(hostname, e))
+            return False
+        finally:
+            sock.close()
+
+
+    def probe(self, hostname, port):
+        """
+            Probe a single host
+            :param hostname: Hostname/IP
+            :param port: TCP port to connect to
+            :return: Dictionary with hostname, reachable, tcp, icmp (None
+                     if not probed) and seconds taken
+        """
+        start_time = time.time()
+        tcp = self.tcp_probe(hostname, port)
+        icmp = self.icmp_probe(hostname) if self.icmp_enabled and not tcp else None
+        result = {"hostname": hostname,
+                  "reachable": tcp or bool(icmp),
+                  "tcp": tcp,
+                  "icmp": icmp,
+                  "seconds": time.time() - start_time}
+        self.logger.info("Reachability of {}: {}".format(hostname, result))
+        return result
+
+
+    def probe_many(self, hostnames, port):
+        """
+            Probe many hosts concurrently
+            :param hostnames: List of hostnames/IPs
+            :param port: TCP port to connect to
+            :return: List of probe results in the order of the hosts
+        """
+        if not hostnames:
+            return []
+        pool = ThreadPool(max(1, min(self.max_parallel_probes, len(hostnames))))
+        try:
+            return pool.map(lambda hostname: self.probe(hostname, port), hostnames)
+        finally:
+            pool.close()
+            pool.join()
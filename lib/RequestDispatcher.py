@@ -0,0 +1,193 @@
+import logging
+import threading
+from collections import OrderedDict
+from Metrics import Metrics
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class RequestDispatcher:
+    """
+        Request Dispatcher Class which runs chat bot requests on bounded
+        pools of worker threads, one pool (lane) per type of request
+    """
+    def __init__(self, lanes, queue_size=20, submit_timeout=30):
+        """
+            Init Method
+            Creating worker queues and starting worker threads
+            :param lanes: Dictionary of lane name to number of workers
+            :param queue_size: Max number of requests queued per worker
+            :param submit_timeout: Seconds to wait for a free queue slot
+                                   before giving up on a request
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.submit_timeout = submit_timeout
+        self.submitted_counter = Metrics.counter("chatbot_dispatch_requests_total",
+                                                 "Requests submitted to the dispatcher by lane and result",
+                                                 ("lane", "result"))
+        Metrics.gauge("chatbot_dispatch_queue_depth", "Requests waiting in the dispatcher queues", ("lane",),
+                      function=self.get_queue_depths)
+        self.lanes = {}
+        self.workers = []
+        for lane, worker_count in lanes.items():
+            self.lanes[lane] = []
+            for index in range(max(1, int(worker_count))):
+                worker_queue = queue.Queue(maxsize=queue_size)
+                worker = threading.Thread(target=self.worker_loop, args=(worker_queue,),
+                                          name="{}-worker-{}".format(lane, index))
+                worker.daemon = True
+                worker.start()
+                self.lanes[lane].append(worker_queue)
+                self.workers.append(worker)
+            self.logger.info("Started {} worker(s) for {} lane".format(len(self.lanes[lane]), lane))
+
+
+    def worker_loop(self, worker_queue):
+        """
+            Worker thread, runs queued requests one after another until
+            it receives the stop sentinel
+            :param worker_queue: Queue this worker reads from
+        """
+        while True:
+            request = worker_queue.get()
+            try:
+                if request is None:
+                    return
+                function, args = request
+                function(*args)
+            except Exception as e:
+                self.logger.error("Error while serving dispatched request: {}".format(e))
+            finally:
+                worker_queue.task_done()
+
+
+    def submit(self, lane, key, function, *args):
+        """
+            Queue a request on the given lane. Requests submitted with the
+            same key always go to the same worker, so they are served in
+            the order they were submitted. Blocks while the worker queue
+            is full (backpressure)
+            :param lane: Lane name
+            :param key: Ordering key, e.g. Webex person ID
+            :param function: Function to run
+            :param args: Arguments for the function
+            :return: True if the request was queued, False if the worker
+                     queue stayed full for submit_timeout seconds
+        """
+        worker_queues = self.lanes[lane]
+        worker_queue = worker_queues[hash(key) % len(worker_queues)]
+        try:
+            worker_queue.put((function, args), timeout=self.submit_timeout)
+            self.submitted_counter.inc(labels=(lane, "queued"))
+            return True
+        except queue.Full:
+            self.logger.warning("{} lane is full, request deferred to the next iteration".format(lane))
+            self.submitted_counter.inc(labels=(lane, "deferred"))
+            return False
+
+
+    def get_queue_depths(self):
+        """
+            Requests waiting in the queues of every lane
+            :return: Dictionary of (lane,) to number of queued requests
+        """
+        return dict(((lane,), sum(worker_queue.qsize() for worker_queue in worker_queues))
+                    for lane, worker_queues in self.lanes.items())
+
+
+    def shutdown(self, timeout=60):
+        """
+            Stops the workers once the requests already queued are served
+            :param timeout: Seconds to wait for each worker to finish
+        """
+        self.logger.info("Stopping request dispatcher...")
+        for worker_queues in self.lanes.values():
+            for worker_queue in worker_queues:
+                worker_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+        self.logger.info("Request dispatcher stopped!!!")
+
+
+
+class ServedWatermark:
+    """
+        Keeps track of the messages being served concurrently and moves
+        the last served request timestamp only past messages for which
+        every older message has been served as well
+    """
+    def __init__(self, update_function, served_history_size=1000):
+        """
+            Init Method
+            :param update_function: Called with the message time of the
+                                    newest message that can be marked as
+                                    served
+            :param served_history_size: Number of recently served message
+                                        IDs remembered, guards against
+                                        serving a message twice while the
+                                        poller holds a stale watermark
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.lock = threading.Lock()
+        self.update_function = update_function
+        self.served_history_size = served_history_size
+        # message ID --> [message time, served flag], in dispatch order
+        self.tracked_messages = OrderedDict()
+        self.served_messages = OrderedDict()
+
+
+    def begin(self, message_id, message_time):
+        """
+            Start tracking a dispatched message
+            :param message_id: Webex message ID
+            :param message_time: message time
+        """
+        with self.lock:
+            self.tracked_messages[message_id] = [message_time, False]
+
+
+    def cancel(self, message_id):
+        """
+            Stop tracking a message which could not be dispatched
+            :param message_id: Webex message ID
+        """
+        with self.lock:
+            self.tracked_messages.pop(message_id, None)
+
+
+    def is_tracked(self, message_id):
+        """
+            Check if the message was already dispatched, either still
+            being served or recently served
+            :param message_id: Webex message ID
+            :return: True if tracked
+        """
+        with self.lock:
+            return message_id in self.tracked_messages or message_id in self.served_messages
+
+
+    def complete(self, message_id):
+        """
+            Mark a message as served and advance the watermark over the
+            oldest contiguous run of served messages
+            :param message_id: Webex message ID
+        """
+        with self.lock:
+            if message_id not in self.tracked_messages:
+                return
+            self.tracked_messages[message_id][1] = True
+            served_time = None
+            while self.tracked_messages:
+                oldest_id = next(iter(self.tracked_messages))
+                message_time, served = self.tracked_messages[oldest_id]
+                if not served:
+                    break
+                served_time = message_time
+                del self.tracked_messages[oldest_id]
+                self.served_messages[oldest_id] = True
+                if len(self.served_messages) > self.served_history_size:
+                    self.served_messages.popitem(last=False)
+            if served_time is not None:
+                self.update_function(served_time)
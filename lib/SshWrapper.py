@@ -1,17 +1,82 @@
-import os
+import time
+import hashlib
 import paramiko
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
+from ReachabilityProbe import ReachabilityProbe
+from Tracer import Tracer
+from Metrics import Metrics
+
+
+def parse_host_list(text, max_hosts=None):
+    """
+        Parse a comma separated list of hosts, where a host can be an
+        IPv4 address range in its last octet, e.g.
+        "10.198.198.1-4,10.198.199.10,cluster-a". Hostnames with a hyphen
+        in their last label (e.g. "host.my-lab") are taken as they are
+        :param text: Host list text
+        :param max_hosts: Max number of hosts, checked before a range is
+                          expanded
+        :return: List of hosts
+        :raises ValueError: Invalid range or too many hosts
+    """
+    hosts = []
+    for entry in text.split(","):
+        entry = entry.strip()
+        prefix, separator, last = entry.rpartition(".")
+        first_octet, hyphen, last_octet = last.partition("-")
+        if separator and hyphen and first_octet.isdigit() and last_octet.isdigit():
+            first_octet, last_octet = int(first_octet), int(last_octet)
+            if not 0 <= first_octet <= last_octet <= 255:
+                raise ValueError("Invalid address range {}".format(entry))
+            count = last_octet - first_octet + 1
+            if max_hosts is not None and len(hosts) + count > max_hosts:
+                raise ValueError("More than {} hosts given".format(max_hosts))
+            hosts.extend("{}.{}".format(prefix, octet) for octet in range(first_octet, last_octet + 1))
+        elif entry:
+            hosts.append(entry)
+    if max_hosts is not None and len(hosts) > max_hosts:
+        raise ValueError("More than {} hosts given".format(max_hosts))
+    return hosts
 
 
 class SshWrappper:
     """
         SSH Wrapper Class
     """
-    def __init__(self):
+    # Bytes read from a channel at a time
+    READ_SIZE = 32768
+    # Wait between channel reads when there is no output
+    POLL_INTERVAL = 0.05
+    # connect response when the cluster is reachable but the SSH
+    # connection or login failed
+    SSH_FAILED = 3
+
+    def __init__(self, max_channels=8, command_timeout=20, pool_max_connections=16,
+                 pool_idle_timeout=300, keepalive_interval=30, probe_timeout=2, probe_icmp=False,
+                 pool_acquire_timeout=30):
         """
             Init Method
+            :param max_channels: Max commands run at once over one SSH
+                                 connection, keep below sshd MaxSessions
+            :param command_timeout: Seconds a command may run
+            :param pool_max_connections: Max SSH connections kept open
+            :param pool_idle_timeout: Seconds an unused connection is kept
+            :param keepalive_interval: Transport keepalive interval
+            :param probe_timeout: Seconds a reachability probe may take
+            :param probe_icmp: Also probe reachability with ICMP echo
+            :param pool_acquire_timeout: Seconds to wait for a connection
+                                         when the pool is full
         """
         self.logger = logging.getLogger('chatbot_logger')
+        self.reachability_probe = ReachabilityProbe(timeout=probe_timeout, icmp_enabled=probe_icmp)
+        self.max_channels = int(max_channels)
+        self.command_timeout = float(command_timeout)
+        self.connection_pool = SshConnectionPool(self, max_connections=pool_max_connections,
+                                                 idle_timeout=pool_idle_timeout,
+                                                 keepalive_interval=keepalive_interval,
+                                                 acquire_timeout=pool_acquire_timeout)
 
 
     def connect(self, hostname, username, password, port=2222, timeout=10):
@@ -22,34 +87,337 @@ class SshWrappper:
             :param password: Password
             :param port: Port
             :param timeout: SSH timeout value
-            :return: SSH connection object
+            :return: SSH connection object, 0 on success, 1 if the cluster
+                     is not reachable, SSH_FAILED if it is reachable but
+                     the SSH connection failed
         """
         try:
             self.logger.info("Creating a SSH connection to {} cluster".format(hostname))
             ssh = paramiko.SSHClient()
             ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(hostname=hostname, username=username, password=password, port=port, timeout=timeout)
-            response = self.check_cluster_reachability(hostname)
+            with Tracer.span("ssh connect"):
+                ssh.connect(hostname=hostname, username=username, password=password, port=port, timeout=timeout)
+            # A successful connect proves the cluster is reachable
             self.logger.info("Connected to - {} cluster".format(hostname))
-            return ssh, response
+            return ssh, 0
         except Exception as e:
             self.logger.error("Cannot connect to {} cluster".format(hostname))
             self.logger.error("Error -- {}".format(e))
-            response = self.check_cluster_reachability(hostname)
-            return 0, response
+            response = self.check_cluster_reachability(hostname, port)
+            return 0, response if response else self.SSH_FAILED
 
 
-    def check_cluster_reachability(self, hostname):
+    def check_cluster_reachability(self, hostname, port=2222):
         """
             Check cluster reachability
             :param hostname: Hostname/IP of the cluster
-            :return: pingstatus
+            :param port: SSH port
+            :return: pingstatus, 0 if reachable
         """
         self.logger.info("Checking cluster reachability...")
-        response = os.system("ping -c 1 " + hostname + " | >/dev/null 2>&1")
-        if response == 0:
+        if self.reachability_probe.probe(hostname, port)["reachable"]:
             pingstatus = "Cluster is reachable"
+            response = 0
         else:
             pingstatus = "Cluster is not reachable"
+            response = 1
         self.logger.info("Ping Status: {}".format(pingstatus))
         return response
+
+
+    def execute_command(self, ssh, command):
+        """
+            Run a command on its own channel of the SSH connection,
+            reading stdout and stderr as the output arrives
+            :param ssh: SSH connection object
+            :param command: Command
+            :return: (command, output, error)
+        """
+        output = []
+        error = []
+        try:
+            with Tracer.span("ssh command"):
+                channel = ssh.get_transport().open_session()
+                channel.exec_command(command)
+                deadline = time.time() + self.command_timeout
+                while True:
+                    if channel.recv_ready():
+                        output.append(channel.recv(self.READ_SIZE))
+                    elif channel.recv_stderr_ready():
+                        error.append(channel.recv_stderr(self.READ_SIZE))
+                    elif channel.exit_status_ready():
+                        break
+                    elif time.time() > deadline:
+                        error.append("Command timed out after {:g} seconds".format(self.command_timeout)
+                                     .encode('utf8'))
+                        break
+                    else:
+                        time.sleep(self.POLL_INTERVAL)
+                channel.close()
+        except Exception as e:
+            self.logger.error("Error while executing {} -- {}".format(command, e))
+            error.append(str(e).encode('utf8'))
+        self.logger.info("Executed: {}".format(command))
+        return (command, b"".join(output).decode('utf8', 'replace'),
+                b"".join(error).decode('utf8', 'replace'))
+
+
+    def execute_commands(self, ssh, commands):
+        """
+            Run commands concurrently, each on its own channel multiplexed
+            over the single SSH connection, at most max_channels at a time
+            :param ssh: SSH connection object
+            :param commands: List of commands
+            :return: Generator of (command, output, error) in the order of
+                     the commands, each yielded as soon as it and every
+                     command before it have finished
+        """
+        if not commands:
+            return
+        pool = ThreadPool(max(1, min(self.max_channels, len(commands))))
+        try:
+            for result in pool.imap(Tracer.bind(lambda command: self.execute_command(ssh, command)), commands):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+
+    def acquire(self, hostname, username, password, port=2222):
+        """
+            Get an SSH connection from the connection pool, connecting
+            only if there is no live idle connection to the host
+            :param hostname: Hostname/IP
+            :param username: Username
+            :param password: Password
+            :param port: Port
+            :return: SSH connection object, response as returned by connect
+        """
+        return self.connection_pool.acquire(hostname, username, password, port)
+
+
+    def release(self, ssh, hostname, username, password, port=2222):
+        """
+            Return an SSH connection to the connection pool
+            :param ssh: SSH connection object
+            :param hostname: Hostname/IP
+            :param username: Username
+            :param password: Password
+            :param port: Port
+        """
+        self.connection_pool.release(ssh, hostname, username, password, port)
+
+
+
+class SshConnectionPool:
+    """
+        SSH Connection Pool Class which keeps authenticated SSH
+        connections open after use, keyed by host, port, user and
+        password hash, so that repeat requests skip the key exchange and
+        authentication. Idle connections expire and dead ones are dropped.
+        At most max_connections are open at once, when every one of them
+        is in use acquire waits for a release
+    """
+    # acquire response when no connection freed up in time
+    POOL_FULL = 2
+
+    def __init__(self, ssh_wrapper, max_connections=16, idle_timeout=300, keepalive_interval=30,
+                 acquire_timeout=30):
+        """
+            Init Method
+            :param ssh_wrapper: SshWrappper object used to connect
+            :param max_connections: Max SSH connections open, in use or
+                                    idle
+            :param idle_timeout: Seconds an unused connection is kept
+            :param keepalive_interval: Transport keepalive interval
+            :param acquire_timeout: Seconds acquire waits for a
+                                    connection when the pool is full
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.ssh_wrapper = ssh_wrapper
+        self.max_connections = int(max_connections)
+        self.idle_timeout = float(idle_timeout)
+        self.keepalive_interval = int(keepalive_interval)
+        self.acquire_timeout = float(acquire_timeout)
+        # Guards the pool, notified whenever a connection is released or
+        # closed
+        self.lock = threading.Condition()
+        # key --> list of [SSH connection object, last used time]
+        self.idle_connections = {}
+        self.open_connections = 0
+        self.reaper_thread = None
+        self.sessions_counter = Metrics.counter("chatbot_ssh_sessions_total",
+                                                "SSH sessions acquired by result (reused, new, failed, pool full)",
+                                                ("result",))
+        Metrics.gauge("chatbot_ssh_open_connections", "SSH connections open, in use or idle",
+                      function=lambda: self.open_connections)
+
+
+    def get_key(self, hostname, username, password, port):
+        """
+            Pool key of a connection
+            :return: Key tuple
+        """
+        return (hostname, int(port), username, hashlib.sha256(password.encode('utf8')).hexdigest())
+
+
+    def is_alive(self, ssh):
+        """
+            Check if the SSH connection can still be used
+            :param ssh: SSH connection object
+            :return: True if alive
+        """
+        try:
+            transport = ssh.get_transport()
+            if transport is None or not transport.is_active():
+                return False
+            transport.send_ignore()
+            return True
+        except Exception:
+            return False
+
+
+    def close(self, ssh):
+        """
+            Close a pooled connection
+            :param ssh: SSH connection object
+        """
+        with self.lock:
+            self.open_connections -= 1
+            self.lock.notify_all()
+        try:
+            ssh.close()
+        except Exception as e:
+            self.logger.error("Error while closing SSH connection -- {}".format(e))
+
+
+    def remove_expired(self):
+        """
+            Close idle connections not used for idle_timeout seconds
+        """
+        expired = []
+        with self.lock:
+            now = time.time()
+            for key in list(self.idle_connections):
+                idle = self.idle_connections[key]
+                expired.extend(ssh for ssh, last_used in idle if now - last_used > self.idle_timeout)
+                idle[:] = [entry for entry in idle if now - entry[1] <= self.idle_timeout]
+                if not idle:
+                    del self.idle_connections[key]
+        for ssh in expired:
+            self.close(ssh)
+        if expired:
+            self.logger.info("Closed {} idle SSH connections".format(len(expired)))
+
+
+    def pop_oldest_idle(self):
+        """
+            Take the least recently used idle connection out of the pool
+            to make room for a new one, called with the lock held
+            :return: SSH connection object, None if there is no idle
+                     connection
+        """
+        oldest = None
+        for key, idle in self.idle_connections.items():
+            for entry in idle:
+                if oldest is None or entry[1] < oldest[1][1]:
+                    oldest = (key, entry)
+        if oldest is None:
+            return None
+        self.idle_connections[oldest[0]].remove(oldest[1])
+        if not self.idle_connections[oldest[0]]:
+            del self.idle_connections[oldest[0]]
+        return oldest[1][0]
+
+
+    def reaper_loop(self):
+        """
+            Background thread closing expired idle connections
+        """
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 2))
+            self.remove_expired()
+
+
+    def acquire(self, hostname, username, password, port=2222):
+        """
+            Get a live idle connection to the host or open a new one. When
+            the pool is full the least recently used idle connection is
+            closed, if every connection is in use acquire waits up to
+            acquire_timeout seconds for one to be released
+            :param hostname: Hostname/IP
+            :param username: Username
+            :param password: Password
+            :param port: Port
+            :return: SSH connection object, response as returned by connect
+                     or (0, POOL_FULL) if no connection freed up in time
+        """
+        key = self.get_key(hostname, username, password, port)
+        self.remove_expired()
+        deadline = time.time() + self.acquire_timeout
+        while True:
+            ssh = evicted = None
+            with self.lock:
+                idle = self.idle_connections.get(key)
+                if idle:
+                    ssh, last_used = idle.pop()
+                    if not idle:
+                        del self.idle_connections[key]
+                elif self.open_connections < self.max_connections:
+                    # Taking the slot before connecting, so that
+                    # concurrent callers cannot go over the limit
+                    self.open_connections += 1
+                    break
+                else:
+                    evicted = self.pop_oldest_idle()
+                    if evicted is None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.logger.error("All {} SSH connections are in use, giving up on {}"
+                                              .format(self.max_connections, hostname))
+                            self.sessions_counter.inc(labels=("pool full",))
+                            return 0, self.POOL_FULL
+                        self.lock.wait(remaining)
+                        continue
+            if evicted is not None:
+                self.close(evicted)
+            elif self.is_alive(ssh):
+                self.logger.info("Reusing SSH connection to {}".format(hostname))
+                self.sessions_counter.inc(labels=("reused",))
+                return ssh, 0
+            else:
+                self.close(ssh)
+        ssh, response = self.ssh_wrapper.connect(hostname=hostname, username=username,
+                                                 password=password, port=port)
+        self.sessions_counter.inc(labels=("new" if ssh else "failed",))
+        with self.lock:
+            if not ssh:
+                self.open_connections -= 1
+                self.lock.notify_all()
+                return ssh, response
+            if self.reaper_thread is None:
+                self.reaper_thread = threading.Thread(target=self.reaper_loop, name="ssh-pool-reaper")
+                self.reaper_thread.daemon = True
+                self.reaper_thread.start()
+        ssh.get_transport().set_keepalive(self.keepalive_interval)
+        return ssh, response
+
+
+    def release(self, ssh, hostname, username, password, port=2222):
+        """
+            Keep the connection for reuse, or close it if it is dead
+            :param ssh: SSH connection object
+            :param hostname: Hostname/IP
+            :param username: Username
+            :param password: Password
+            :param port: Port
+        """
+        if not ssh:
+            return
+        key = self.get_key(hostname, username, password, port)
+        if self.is_alive(ssh):
+            with self.lock:
+                self.idle_connections.setdefault(key, []).append([ssh, time.time()])
+                self.lock.notify_all()
+                return
+        self.close(ssh)
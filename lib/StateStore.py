@@ -0,0 +1,181 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+import ruamel.yaml
+
+
+class StateStore:
+    """
+        State Store Class, small SQLite (WAL mode) database holding the
+        chat bot state -- last served request watermark, processed
+        message IDs, tokens and per user request history. Every update is
+        a single atomic transaction, safe to share between threads and
+        between the chat bot and the periodic notifier processes
+    """
+    # One store per database file in the process
+    stores = {}
+    stores_lock = threading.Lock()
+    # History rows older than this are pruned
+    HISTORY_RETENTION = 30 * 24 * 3600
+    PRUNE_EVERY = 500
+
+    def __init__(self, db_path, legacy_metadata_path='tmp/metadata.yaml'):
+        """
+            Init Method
+            Opening the database and importing tmp/metadata.yaml on first use
+            :param db_path: SQLite database file
+            :param legacy_metadata_path: YAML metadata file the state used
+                                         to be kept in
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.lock = threading.Lock()
+        self.writes_since_prune = 0
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        self.connection = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS state "
+                                    "(key TEXT PRIMARY KEY, value TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS processed_messages "
+                                    "(message_id TEXT PRIMARY KEY, created TEXT, served_at REAL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS user_history "
+                                    "(id INTEGER PRIMARY KEY AUTOINCREMENT, person_id TEXT, "
+                                    "message TEXT, created TEXT, served_at REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS user_history_person "
+                                    "ON user_history (person_id, served_at)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS cache_entries "
+                                    "(cache_name TEXT, key TEXT, value TEXT, stored_at REAL, "
+                                    "PRIMARY KEY (cache_name, key))")
+        self.import_legacy_metadata(legacy_metadata_path)
+        self.logger.info("State store ready: {}".format(db_path))
+
+
+    @classmethod
+    def get_store(cls, db_path):
+        """
+            Returns the shared store for the given database file, opening
+            it on first use
+            :param db_path: SQLite database file
+            :return: StateStore object
+        """
+        with cls.stores_lock:
+            store = cls.stores.get(db_path)
+            if store is None:
+                store = cls(db_path)
+                cls.stores[db_path] = store
+            return store
+
+
+    def import_legacy_metadata(self, legacy_metadata_path):
+        """
+            Seeds an empty store with the values from tmp/metadata.yaml
+            :param legacy_metadata_path: YAML metadata file
+        """
+        if self.get("last_served_request") is not None or not os.path.isfile(legacy_metadata_path):
+            return
+        self.logger.info("Importing state from {}...".format(legacy_metadata_path))
+        with open(legacy_metadata_path, 'r') as mfh:
+            metadata = ruamel.yaml.YAML().load(mfh)
+        for key, value in metadata['read_only'].items():
+            self.set(key, str(value))
+
+
+    def get(self, key, default=None):
+        """
+            Get a state value
+            :param key: Key
+            :param default: Returned if the key is not set
+            :return: Value
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else default
+
+
+    def set(self, key, value):
+        """
+            Set a state value
+            :param key: Key
+            :param value: Value
+        """
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                                    (key, value))
+
+
+    def is_message_processed(self, message_id):
+        """
+            Check if a message was already served
+            :param message_id: Webex message ID
+            :return: True if served
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM processed_messages WHERE message_id = ?",
+                                          (message_id,)).fetchone()
+        return row is not None
+
+
+    def record_processed_message(self, message_id, created, person_id, message):
+        """
+            Remember a served message and add it to the user history
+            :param message_id: Webex message ID
+            :param created: Message time
+            :param person_id: Webex person ID
+            :param message: Message text
+        """
+        served_at = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO processed_messages "
+                                    "(message_id, created, served_at) VALUES (?, ?, ?)",
+                                    (message_id, created, served_at))
+            self.connection.execute("INSERT INTO user_history (person_id, message, created, served_at) "
+                                    "VALUES (?, ?, ?, ?)", (person_id, message, created, served_at))
+            self.writes_since_prune += 1
+            if self.writes_since_prune >= self.PRUNE_EVERY:
+                self.writes_since_prune = 0
+                cutoff = served_at - self.HISTORY_RETENTION
+                self.connection.execute("DELETE FROM processed_messages WHERE served_at < ?", (cutoff,))
+                self.connection.execute("DELETE FROM user_history WHERE served_at < ?", (cutoff,))
+
+
+    def get_user_history(self, person_id, limit=10):
+        """
+            Latest requests of a user
+            :param person_id: Webex person ID
+            :param limit: Max number of requests
+            :return: List of (message, created) tuples, newest first
+        """
+        with self.lock:
+            return self.connection.execute("SELECT message, created FROM user_history "
+                                           "WHERE person_id = ? ORDER BY served_at DESC LIMIT ?",
+                                           (person_id, limit)).fetchall()
+
+
+    def get_cache_entry(self, cache_name, key):
+        """
+            Get a value spilled to disk by a cache
+            :param cache_name: Cache name
+            :param key: Cache key
+            :return: Value, None if not stored
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM cache_entries WHERE cache_name = ? AND key = ?",
+                                          (cache_name, key)).fetchone()
+        return row[0] if row is not None else None
+
+
+    def put_cache_entry(self, cache_name, key, value):
+        """
+            Spill a cache value to disk
+            :param cache_name: Cache name
+            :param key: Cache key
+            :param value: Value text
+        """
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO cache_entries (cache_name, key, value, stored_at) "
+                                    "VALUES (?, ?, ?, ?)", (cache_name, key, value, time.time()))
@@ -0,0 +1,233 @@
+import time
+import uuid
+import logging
+import threading
+import collections
+from Metrics import Metrics
+
+
+class Trace:
+    """
+        Timed spans of a single request
+    """
+    def __init__(self, name):
+        """
+            Init Method
+            :param name: Request name, e.g. the command words. Never the
+                         message text, traces are logged and posted
+        """
+        self.trace_id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.start_time = time.time()
+        self.seconds = None
+        self.lock = threading.Lock()
+        # (depth, span name) --> [calls, seconds, errors], in the order
+        # the spans first started
+        self.spans = collections.OrderedDict()
+
+
+    def start_span(self, name, depth):
+        """
+            Keep the place of a span in the breakdown, nested spans finish
+            first but are listed after the span they ran in
+            :param name: Span name
+            :param depth: Nesting level, 0 for top level spans
+        """
+        with self.lock:
+            self.spans.setdefault((depth, name), [0, 0.0, 0])
+
+
+    def add_span(self, name, depth, seconds, error):
+        """
+            Record a finished span
+            :param name: Span name
+            :param depth: Nesting level, 0 for top level spans
+            :param seconds: Span duration
+            :param error: True if the span raised
+        """
+        with self.lock:
+            span = self.spans.setdefault((depth, name), [0, 0.0, 0])
+            span[0] += 1
+            span[1] += seconds
+            span[2] += 1 if error else 0
+
+
+    def get_breakdown(self):
+        """
+            Timing breakdown, nested spans are indented under the spans
+            they ran in. Spans run concurrently by worker threads can add
+            up to more than the request took
+            :return: Breakdown text
+        """
+        parts = []
+        top_level_seconds = 0.0
+        with self.lock:
+            for (depth, name), (calls, seconds, errors) in self.spans.items():
+                if depth == 0:
+                    top_level_seconds += seconds
+                parts.append("{}{} {}x {:.3f}s{}".format(". " * depth, name, calls, seconds,
+                                                         " ({} failed)".format(errors) if errors else ""))
+        parts.append("other {:.3f}s".format(max(0.0, (self.seconds or 0.0) - top_level_seconds)))
+        return ", ".join(parts)
+
+
+
+class Span:
+    """
+        Timed block of a trace, used as a context manager
+    """
+    def __init__(self, name):
+        """
+            Init Method
+            :param name: Span name, e.g. "http GET <host>"
+        """
+        self.name = name
+
+
+    def __enter__(self):
+        """
+            Start timing, spans opened inside are nested under this one
+        """
+        local = Tracer.local
+        self.trace = getattr(local, "trace", None)
+        self.depth = getattr(local, "depth", 0)
+        local.depth = self.depth + 1
+        if self.trace is not None:
+            self.trace.start_span(self.name, self.depth)
+        self.start_time = time.time()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+            Record the span, exceptions are passed on
+        """
+        seconds = time.time() - self.start_time
+        Tracer.local.depth = self.depth
+        if self.trace is not None:
+            self.trace.add_span(self.name, self.depth, seconds, exc_type is not None)
+        Tracer.record_span(self.name, seconds, exc_type is not None)
+        return False
+
+
+
+class Tracer:
+    """
+        Tracer Class which times the backend calls made while serving a
+        request. The trace of a request is kept per thread, spans record
+        themselves in it and in process wide per span statistics
+    """
+    local = threading.local()
+    stats_lock = threading.Lock()
+    # span name --> [calls, seconds, max seconds, errors]
+    span_stats = {}
+    recent_traces = collections.deque(maxlen=20)
+    call_seconds = Metrics.histogram("chatbot_backend_call_seconds",
+                                     "Time spent in backend calls (HTTP, JIRA, SSH, fileserver)", ("call",))
+    call_errors = Metrics.counter("chatbot_backend_call_errors_total", "Backend calls that raised", ("call",))
+
+    @classmethod
+    def span(cls, name):
+        """
+            Timed span in the current trace
+            :param name: Span name
+            :return: Span context manager
+        """
+        return Span(name)
+
+
+    @classmethod
+    def start_trace(cls, name):
+        """
+            Start the trace of a request in the current thread
+            :param name: Request name, e.g. the command words
+            :return: Trace object
+        """
+        trace = Trace(name)
+        cls.local.trace = trace
+        cls.local.depth = 0
+        return trace
+
+
+    @classmethod
+    def set_trace_name(cls, name):
+        """
+            Rename the trace of the current thread, once the request is
+            routed
+            :param name: Request name
+        """
+        trace = getattr(cls.local, "trace", None)
+        if trace is not None:
+            trace.name = name
+
+
+    @classmethod
+    def finish_trace(cls, trace):
+        """
+            Finish the trace of the current thread and log its breakdown
+            :param trace: Trace object from start_trace
+        """
+        trace.seconds = time.time() - trace.start_time
+        cls.local.trace = None
+        breakdown = trace.get_breakdown()
+        logging.getLogger('chatbot_logger').info("Trace %s -- %s took %.3fs: %s", trace.trace_id,
+                                                 trace.name, trace.seconds, breakdown)
+        with cls.stats_lock:
+            cls.recent_traces.append((trace.trace_id, trace.name, trace.seconds, breakdown))
+
+
+    @classmethod
+    def bind(cls, function):
+        """
+            Run function in the trace of the calling thread, for work
+            handed to worker threads
+            :param function: Function
+            :return: Function running in the trace
+        """
+        trace = getattr(cls.local, "trace", None)
+        depth = getattr(cls.local, "depth", 0)
+
+        def traced_function(*args, **kwargs):
+            cls.local.trace = trace
+            cls.local.depth = depth
+            try:
+                return function(*args, **kwargs)
+            finally:
+                cls.local.trace = None
+                cls.local.depth = 0
+        return traced_function
+
+
+    @classmethod
+    def record_span(cls, name, seconds, error):
+        """
+            Add a finished span to the span statistics
+            :param name: Span name
+            :param seconds: Span duration
+            :param error: True if the span raised
+        """
+        with cls.stats_lock:
+            stats = cls.span_stats.setdefault(name, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            stats[3] += 1 if error else 0
+        cls.call_seconds.observe(seconds, (name,))
+        if error:
+            cls.call_errors.inc(labels=(name,))
+
+
+    @classmethod
+    def get_stats(cls):
+        """
+            Span statistics and the latest traces
+            :return: (List of [span name, calls, average seconds, max
+                     seconds, errors] sorted by total time, List of
+                     (trace ID, request name, seconds, breakdown) newest
+                     first)
+        """
+        with cls.stats_lock:
+            spans = sorted(cls.span_stats.items(), key=lambda item: item[1][1], reverse=True)
+            traces = list(reversed(cls.recent_traces))
+        return ([[name, calls, seconds / calls, max_seconds, errors]
+                 for name, (calls, seconds, max_seconds, errors) in spans], traces)
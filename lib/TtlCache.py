@@ -0,0 +1,115 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from Metrics import Metrics
+
+
+class TtlCache:
+    """
+        Thread safe in-memory cache where every entry expires after a
+        time to live and the least recently used entry is evicted once
+        the cache is full
+    """
+    def __init__(self, name, ttl=300, max_size=128):
+        """
+            Init Method
+            :param name: Cache name, used in logs
+            :param ttl: Seconds an entry stays valid
+            :param max_size: Max number of entries
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.name = name
+        self.ttl = float(ttl)
+        self.max_size = int(max_size)
+        self.lock = threading.Lock()
+        # key --> (expiry time, value), least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lookups_counter = Metrics.counter("chatbot_cache_lookups_total", "Cache lookups by result",
+                                               ("cache", "result"))
+
+
+    def get(self, key):
+        """
+            Look up a key
+            :param key: Cache key
+            :return: (True, value) on a hit, (False, None) on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                # Moving entry to the most recently used end
+                del self.entries[key]
+                self.entries[key] = entry
+                self.hits += 1
+                self.lookups_counter.inc(labels=(self.name, "hit"))
+                return True, entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            self.lookups_counter.inc(labels=(self.name, "miss"))
+            return False, None
+
+
+    def put(self, key, value, ttl=None):
+        """
+            Store a value, evicting the least recently used entries if
+            the cache is full
+            :param key: Cache key
+            :param value: Value to store
+            :param ttl: Seconds this entry stays valid, default is the
+                        cache ttl, float("inf") never expires
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+    def get_or_load(self, key, loader, fresh=False):
+        """
+            Returns the cached value for the key, calling loader() and
+            caching its result on a miss. None results are not cached
+            :param key: Cache key
+            :param loader: Function returning the value to cache
+            :param fresh: Skip the lookup and reload the value
+            :return: Cached or freshly loaded value
+        """
+        if not fresh:
+            found, value = self.get(key)
+            if found:
+                self.logger.info("{} cache hit: {}".format(self.name, key))
+                return value
+        value = loader()
+        if value is not None:
+            self.put(key, value)
+        self.logger.info("{} cache {}: {}".format(self.name, "refresh" if fresh else "miss", key))
+        return value
+
+
+    def invalidate(self, key=None):
+        """
+            Drop a single entry or, if no key is given, every entry
+            :param key: Cache key
+        """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+    def stats(self):
+        """
+            Returns cache counters
+            :return: Dictionary with hits, misses, hit ratio and size
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_ratio": float(self.hits) / lookups if lookups else 0.0,
+                    "size": len(self.entries)}
@@ -1,5 +1,6 @@
 import logging
 from GenericWrappper import GenericWrappper
+from MessageChunker import MessageChunker
 
 
 
@@ -20,14 +21,56 @@ class WebexNotifierWrapper:
             :param data_to_send: Data
             :return: Output from the POST API call
         """
-        self.logger.info("Webex Teams authentication header: {}".format(webex_auth_headers))
-        self.logger.info("Webex URL: {}".format(webex_url))
-        self.logger.info("Data to send: {}".format(data_to_send))
+        self.logger.debug("Webex Teams authentication header: %s", webex_auth_headers)
+        self.logger.info("Webex URL: %s", webex_url)
+        self.logger.debug("Data to send: %s", data_to_send)
         try:
             # Send message to webex group
             output = self.generic_wrapper.requests_post(url = webex_url, data=data_to_send,
                                                         headers = webex_auth_headers)
-            self.logger.info("Response: {}".format(output))
+            self.logger.info("Response: %s", output)
+            return output
+        except Exception as e:
+            self.logger.error("Error: {}".format(e))
+
+
+    def send_message_in_chunks(self, webex_url, webex_auth_headers, data_to_send,
+                               rows, text_key="markdown", max_message_size=7000):
+        """
+            Send a long reply as one or more messages under the Webex
+            message size limit, in order
+            :param webex_url: Webex Teams Backend URL
+            :param webex_auth_headers: Webex Teams Authentication header
+            :param data_to_send: Data with the room or person to send to
+            :param rows: Iterable of reply rows
+            :param text_key: "text" or "markdown"
+            :param max_message_size: Max bytes per message
+            :return: List of outputs from the POST API calls
+        """
+        outputs = []
+        chunker = MessageChunker(max_message_size=max_message_size)
+        for message in chunker.split_rows(rows):
+            chunk_to_send = dict(data_to_send)
+            chunk_to_send[text_key] = message
+            outputs.append(self.send_message_to_webex_group(webex_url=webex_url,
+                                                            webex_auth_headers=webex_auth_headers,
+                                                            data_to_send=chunk_to_send))
+        self.logger.info("Reply sent in {} message(s)".format(len(outputs)))
+        return outputs
+
+
+    def get_message(self, webex_url, webex_auth_headers, message_id):
+        """
+            Get details of a single message
+            :param webex_url: Webex Teams Backend URL
+            :param webex_auth_headers: Webex Teams Authentication header
+            :param message_id: Webex message ID
+            :return: Output from the GET API call
+        """
+        self.logger.info("Getting message {}".format(message_id))
+        try:
+            output = self.generic_wrapper.requests_get(url = "{}/{}".format(webex_url, message_id),
+                                                       headers = webex_auth_headers)
             return output
         except Exception as e:
             self.logger.error("Error: {}".format(e))
@@ -40,13 +83,13 @@ class WebexNotifierWrapper:
             :param webex_auth_headers: Webex Teams Authentication header
             :return: Output from the GET API call
         """
-        self.logger.info("Webex Teams authentication header: {}".format(webex_auth_headers))
-        self.logger.info("Webex URL: {}".format(webex_url))
+        self.logger.debug("Webex Teams authentication header: %s", webex_auth_headers)
+        self.logger.info("Webex URL: %s", webex_url)
         try:
             # Receiving message from a webex group
             output = self.generic_wrapper.requests_get(url = webex_url,
                                                        headers = webex_auth_headers)
-            #self.logger.info("Response: {}".format(output))
+            #self.logger.info("Response: %s", output)
             return output
         except Exception as e:
             self.logger.error("Error: {}".format(e))
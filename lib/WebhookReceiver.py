@@ -0,0 +1,201 @@
+import hmac
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+        HTTP server handling every request in its own thread
+    """
+    daemon_threads = True
+
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    """
+        Request handler for the webhook receiver, the receiver object is
+        set as a class attribute by WebhookReceiver
+    """
+    receiver = None
+
+    def do_POST(self):
+        """
+            Accepts webhook callbacks
+        """
+        if self.path != self.receiver.path:
+            self.send_response(404)
+            self.end_headers()
+            return
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length)
+        status = self.receiver.handle_payload(body, self.headers.get('X-Spark-Signature'))
+        self.send_response(status)
+        self.end_headers()
+
+
+    def do_GET(self):
+        """
+            Health check, used to find out if the receiver is up
+        """
+        self.send_response(200 if self.path == "/health" else 404)
+        self.end_headers()
+
+
+    def log_message(self, format, *args):
+        """
+            Sending access logs to the chat bot log instead of stderr
+        """
+        self.receiver.logger.debug("Webhook receiver: " + format % args)
+
+
+
+class WebhookReceiver:
+    """
+        Webhook Receiver Class, small embedded HTTP server which accepts
+        Webex "messages created" webhook callbacks, drops duplicate
+        deliveries and hands every new message to a callback
+    """
+    def __init__(self, callback, host="0.0.0.0", port=8012, path="/webhook",
+                 secret=None, dedupe_size=1000):
+        """
+            Init Method
+            :param callback: Called with the webhook "data" dictionary of
+                             every new message, should return quickly
+            :param host: Address to listen on
+            :param port: Port to listen on
+            :param path: URL path Webex posts the callbacks to
+            :param secret: Webhook secret, if set X-Spark-Signature of
+                           every callback is verified
+            :param dedupe_size: Number of message IDs remembered to drop
+                                duplicate deliveries
+        """
+        self.logger = logging.getLogger('chatbot_logger')
+        self.callback = callback
+        self.host = host
+        self.port = int(port)
+        self.path = path
+        self.secret = secret
+        self.dedupe_size = dedupe_size
+        self.seen_message_ids = OrderedDict()
+        self.lock = threading.Lock()
+        self.server = None
+        self.server_thread = None
+
+
+    def start(self):
+        """
+            Starts the HTTP server in a background thread
+            :return: True if the server is listening
+        """
+        try:
+            # Class statement rather than type(), the py2 handler is an
+            # old-style class
+            class BoundWebhookRequestHandler(WebhookRequestHandler):
+                receiver = self
+
+            self.server = ThreadingHTTPServer((self.host, self.port), BoundWebhookRequestHandler)
+            self.server_thread = threading.Thread(target=self.server.serve_forever,
+                                                  name="webhook-receiver")
+            self.server_thread.daemon = True
+            self.server_thread.start()
+            self.logger.info("Webhook receiver listening on {}:{}{}".format(self.host, self.port, self.path))
+            return True
+        except Exception as e:
+            self.logger.error("Failed to start webhook receiver: {}".format(e))
+            self.server = None
+            return False
+
+
+    def is_alive(self):
+        """
+            Check if the receiver is up and serving requests
+            :return: True if alive
+        """
+        return self.server_thread is not None and self.server_thread.is_alive()
+
+
+    def stop(self):
+        """
+            Stops the HTTP server
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.logger.info("Webhook receiver stopped!!!")
+
+
+    def is_duplicate(self, message_id):
+        """
+            Remembers the message ID and tells if it was already seen
+            :param message_id: Webex message ID
+            :return: True if the message was already received
+        """
+        with self.lock:
+            if message_id in self.seen_message_ids:
+                return True
+            self.seen_message_ids[message_id] = True
+            if len(self.seen_message_ids) > self.dedupe_size:
+                self.seen_message_ids.popitem(last=False)
+            return False
+
+
+    def verify_signature(self, body, signature):
+        """
+            Verify the HMAC-SHA1 signature Webex computes over the body
+            with the webhook secret
+            :param body: Raw request body
+            :param signature: X-Spark-Signature header value
+            :return: True if valid or no secret is configured
+        """
+        if not self.secret:
+            return True
+        if not signature:
+            return False
+        expected = hmac.new(self.secret.encode('utf8'), body, hashlib.sha1).hexdigest()
+        return hmac.compare_digest(expected, str(signature))
+
+
+    def handle_payload(self, body, signature=None):
+        """
+            Validates a webhook callback and passes new messages on to the
+            callback
+            :param body: Raw request body
+            :param signature: X-Spark-Signature header value
+            :return: HTTP status code to respond with
+        """
+        if not self.verify_signature(body, signature):
+            self.logger.error("Webhook callback with invalid signature dropped")
+            return 401
+        try:
+            payload = json.loads(body.decode('utf8'))
+            data = payload["data"]
+            message_id = data["id"]
+        except Exception as e:
+            self.logger.error("Invalid webhook payload: {}".format(e))
+            return 400
+        if payload.get("resource") != "messages" or payload.get("event") != "created":
+            self.logger.info("Ignoring webhook event {} {}".format(payload.get("resource"), payload.get("event")))
+            return 200
+        if self.is_duplicate(message_id):
+            self.logger.info("Duplicate webhook delivery for message {} dropped".format(message_id))
+            return 200
+        self.logger.info("Webhook received for message {}".format(message_id))
+        try:
+            self.callback(data)
+        except Exception as e:
+            self.logger.error("Error while handling webhook message {}: {}".format(message_id, e))
+            # Letting the retried delivery through
+            with self.lock:
+                self.seen_message_ids.pop(message_id, None)
+            return 500
+        return 200
@@ -1,13 +1,22 @@
+import json
+import math
+import time
 import yaml
 import logging
 
 from lib.GenericWrappper import GenericWrappper
-from lib.JiraConnectionWrapper import JiraConnectionWrapper
+from lib.JiraConnectionWrapper import JiraConnectionWrapper, JiraClientManager, JiraIssueNotFound
 from lib.WebexNotifierWrapper import WebexNotifierWrapper
 
 
 
 class BugNotifierUtility:
+    # Issue keys per "issuekey in (...)" query
+    KEY_BATCH_SIZE = 200
+    # JQL relative dates have minute precision, the watermark is moved
+    # back by this many seconds so that no update is missed
+    WATERMARK_OVERLAP = 120
+
     def __init__(self):
         """
             Initializes and sets variables by collecting metadata
@@ -33,11 +42,15 @@ class BugNotifierUtility:
                 self.jira_server_url = str(self.doc["jira_details"]["jira_server_url"])
                 self.fixed_jira_query = str(self.doc["jira_details"]["fixed_jira_query"])
                 self.string_header_with_response = str(self.doc["jira_details"]["string_header_with_response"])
+                self.incremental = str(self.doc["jira_details"].get("notifier_incremental", False)).lower() == 'true'
 
                 # Getting Webex Teams Room details
                 self.webex_url = str(self.doc["webex_teams_details"]["webex_url"])
                 self.webex_room_id = str(self.doc["webex_teams_details"]["webex_room_id"])
 
+                # Max bytes (UTF-8) per message, longer replies are split
+                self.message_size_limit = int(self.doc["webex_teams_details"].get("message_size_limit", 7000))
+
                 # Getting Webex Teams Bot details
                 self.auth_token = str(self.doc["webex_teams_details"]["auth_token"])
                 self.webex_bot_name = str(self.doc["webex_teams_details"]["webex_bot_name"])
@@ -45,29 +58,168 @@ class BugNotifierUtility:
             # Setting Webex connectivity parameters
             self.webex_auth_headers['authorization'] = 'Bearer ' + self.auth_token
 
-            # Creating connection to Jira server
-            self.jira_object = self.jira_wrapper.get_jira_server_connection_object(jira_server_url = self.jira_server_url,
-                                                                                   jira_user = self.jira_user,
-                                                                                   jira_password = self.jira_password)
+            # Connection to Jira server is created on first use
+            self.jira_manager = JiraClientManager.get_manager(jira_server_url = self.jira_server_url,
+                                                              jira_user = self.jira_user,
+                                                              jira_password = self.jira_password)
             self.logger.info("Periodic Bug Notifier, Initialization Complete!!!")
         except Exception as e:
             self.logger.info("Error -- {}".format(e))
 
 
+    def run_query(self, jira_query, fields, raise_not_found=False):
+        """
+            Run a jira query with the shared JIRA connection
+            :param jira_query: Jira query
+            :param fields: Comma separated issue fields to fetch
+            :param raise_not_found: Raise JiraIssueNotFound if the query
+                                    names an issue key that does not exist
+            :return: List of issues, None on failure
+        """
+        return self.jira_manager.run(self.jira_wrapper.run_jira_query,
+                                     jira_query = jira_query,
+                                     fields = fields,
+                                     raise_not_found = raise_not_found)
+
+
+    def summarize_issue(self, issue):
+        """
+            Issue details kept between runs
+            :param issue: JIRA issue
+            :return: Dictionary with summary and assignee
+        """
+        return {"summary": issue.fields.summary, "assignee": str(issue.fields.assignee)}
+
+
+    def send_rows(self, rows, room_id):
+        """
+            Send message rows to the webex room
+            :param rows: Iterable of message rows
+            :param room_id: Webex room ID
+        """
+        self.webex_wrapper.send_message_in_chunks(webex_url = self.webex_url,
+                                                  webex_auth_headers = self.webex_auth_headers,
+                                                  data_to_send = {"roomId": room_id},
+                                                  rows = rows,
+                                                  max_message_size = self.message_size_limit)
+
+
+    def notify_full_list(self, jira_query, room_id, header):
+        """
+            Post every issue of the jira query
+            :param jira_query: Jira query
+            :param room_id: Webex room ID
+            :param header: Message header
+        """
+        self.open_issues = self.run_query(jira_query, self.jira_wrapper.MESSAGE_FIELDS)
+        rows = self.jira_wrapper.formulate_message_rows(text_data = header,
+                                                        issues = self.open_issues,
+                                                        jira_server_url = self.jira_server_url)
+        self.send_rows(rows, room_id)
+
+
+    def notify_changes(self, name, jira_query, room_id, header):
+        """
+            Post only the issues that are new, reassigned or closed since
+            the last run. The last sync time and the issues seen are kept
+            in the state store, the first run posts the full list
+            :param name: Notification name, state store key prefix
+            :param jira_query: Jira query
+            :param room_id: Webex room ID
+            :param header: Message header
+        """
+        state_store = self.generic_wrapper.state_store
+        watermark_key = "notifier:{}:watermark".format(name)
+        issues_key = "notifier:{}:issues".format(name)
+        sync_time = time.time()
+        watermark = state_store.get(watermark_key)
+        if watermark is None or state_store.get("notifier:{}:query".format(name)) != jira_query:
+            self.logger.info("No previous sync for {}, posting the full list".format(name))
+            issues = self.run_query(jira_query, self.jira_wrapper.MESSAGE_FIELDS)
+            if issues is None:
+                return
+            self.send_rows(self.jira_wrapper.formulate_message_rows(text_data = header, issues = issues,
+                                                                    jira_server_url = self.jira_server_url),
+                           room_id)
+            seen_issues = dict((str(issue.key), self.summarize_issue(issue)) for issue in issues)
+        else:
+            seen_issues = json.loads(state_store.get(issues_key, "{}"))
+            # Relative to the JIRA server clock, an absolute date would be
+            # read in the timezone of the JIRA user profile, not the host's
+            since = "-{}m".format(int(math.ceil((sync_time - float(watermark) + self.WATERMARK_OVERLAP) / 60.0)))
+            self.logger.info("Getting changes of {} since {}".format(name, since))
+            updated_issues = self.run_query('({}) AND updated >= "{}"'.format(jira_query, since),
+                                            self.jira_wrapper.MESSAGE_FIELDS)
+            if updated_issues is None:
+                return
+            new_issues = []
+            reassigned_issues = []
+            for issue in updated_issues:
+                key = str(issue.key)
+                summary = self.summarize_issue(issue)
+                if key not in seen_issues:
+                    new_issues.append((key, summary))
+                elif seen_issues[key]["assignee"] != summary["assignee"]:
+                    reassigned_issues.append((key, summary, seen_issues[key]["assignee"]))
+                seen_issues[key] = summary
+            # Issues seen before and updated since are out of the query
+            # result now if they were closed
+            closed_issues = []
+            keys = sorted(set(seen_issues) - set(str(issue.key) for issue in updated_issues))
+            for start in range(0, len(keys), self.KEY_BATCH_SIZE):
+                batch = keys[start:start + self.KEY_BATCH_SIZE]
+                try:
+                    left_issues = self.run_query('issuekey in ({}) AND updated >= "{}" AND NOT ({})'
+                                                 .format(",".join(batch), since, jira_query),
+                                                 self.jira_wrapper.MESSAGE_FIELDS + ",status",
+                                                 raise_not_found=True)
+                except JiraIssueNotFound:
+                    # JIRA rejects the whole query if one of the keys was
+                    # deleted or moved, retrying the batch key by key
+                    self.logger.warning("Checking {} issues of {} one by one".format(len(batch), name))
+                    left_issues = []
+                    for key in batch:
+                        try:
+                            issues = self.run_query('issuekey = {} AND updated >= "{}" AND NOT ({})'
+                                                    .format(key, since, jira_query),
+                                                    self.jira_wrapper.MESSAGE_FIELDS + ",status",
+                                                    raise_not_found=True)
+                        except JiraIssueNotFound:
+                            closed_issues.append((key, seen_issues.pop(key), "Deleted or moved"))
+                            continue
+                        if issues is None:
+                            return
+                        if issues:
+                            closed_issues.append((key, seen_issues.pop(key), str(issues[0].fields.status)))
+                if left_issues is None:
+                    # JIRA is unavailable, nothing is saved so that the run
+                    # is retried next time from the same watermark
+                    return
+                for issue in left_issues:
+                    # Moved issues come back under a key that was not seen
+                    key = str(issue.key)
+                    if key in seen_issues:
+                        closed_issues.append((key, seen_issues.pop(key), str(issue.fields.status)))
+            if new_issues or reassigned_issues or closed_issues:
+                self.send_rows(self.jira_wrapper.formulate_diff_rows(header, new_issues, reassigned_issues,
+                                                                     closed_issues, self.jira_server_url),
+                               room_id)
+            else:
+                self.logger.info("No changes for {}".format(name))
+        state_store.set(issues_key, json.dumps(seen_issues))
+        state_store.set("notifier:{}:query".format(name), jira_query)
+        state_store.set(watermark_key, str(sync_time))
+
+
     def start_script(self):
         """
             Starter method for periodic bug notifier utility
         """
-        self.open_issues = self.jira_wrapper.run_jira_query(jira_object = self.jira_object,
-                                                            jira_query = self.fixed_jira_query)
-        self.data_to_send = self.jira_wrapper.formulate_message_to_send(room_id = self.webex_room_id,
-                                                                        text_data = self.string_header_with_response,
-                                                                        issues = self.open_issues,
-                                                                        jira_server_url=self.jira_server_url,
-                                                                        jira_object=self.jira_object)
-        self.webex_wrapper.send_message_to_webex_group(webex_url = self.webex_url,
-                                                       webex_auth_headers = self.webex_auth_headers,
-                                                       data_to_send = self.data_to_send)
+        if self.incremental:
+            self.notify_changes("fixed_jira_query", self.fixed_jira_query, self.webex_room_id,
+                                self.string_header_with_response)
+        else:
+            self.notify_full_list(self.fixed_jira_query, self.webex_room_id, self.string_header_with_response)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,5 @@
 #!/bin/sh
 
-read_time_interval=$(grep 'chat_bot_read_time_interval:' information.yaml | tail -n1 | awk '{ print $2}')
-
-while true; do
-  python chat_bot_utility.py;
-  sleep $read_time_interval;
-done
+# Runs the chat bot as a resident daemon, polling interval is read from
+# information.yaml (general_details:chat_bot_read_time_interval)
+exec python chat_bot_utility.py --daemon
@@ -0,0 +1,127 @@
+import sys
+import hmac
+import json
+import hashlib
+import argparse
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPError
+
+from lib.WebhookReceiver import WebhookReceiver
+
+
+
+class WebhookFakeSender:
+    def __init__(self, url, secret=None):
+        """
+            Init Method
+            :param url: Webhook receiver URL
+            :param secret: Webhook secret used to sign the payload
+        """
+        self.url = url
+        self.secret = secret
+
+
+    def formulate_sample_payload(self, message_id, room_id, person_id):
+        """
+            Formulate a sample Webex "messages created" webhook payload
+            :param message_id: Webex message ID
+            :param room_id: Webex room ID
+            :param person_id: Webex person ID
+            :return: Payload dictionary
+        """
+        return {"id": "FAKE_WEBHOOK_ID",
+                "name": "chatbot fake webhook",
+                "resource": "messages",
+                "event": "created",
+                "filter": "roomId={}&mentionedPeople=me".format(room_id),
+                "data": {"id": message_id,
+                         "roomId": room_id,
+                         "personId": person_id,
+                         "created": "2019-12-19T02:57:08.044Z"}}
+
+
+    def post_payload(self, payload, signature=None):
+        """
+            Post the payload to the webhook receiver the way Webex does
+            :param payload: Payload dictionary
+            :param signature: X-Spark-Signature to send instead of the one
+                              computed with the secret
+            :return: HTTP status code
+        """
+        body = json.dumps(payload).encode('utf8')
+        headers = {'content-type': 'application/json'}
+        if signature is None and self.secret:
+            signature = hmac.new(self.secret.encode('utf8'), body, hashlib.sha1).hexdigest()
+        if signature:
+            headers['X-Spark-Signature'] = signature
+        try:
+            response = urlopen(Request(self.url, data=body, headers=headers))
+        except HTTPError as e:
+            return e.code
+        return response.getcode()
+
+
+
+def self_check(port=18012):
+    """
+        Runs a local webhook receiver with a recording callback and checks
+        signature validation, duplicate and event filtering and delivery
+        order, without the Webex API
+        :param port: Port for the local receiver
+        :return: True if every check passed
+    """
+    received = []
+    receiver = WebhookReceiver(callback=lambda data: received.append(data["id"]), host="127.0.0.1",
+                               port=port, path="/webhook", secret="SELF_CHECK_SECRET")
+    if not receiver.start():
+        print("FAILED to start the webhook receiver on port {}".format(port))
+        return False
+    url = "http://127.0.0.1:{}/webhook".format(port)
+    sender = WebhookFakeSender(url, "SELF_CHECK_SECRET")
+    unsigned_sender = WebhookFakeSender(url)
+    other_event = sender.formulate_sample_payload("MESSAGE_X", "ROOM", "PERSON")
+    other_event["event"] = "deleted"
+    checks = [("unsigned payload is rejected",
+               unsigned_sender.post_payload(sender.formulate_sample_payload("MESSAGE_X", "ROOM", "PERSON")), 401),
+              ("payload with a bad signature is rejected",
+               sender.post_payload(sender.formulate_sample_payload("MESSAGE_X", "ROOM", "PERSON"),
+                                   signature="0" * 40), 401),
+              ("signed payload is accepted",
+               sender.post_payload(sender.formulate_sample_payload("MESSAGE_1", "ROOM", "PERSON")), 200),
+              ("second message is accepted",
+               sender.post_payload(sender.formulate_sample_payload("MESSAGE_2", "ROOM", "PERSON")), 200),
+              ("duplicate delivery is acknowledged",
+               sender.post_payload(sender.formulate_sample_payload("MESSAGE_1", "ROOM", "PERSON")), 200),
+              ("other events are acknowledged", sender.post_payload(other_event), 200)]
+    receiver.stop()
+    checks.append(("only new messages reach the callback, in order", received, ["MESSAGE_1", "MESSAGE_2"]))
+    passed = True
+    for description, actual, expected in checks:
+        ok = actual == expected
+        passed = passed and ok
+        print("{} {} (expected {}, got {})".format("PASS" if ok else "FAIL", description, expected, actual))
+    return passed
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Posts sample webhook payloads to the local webhook receiver")
+    parser.add_argument("--url", default="http://127.0.0.1:8012/webhook")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--room-id", default="WEBEX_ROOM_ID")
+    parser.add_argument("--person-id", default="PERSON_ID")
+    parser.add_argument("--self-check", action="store_true",
+                        help="Check the webhook receiver against a local instance and exit")
+    parser.add_argument("message_ids", nargs="*", help="Webex message IDs to announce")
+    args = parser.parse_args()
+    if args.self_check:
+        sys.exit(0 if self_check() else 1)
+    if not args.message_ids:
+        parser.error("message_ids are required unless --self-check is given")
+    sender = WebhookFakeSender(args.url, args.secret)
+    for message_id in args.message_ids:
+        status = sender.post_payload(sender.formulate_sample_payload(message_id, args.room_id, args.person_id))
+        print("{} --> {}".format(message_id, status))